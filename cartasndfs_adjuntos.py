@@ -0,0 +1,97 @@
+"""
+Índice de adjuntos recolectados por contenido
+Cada archivo guardado por la recolección queda registrado con su SHA-256; si el
+mismo PDF llega otra vez (un reenvío, una ventana de fechas que se solapa) no se
+guarda de nuevo y queda registrado como enlace al archivo existente, así no se
+vuelve a pasar por OCR ni por el LLM
+"""
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from cartasndfs_cache import hash_file
+
+
+class IndiceAdjuntos:
+    """Archivo JSON lines con un registro por archivo guardado o descartado por duplicado"""
+
+    def __init__(self, path, base_dir):
+        """
+        Carga el índice
+
+        Args:
+            path: Archivo .jsonl del índice; si existe se agregan líneas al final
+            base_dir: Carpeta base de la recolección; las rutas se guardan relativas a ella
+        """
+        self.path = Path(path)
+        self.base_dir = Path(base_dir)
+        self._archivos: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        registro = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Última línea cortada por una caída: se ignora
+                        continue
+                    if "duplicado_de" not in registro:
+                        self._archivos[registro["hash"]] = registro["archivo"]
+
+    def _relative(self, path: Path) -> str:
+        try:
+            return str(Path(path).relative_to(self.base_dir))
+        except ValueError:
+            return str(path)
+
+    def lookup(self, file_hash: str) -> Optional[Path]:
+        """
+        Archivo ya recolectado con ese contenido
+
+        Returns:
+            Path: Ruta del archivo, o None si no hay uno o ya no existe en disco
+        """
+        archivo = self._archivos.get(file_hash)
+        if archivo is None:
+            return None
+        path = self.base_dir / archivo
+        return path if path.exists() else None
+
+    def _append(self, registro: dict) -> None:
+        registro["fecha"] = datetime.now().isoformat(timespec="seconds")
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+    def add(self, file_path: Path, origen: str = "", file_hash: Optional[str] = None) -> str:
+        """
+        Registra un archivo recién guardado
+
+        Args:
+            file_path: Archivo ya escrito en disco
+            origen: Mensaje o descarga de donde vino
+            file_hash: SHA-256 del archivo, si ya se calculó
+
+        Returns:
+            str: SHA-256 del archivo
+        """
+        file_hash = file_hash or hash_file(file_path)
+        with self._lock:
+            self._archivos[file_hash] = self._relative(file_path)
+            self._append({"hash": file_hash, "archivo": self._relative(file_path), "origen": origen})
+        return file_hash
+
+    def link(self, filename: str, existente: Path, file_hash: str, origen: str = "") -> None:
+        """
+        Registra un duplicado descartado como enlace al archivo existente
+
+        Args:
+            filename: Nombre con el que llegó el duplicado
+            existente: Archivo ya recolectado con el mismo contenido (ver lookup)
+            file_hash: SHA-256 del contenido
+            origen: Mensaje o descarga de donde vino
+        """
+        with self._lock:
+            self._append({"hash": file_hash, "archivo": filename, "origen": origen,
+                          "duplicado_de": self._relative(existente)})
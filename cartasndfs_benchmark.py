@@ -0,0 +1,858 @@
+"""
+Benchmark de extracción de cartas NDF, ejecutable sin red en Linux
+Genera un corpus sintético con un PDF por cada rama de extract_text_from_pdf,
+levanta un servidor local que imita la API de Ollama y mide cada etapa; la
+recolección se mide con un buzón de archivos .eml y un servidor que imita el
+portal de confirmaciones JPM
+
+Uso:
+    python cartasndfs_benchmark.py --docs-por-tipo 3 --workers 4 --salida bench.json
+"""
+import io
+import sys
+import json
+import time
+import random
+import secrets
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import contextlib
+import importlib.util
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import format_datetime
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+import fitz
+import numpy as np
+from PIL import Image
+
+CLAVE_BANCOLOMBIA = "830122566"
+
+PARRAFO_LEGAL = (
+    "This Confirmation supplements, forms part of, and is subject to the Master Agreement "
+    "between the parties. All provisions contained in the Master Agreement govern this "
+    "Confirmation except as expressly modified below. Las partes declaran que la operación "
+    "se rige por las condiciones generales del contrato marco suscrito entre ellas. "
+)
+
+
+# ---------------------------------------------------------------------------
+# Corpus sintético
+# ---------------------------------------------------------------------------
+
+def _random_trade(rng):
+    """Genera los valores de una operación forward"""
+    fecha = f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.choice([2024, 2025])}"
+    tasa = round(rng.uniform(3800, 4600), 2)
+    nominal = rng.choice([250000, 500000, 1000000, 2000000, 3500000])
+    return {"fecha_inicio": fecha, "tasa_fwd": tasa, "valor_nominal_usd": nominal}
+
+
+def _letter_lines(banco, trade, idioma):
+    """Texto de una carta de confirmación en inglés o español"""
+    dia, mes, anio = trade["fecha_inicio"].split("/")
+    if idioma == "english":
+        meses = ["January", "February", "March", "April", "May", "June", "July",
+                 "August", "September", "October", "November", "December"]
+        return [
+            f"{banco}",
+            "NON-DELIVERABLE FX FORWARD CONFIRMATION",
+            "Counterparty: COLOMBIA TELECOMUNICACIONES S.A. E.S.P. BIC",
+            f"Trade Date: {int(dia)} {meses[int(mes) - 1]} {anio}",
+            f"Reference Currency Notional Amount: USD {trade['valor_nominal_usd']:,.2f}",
+            f"Forward Rate: {trade['tasa_fwd']:,.2f} COP/USD",
+            "Settlement Currency: USD",
+            "Valuation Date: 15 days after Trade Date",
+        ]
+    tasa = f"{trade['tasa_fwd']:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    nominal = f"{trade['valor_nominal_usd']:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    return [
+        f"{banco}",
+        "CONFIRMACIÓN DE OPERACIÓN FORWARD NDF",
+        "Contraparte: COLOMBIA TELECOMUNICACIONES S.A. E.S.P. BIC",
+        f"Fecha de Celebración: {trade['fecha_inicio']}",
+        f"Valor Nominal: USD {nominal}",
+        f"Tasa Forward: $ {tasa}",
+        "Modalidad: Non Delivery",
+        "Fecha de Cumplimiento: 30 días calendario",
+    ]
+
+
+def _text_pdf(lines, paginas_relleno=0):
+    """PDF digital con capa de texto; los datos quedan en la última página"""
+    doc = fitz.open()
+    for _ in range(paginas_relleno):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(60, 60, 550, 760), PARRAFO_LEGAL * 6, fontsize=10)
+    page = doc.new_page()
+    page.insert_textbox(fitz.Rect(60, 60, 550, 400), "\n".join(lines), fontsize=11)
+    page.insert_textbox(fitz.Rect(60, 420, 550, 760), PARRAFO_LEGAL * 3, fontsize=9)
+    return doc
+
+
+def _scanned_pdf(lines, rng, dpi=200, paginas=2):
+    """PDF escaneado: páginas renderizadas como imagen con ruido y leve inclinación, sin capa de texto"""
+    origen = _text_pdf(lines, paginas_relleno=paginas - 1)
+    doc = fitz.open()
+    for page in origen:
+        pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+        image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+        pixels = np.asarray(image, dtype=np.int16)
+        ruido = np.random.default_rng(rng.randint(0, 2**31)).normal(0, 12, pixels.shape)
+        image = Image.fromarray(np.clip(pixels + ruido, 0, 255).astype(np.uint8))
+        image = image.rotate(rng.uniform(-1.0, 1.0), fillcolor=255, expand=False)
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=80)
+        nueva = doc.new_page(width=page.rect.width, height=page.rect.height)
+        nueva.insert_image(nueva.rect, stream=buffer.getvalue())
+    origen.close()
+    return doc
+
+
+def generate_corpus(output_dir, docs_por_tipo=2, seed=7):
+    """
+    Genera confirmaciones sintéticas para cada rama de extract_text_from_pdf
+
+    Args:
+        output_dir: Carpeta donde se escriben los PDFs
+        docs_por_tipo: Documentos por tipo
+        seed: Semilla para que el corpus sea reproducible
+
+    Returns:
+        list: Dicts {"archivo", "tipo", "paginas", "esperado"} por documento
+    """
+    rng = random.Random(seed)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    corpus = []
+
+    for i in range(docs_por_tipo):
+        documentos = []
+
+        trade = _random_trade(rng)
+        doc = _text_pdf(_letter_lines("JPMorgan Chase Bank, N.A.", trade, "english"), paginas_relleno=1)
+        documentos.append(("jpm_texto", f"Confirmation-AE2025{rng.randint(10**9, 10**10 - 1)}.pdf", doc, {}, trade))
+
+        trade = _random_trade(rng)
+        doc = _text_pdf(_letter_lines("BANCOLOMBIA S.A.", trade, "spanish"))
+        # Cifrado con contraseña de usuario, como las cartas de Bancolombia; lo abre DocumentoPDF
+        cifrado = {"encryption": fitz.PDF_ENCRYPT_RC4_128, "user_pw": CLAVE_BANCOLOMBIA,
+                   "owner_pw": CLAVE_BANCOLOMBIA}
+        documentos.append(("bancolombia_cifrado", f"2025-07-{10 + i:02d}_COLOMBIA TELECO.pdf", doc, cifrado, trade))
+
+        trade = _random_trade(rng)
+        doc = _scanned_pdf(_letter_lines("SCOTIABANK COLPATRIA S.A.", trade, "spanish"), rng)
+        documentos.append(("scotiabank_escaneado", f"{rng.randint(10**6, 10**7 - 1)}.pdf", doc, {}, trade))
+
+        trade = _random_trade(rng)
+        doc = _scanned_pdf(_letter_lines("ITAÚ COLOMBIA S.A.", trade, "spanish"), rng)
+        documentos.append(("itau_escaneado", f"CTA_NDFV_FW_{i:04d}.pdf", doc, {}, trade))
+
+        trade = _random_trade(rng)
+        banco = rng.choice(["BANCO DE OCCIDENTE", "BANCO SANTANDER", "CITIBANK COLOMBIA"])
+        doc = _text_pdf(_letter_lines(banco, trade, "spanish"))
+        documentos.append(("otro_banco_texto", f"Confirmacion operacion {i:03d}.pdf", doc, {}, trade))
+
+        trade = _random_trade(rng)
+        doc = _scanned_pdf(_letter_lines("CORFICOLOMBIANA", trade, "spanish"), rng, paginas=1)
+        documentos.append(("otro_banco_escaneado", f"Carta forward {i:03d}.pdf", doc, {}, trade))
+
+        for tipo, nombre, doc, opciones, esperado in documentos:
+            path = output_dir / nombre
+            paginas = doc.page_count
+            doc.save(str(path), **opciones)
+            doc.close()
+            corpus.append({"archivo": nombre, "tipo": tipo, "paginas": paginas, "esperado": esperado})
+
+    return corpus
+
+
+# Etiqueta que antecede al valor de cada campo en las cartas en español del corpus
+ETIQUETAS_PLANTILLA = {
+    "fecha_inicio": "Fecha de Celebración:",
+    "valor_nominal_usd": "Valor Nominal: USD",
+    "tasa_fwd": "Tasa Forward: $",
+}
+
+
+def synthetic_template(nombre, desplazamiento_lineas=0):
+    """
+    Plantilla para las cartas escaneadas en español del corpus, medida sobre el mismo
+    diseño con que _text_pdf las genera: cada región va desde el final de la etiqueta
+    hasta donde cabe el valor más largo, con margen para la inclinación del escaneo
+
+    Args:
+        nombre: Nombre de la plantilla
+        desplazamiento_lineas: Líneas que se corren las regiones hacia abajo (para
+            probar que una plantilla mal medida se descarta)
+
+    Returns:
+        Plantilla: Regiones en la última página, con la verificación por defecto
+    """
+    from cartasndfs_plantillas import CARACTERES_FECHA, CARACTERES_NUMERO, Plantilla, Region
+
+    trade = {"fecha_inicio": "01/01/2025", "tasa_fwd": 4000.0, "valor_nominal_usd": 1000000}
+    doc = _text_pdf(_letter_lines("BANCO", trade, "spanish"))
+    try:
+        page = doc[-1]
+        regiones = []
+        for campo, etiqueta in ETIQUETAS_PLANTILLA.items():
+            rect = page.search_for(etiqueta)[0]
+            dy = rect.height * desplazamiento_lineas
+            whitelist = CARACTERES_FECHA if campo == "fecha_inicio" else CARACTERES_NUMERO
+            regiones.append(Region(campo, -1, (rect.x1 + 1, rect.y0 - 4 + dy, rect.x1 + 120, rect.y1 + 4 + dy),
+                                   whitelist=whitelist))
+    finally:
+        doc.close()
+    return Plantilla(nombre, regiones)
+
+
+# ---------------------------------------------------------------------------
+# Servidor que imita la API de Ollama
+# ---------------------------------------------------------------------------
+
+class OllamaStub:
+    """
+    Servidor HTTP local con /api/generate, /api/ps y /api/tags
+
+    Simula el costo del modelo en función de los tokens (~4 caracteres por token)
+    y la caché de prompt: si el "system" es el mismo de la llamada anterior,
+    prompt_eval_count solo cuenta los tokens del prompt.
+    """
+
+    def __init__(self, ms_por_token_prompt=0.05, ms_por_token_generado=2.0, segundos_carga=0.2):
+        self.ms_por_token_prompt = ms_por_token_prompt
+        self.ms_por_token_generado = ms_por_token_generado
+        self.segundos_carga = segundos_carga
+        self.cargado = False
+        self.ultimo_system = None
+        self.lock = threading.Lock()
+        self.llamadas = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="ollama-stub", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _answer(self, prompt):
+        """Respuesta plausible: los campos que se puedan leer del texto, null el resto"""
+        from cartasndfs_extractores import extract_fields
+        campos = extract_fields(prompt, "")
+        return json.dumps(campos)
+
+    def _generate(self, body):
+        """Calcula la respuesta y las métricas de una llamada a /api/generate"""
+        carga = 0.0
+        with self.lock:
+            if not self.cargado:
+                time.sleep(self.segundos_carga)
+                carga = self.segundos_carga
+                self.cargado = True
+            prompt = body.get("prompt", "")
+            system = body.get("system", "")
+            tokens_prompt = len(prompt) // 4 + 1
+            if system and system != self.ultimo_system:
+                tokens_prompt += len(system) // 4
+            self.ultimo_system = system or self.ultimo_system
+            self.llamadas += 1
+
+        if not prompt:
+            return "", {"load_duration": int(carga * 1e9), "total_duration": int(carga * 1e9)}
+
+        respuesta = self._answer(prompt)
+        max_tokens = body.get("options", {}).get("num_predict", 256)
+        tokens = [respuesta[i:i + 4] for i in range(0, len(respuesta), 4)][:max_tokens]
+        eval_prompt = tokens_prompt * self.ms_por_token_prompt / 1000
+        time.sleep(eval_prompt)
+        stats = {
+            "load_duration": int(carga * 1e9),
+            "prompt_eval_count": tokens_prompt,
+            "prompt_eval_duration": int(eval_prompt * 1e9),
+            "eval_count": len(tokens),
+            "eval_duration": int(len(tokens) * self.ms_por_token_generado * 1e6),
+        }
+        stats["total_duration"] = stats["load_duration"] + stats["prompt_eval_duration"] + stats["eval_duration"]
+        return tokens, stats
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, data):
+                payload = json.dumps(data).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path == "/api/ps":
+                    modelos = [{"name": "llama3.2:3b", "model": "llama3.2:3b"}] if stub.cargado else []
+                    self._send_json({"models": modelos})
+                elif self.path == "/api/tags":
+                    self._send_json({"models": [{"name": "llama3.2:3b", "model": "llama3.2:3b"}]})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                if self.path != "/api/generate":
+                    self.send_error(404)
+                    return
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                tokens, stats = stub._generate(body)
+                base = {"model": body.get("model"), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ")}
+
+                if not body.get("stream", True):
+                    time.sleep(len(tokens) * stub.ms_por_token_generado / 1000)
+                    self._send_json(dict(base, response="".join(tokens), done=True, **stats))
+                    return
+
+                # Streaming NDJSON; la conexión se cierra al terminar (HTTP/1.0)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                try:
+                    for token in tokens:
+                        time.sleep(stub.ms_por_token_generado / 1000)
+                        self.wfile.write((json.dumps(dict(base, response=token, done=False)) + "\n").encode("utf-8"))
+                        self.wfile.flush()
+                    self.wfile.write((json.dumps(dict(base, response="", done=True, **stats)) + "\n").encode("utf-8"))
+                except (BrokenPipeError, ConnectionResetError):
+                    # El cliente cortó la generación al cerrarse el JSON
+                    pass
+
+        return Handler
+
+
+# ---------------------------------------------------------------------------
+# Servidor que imita el portal de confirmaciones JPM
+# ---------------------------------------------------------------------------
+
+class PortalJPMStub:
+    """
+    Servidor HTTP local con el flujo del portal de confirmaciones JPM
+
+    GET /confirmation/<id> devuelve un formulario estilo ASP.NET (campos ocultos,
+    cookie de sesión, ctl00$Main$txtAccessCode); con el código correcto aparece el
+    enlace Q416_downloadspecific, que descarga el PDF por __doPostBack.
+    """
+
+    OBJETIVO_DESCARGA = "ctl00$Main$lnkDownload"
+
+    def __init__(self, ms_por_pagina=30):
+        self.ms_por_pagina = ms_por_pagina
+        self.confirmaciones = {}
+        self.sesiones = {}
+        self.lock = threading.Lock()
+        self.descargas = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="portal-jpm-stub", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add(self, conf_id, codigo, nombre, data):
+        """Publica una confirmación y devuelve el enlace que iría en el correo"""
+        self.confirmaciones[conf_id] = (codigo, nombre, data)
+        return f"{self.url}/confirmation/{conf_id}"
+
+    @staticmethod
+    def _page(conf_id, viewstate, con_enlace=False, error=""):
+        enlace = (f'<a id="ctl00_Main_lnkDownload" class="Q416_downloadspecific" '
+                  f'href="javascript:__doPostBack(\'{PortalJPMStub.OBJETIVO_DESCARGA}\',\'\')">Download</a>'
+                  if con_enlace else "")
+        return f"""<html><body>
+<form name="aspnetForm" method="post" action="/confirmation/{conf_id}" id="aspnetForm">
+<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />
+<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="" />
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{viewstate}" />
+<span class="error">{error}</span>
+<input name="ctl00$Main$txtAccessCode" type="text" id="txtAccessCode" />
+<input type="submit" name="ctl00$Main$btnSubmit" value="Submit" id="ctl00_Main_btnSubmit" />
+{enlace}
+</form></body></html>"""
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, payload, content_type="text/html; charset=utf-8", headers=None):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _conf_id(self):
+                partes = self.path.strip("/").split("/")
+                if len(partes) == 2 and partes[0] == "confirmation" and partes[1] in stub.confirmaciones:
+                    return partes[1]
+                return None
+
+            def _session_id(self):
+                for cookie in (self.headers.get("Cookie") or "").split(";"):
+                    name, _, value = cookie.strip().partition("=")
+                    if name == "ASP.NET_SessionId":
+                        return value
+                return None
+
+            def do_GET(self):
+                time.sleep(stub.ms_por_pagina / 1000)
+                conf_id = self._conf_id()
+                if conf_id is None:
+                    self.send_error(404)
+                    return
+                session_id, viewstate = secrets.token_hex(12), secrets.token_urlsafe(24)
+                with stub.lock:
+                    stub.sesiones[session_id] = {"viewstate": viewstate, "conf_id": conf_id, "autorizada": False}
+                self._send(stub._page(conf_id, viewstate).encode("utf-8"),
+                           headers={"Set-Cookie": f"ASP.NET_SessionId={session_id}; path=/; HttpOnly"})
+
+            def do_POST(self):
+                time.sleep(stub.ms_por_pagina / 1000)
+                conf_id = self._conf_id()
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+                campos = {k: v[0] for k, v in parse_qs(body, keep_blank_values=True).items()}
+                with stub.lock:
+                    sesion = stub.sesiones.get(self._session_id())
+                if conf_id is None or sesion is None or sesion["conf_id"] != conf_id \
+                        or campos.get("__VIEWSTATE") != sesion["viewstate"]:
+                    self.send_error(403, "Sesión inválida")
+                    return
+                codigo, nombre, data = stub.confirmaciones[conf_id]
+
+                if campos.get("__EVENTTARGET") == stub.OBJETIVO_DESCARGA:
+                    if not sesion["autorizada"]:
+                        self.send_error(403, "Código no verificado")
+                        return
+                    with stub.lock:
+                        stub.descargas += 1
+                    self._send(data, "application/pdf",
+                               {"Content-Disposition": f'attachment; filename="{nombre}"'})
+                    return
+
+                sesion["viewstate"] = secrets.token_urlsafe(24)
+                if campos.get("ctl00$Main$txtAccessCode") == codigo:
+                    sesion["autorizada"] = True
+                    self._send(stub._page(conf_id, sesion["viewstate"], con_enlace=True).encode("utf-8"))
+                else:
+                    self._send(stub._page(conf_id, sesion["viewstate"], error="Invalid code").encode("utf-8"))
+
+        return Handler
+
+
+def generate_mailbox(output_dir, corpus_dir, corpus, portal, seed=7):
+    """
+    Genera un buzón .eml con el corpus: correos JPM con enlace y código (publicados en
+    el portal de prueba), cartas adjuntas, un reenvío duplicado y un correo sin nada que procesar
+
+    Returns:
+        dict: Conteos esperados {"mensajes", "adjuntos", "duplicados", "jpm"}
+    """
+    rng = random.Random(seed)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    ahora = datetime.now().astimezone()
+    conteo = {"mensajes": 0, "adjuntos": 0, "duplicados": 0, "jpm": 0}
+
+    def write(asunto, cuerpo, adjunto=None):
+        mensaje = EmailMessage()
+        mensaje["Subject"] = asunto
+        mensaje["From"] = "confirmaciones@banco.example"
+        mensaje["Date"] = format_datetime(ahora - timedelta(minutes=60 - conteo["mensajes"] % 60))
+        mensaje.set_content(cuerpo)
+        if adjunto is not None:
+            mensaje.add_attachment((corpus_dir / adjunto).read_bytes(), maintype="application",
+                                   subtype="pdf", filename=adjunto)
+        conteo["mensajes"] += 1
+        (output_dir / f"{conteo['mensajes']:04d}.eml").write_bytes(bytes(mensaje))
+
+    for documento in corpus:
+        if documento["tipo"] == "jpm_texto":
+            conf_id = Path(documento["archivo"]).stem.replace("Confirmation-", "")
+            codigo = "".join(rng.choice("ABCDEFGHJKLMNPQRSTUVWXYZ23456789") for _ in range(8))
+            enlace = portal.add(conf_id, codigo, documento["archivo"], (corpus_dir / documento["archivo"]).read_bytes())
+            write(f"JPM Confirmation ID {conf_id}",
+                  f"Please use the link below to retrieve your confirmation.\n{enlace}\nVerification Code: {codigo}\n")
+            conteo["jpm"] += 1
+        else:
+            write(f"Confirmación operación forward - {documento['archivo']}", "Adjuntamos la confirmación.",
+                  documento["archivo"])
+            conteo["adjuntos"] += 1
+
+    adjuntos = [d["archivo"] for d in corpus if d["tipo"] != "jpm_texto"]
+    if adjuntos:
+        write(f"RV: Confirmación operación forward - {adjuntos[0]}", "Reenvío la confirmación.", adjuntos[0])
+        conteo["duplicados"] += 1
+    write("Boletín semanal de mercados", "Sin adjuntos.")
+    return conteo
+
+
+def run_collection(corpus_dir, corpus, trabajo_dir, workers=2, seed=7, verbose=False):
+    """
+    Mide la recolección (NDFProcessor) contra un buzón .eml y el portal JPM de prueba
+
+    Returns:
+        dict: Mensajes, adjuntos y descargas procesados, y tiempos; None si la recolección no se puede importar
+    """
+    import logging
+    try:
+        from cartasndfs_recoleccion import NDFProcessor
+        from cartasndfs_buzon import BuzonEml
+    except ImportError as e:
+        print(f"Aviso: se omite la recolección ({e})")
+        return None
+
+    if not verbose:
+        logging.getLogger("cartasndfs_recoleccion").setLevel(logging.WARNING)
+    portal = PortalJPMStub().start()
+    try:
+        buzon_dir = trabajo_dir / "buzon"
+        esperado = generate_mailbox(buzon_dir, corpus_dir, corpus, portal, seed)
+        processor = NDFProcessor(base_output_dir=str(trabajo_dir / "recoleccion"), buzon=BuzonEml(buzon_dir),
+                                 fecha_inicial=datetime.now() - timedelta(days=1), descargas_simultaneas=workers)
+        inicio = time.perf_counter()
+        processor._create_output_directory()
+        messages, start, end = processor._get_filtered_messages(processor.buzon)
+        adjuntos, descargas, _ = processor.process_messages(messages, start, end)
+        segundos = time.perf_counter() - inicio
+    finally:
+        portal.stop()
+    return {
+        "mensajes": len(messages),
+        "adjuntos": adjuntos,
+        "adjuntos_esperados": esperado["adjuntos"],
+        "duplicados_omitidos": esperado["adjuntos"] + esperado["duplicados"] - adjuntos,
+        "descargas_jpm": descargas,
+        "descargas_portal": portal.descargas,
+        "segundos": round(segundos, 3),
+        "ms_por_mensaje": round(segundos * 1000 / max(1, len(messages)), 1),
+    }
+
+
+def check_quarantine(trabajo_dir, max_intentos=3):
+    """
+    Verifica la cuarentena de la marca de agua con un buzón .eml: un correo JPM con un
+    código que el portal rechaza (como uno vencido) se reintenta max_intentos corridas,
+    pasa a cuarentena y deja de detener la marca; la corrida siguiente ya no lo pide
+
+    Returns:
+        dict: {"corridas", "reintentos_portal", "ultima_avanzo"}; None si la recolección no se puede importar
+
+    Raises:
+        AssertionError: Si la marca o la cuarentena no se comportan así
+    """
+    import logging
+    try:
+        from cartasndfs_recoleccion import NDFProcessor
+        from cartasndfs_buzon import BuzonEml
+    except ImportError as e:
+        print(f"Aviso: se omite la verificación de la cuarentena ({e})")
+        return None
+
+    logging.getLogger("cartasndfs_recoleccion").setLevel(logging.CRITICAL)
+    portal = PortalJPMStub(ms_por_pagina=0).start()
+    try:
+        buzon_dir = trabajo_dir / "buzon_cuarentena"
+        buzon_dir.mkdir(parents=True)
+        # La fecha del .eml no lleva microsegundos
+        ahora = datetime.now().astimezone().replace(microsecond=0)
+        enlace = portal.add("AE2025000000001", "CODIGOOK", "Confirmation-AE2025000000001.pdf", b"%PDF-1.4\n%%EOF\n")
+        correos = [
+            ("JPM Confirmation ID AE2025000000001",
+             f"Please use the link below.\n{enlace}\nVerification Code: VENCIDO1\n", ahora - timedelta(hours=2)),
+            ("Boletín semanal de mercados", "Sin adjuntos.", ahora - timedelta(hours=1)),
+        ]
+        for i, (asunto, cuerpo, fecha) in enumerate(correos, 1):
+            mensaje = EmailMessage()
+            mensaje["Subject"] = asunto
+            mensaje["Date"] = format_datetime(fecha)
+            mensaje.set_content(cuerpo)
+            (buzon_dir / f"{i:04d}.eml").write_bytes(bytes(mensaje))
+        vencido = ahora.replace(tzinfo=None) - timedelta(hours=2)
+        boletin = ahora.replace(tzinfo=None) - timedelta(hours=1)
+
+        peticiones = []
+        for corrida in range(1, max_intentos + 2):
+            processor = NDFProcessor(base_output_dir=str(trabajo_dir / "recoleccion_cuarentena"),
+                                     buzon=BuzonEml(buzon_dir), fecha_inicial=datetime.now() - timedelta(days=1))
+            processor.marca.max_intentos = max_intentos
+            antes = len(portal.sesiones)
+            assert processor.run(), f"La corrida {corrida} falló"
+            peticiones.append(len(portal.sesiones) - antes)
+            marca = processor.marca
+            if corrida < max_intentos:
+                assert marca.ultima <= vencido, f"Corrida {corrida}: la marca pasó del mensaje fallido"
+                assert list(marca.intentos.values()) == [corrida], f"Corrida {corrida}: intentos {marca.intentos}"
+            else:
+                assert len(marca.cuarentena) == 1 and not marca.intentos, \
+                    f"Corrida {corrida}: cuarentena {marca.cuarentena}, intentos {marca.intentos}"
+                assert marca.ultima >= boletin, f"Corrida {corrida}: la marca no avanzó tras la cuarentena"
+    finally:
+        portal.stop()
+    assert peticiones[:max_intentos] == [1] * max_intentos and peticiones[max_intentos] == 0, \
+        f"Peticiones al portal por corrida: {peticiones}"
+    return {"corridas": len(peticiones), "reintentos_portal": sum(peticiones), "ultima_avanzo": True}
+
+
+def run_templates(lectura, corpus_dir, corpus):
+    """
+    Ejercita el OCR por regiones (cartasndfs_plantillas.read_template) sobre las cartas
+    escaneadas de ITAÚ y Scotiabank con synthetic_template, y con la misma plantilla
+    corrida una línea. La primera debe leer los valores o descartarse, nunca dar uno
+    distinto; la corrida debe descartarse siempre y, con la plantilla registrada,
+    extract_with_template debe caer al OCR de la página completa
+
+    Returns:
+        dict: {"docs", "plantilla": conteos, "desplazada": conteos, "respaldo"}; conteos =
+            {"correctos", "descartados", "incorrectos"}
+
+    Raises:
+        AssertionError: Si alguna plantilla da un valor distinto del generado o el respaldo no se activa
+    """
+    import cartasndfs_plantillas as plantillas
+    from cartasndfs_metricas import Cronometro
+
+    documentos = [d for d in corpus if d["tipo"] in ("itau_escaneado", "scotiabank_escaneado")]
+    resultados = {"docs": len(documentos)}
+    for clave, desplazamiento in (("plantilla", 0), ("desplazada", 1)):
+        plantilla = synthetic_template(f"benchmark_{clave}", desplazamiento)
+        conteo = resultados[clave] = {"correctos": 0, "descartados": 0, "incorrectos": 0}
+        for documento in documentos:
+            campos, _ = plantillas.read_template(lectura.load_document(corpus_dir / documento["archivo"]),
+                                                 plantilla, motor=lectura.ocr_motor)
+            if campos is None:
+                conteo["descartados"] += 1
+            elif campos == documento["esperado"]:
+                conteo["correctos"] += 1
+            else:
+                conteo["incorrectos"] += 1
+        assert conteo["incorrectos"] == 0, f"La plantilla {plantilla.nombre} dio valores distintos: {conteo}"
+    assert resultados["desplazada"]["descartados"] == len(documentos), \
+        f"La plantilla desplazada no se descartó: {resultados['desplazada']}"
+
+    # Con la plantilla corrida registrada para el banco, la extracción vuelve a la página completa
+    if documentos:
+        documento = lectura.load_document(corpus_dir / documentos[0]["archivo"])
+        anterior = lectura.ocr_plantillas
+        plantillas.PLANTILLAS["BENCHMARK"] = synthetic_template("benchmark_desplazada", 1)
+        lectura.ocr_plantillas = True
+        try:
+            _, detalles, _, campos = lectura.extract_with_template(documento, "BENCHMARK", 300, Cronometro())
+        finally:
+            plantillas.PLANTILLAS.pop("BENCHMARK")
+            lectura.ocr_plantillas = anterior
+        assert campos is None and detalles["metodo_extraccion"] == "ocr", \
+            f"La extracción no volvió al OCR completo: {detalles}"
+        resultados["respaldo"] = detalles["metodo_extraccion"]
+    return resultados
+
+
+# ---------------------------------------------------------------------------
+# Medición
+# ---------------------------------------------------------------------------
+
+def peak_rss_mb():
+    """Memoria residente máxima del proceso y de sus hijos (ru_maxrss está en KB en Linux)"""
+    propio = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    hijos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return round(propio, 1), round(hijos, 1)
+
+
+def configure_pipeline(lectura, trabajo_dir, ollama_url):
+    """Apunta la configuración de cartasndfs_lectura_pdf a carpetas temporales y al stub"""
+    import pytesseract
+    pytesseract.pytesseract.tesseract_cmd = shutil.which("tesseract") or "tesseract"
+    lectura.input_dir = trabajo_dir / "entrada"
+    lectura.output_base_dir = trabajo_dir / "salida"
+    lectura.excel_output_dir = trabajo_dir / "salida"
+    lectura.cache_dir = trabajo_dir / "cache"
+    lectura.bitacora_path = trabajo_dir / "bitacora.sqlite3"
+    lectura.ollama_url = ollama_url
+
+
+def run_benchmark(docs_por_tipo=2, workers=2, seed=7, verbose=False):
+    """
+    Ejecuta el benchmark completo
+
+    Returns:
+        dict: Resultados por etapa, del pipeline completo y de memoria
+    """
+    import cartasndfs_lectura_pdf as lectura
+    from cartasndfs_extractores import extract_fields
+
+    hay_ocr = bool(shutil.which("tesseract") or importlib.util.find_spec("tesserocr"))
+    if not hay_ocr:
+        print("Aviso: no se encontró tesseract en el PATH; se omiten los PDFs escaneados")
+
+    stub = OllamaStub().start()
+    resultados = {"docs_por_tipo": docs_por_tipo, "workers": workers, "etapas": {}, "tipos": {}}
+    try:
+        with tempfile.TemporaryDirectory(prefix="ndf_bench_") as tmp:
+            trabajo_dir = Path(tmp)
+            corpus_dir = trabajo_dir / "corpus"
+            inicio = time.perf_counter()
+            corpus = generate_corpus(corpus_dir, docs_por_tipo, seed)
+            if not hay_ocr:
+                corpus = [d for d in corpus if "escaneado" not in d["tipo"]]
+            resultados["etapas"]["generacion_corpus_s"] = round(time.perf_counter() - inicio, 3)
+
+            configure_pipeline(lectura, trabajo_dir, stub.url)
+            salida = sys.stdout if verbose else io.StringIO()
+
+            # Etapa 1: extracción de texto, documento por documento (incluye la lectura del archivo)
+            textos = []
+            for documento in corpus:
+                inicio = time.perf_counter()
+                with contextlib.redirect_stdout(salida):
+                    text, banco, detalles = lectura.extract_text_from_pdf(str(corpus_dir / documento["archivo"]))
+                segundos = time.perf_counter() - inicio
+                tipo = resultados["tipos"].setdefault(documento["tipo"], {"docs": 0, "paginas": 0, "segundos": 0.0})
+                tipo["docs"] += 1
+                tipo["paginas"] += documento["paginas"]
+                tipo["segundos"] += segundos
+                textos.append((text, banco, detalles["campos_plantilla"]))
+            for tipo in resultados["tipos"].values():
+                tipo["segundos"] = round(tipo["segundos"], 3)
+                tipo["paginas_por_segundo"] = round(tipo["paginas"] / tipo["segundos"], 2) if tipo["segundos"] else None
+
+            # Etapa 2: regex (o campos de la plantilla), con la fracción de campos que coinciden
+            # con los valores generados
+            inicio = time.perf_counter()
+            campos = [plantilla or extract_fields(text, banco) for text, banco, plantilla in textos]
+            resultados["etapas"]["regex_ms_por_doc"] = round((time.perf_counter() - inicio) * 1000 / max(1, len(textos)), 3)
+            aciertos = sum(
+                leidos[campo] == documento["esperado"][campo]
+                for leidos, documento in zip(campos, corpus) for campo in leidos
+            )
+            resultados["etapas"]["regex_aciertos"] = round(aciertos / max(1, 3 * len(corpus)), 3)
+
+            # Etapa 3: LLM contra el stub
+            inicio = time.perf_counter()
+            for text, _, _ in textos:
+                lectura.extract_with_llm(lectura.clean_text(text))
+            resultados["etapas"]["llm_ms_por_doc"] = round((time.perf_counter() - inicio) * 1000 / max(1, len(textos)), 1)
+
+            # Pipeline completo con main()
+            lectura.input_dir.mkdir(parents=True)
+            for documento in corpus:
+                shutil.copy(corpus_dir / documento["archivo"], lectura.input_dir / documento["archivo"])
+            inicio = time.perf_counter()
+            with contextlib.redirect_stdout(salida):
+                lectura.main(workers=workers)
+            segundos = time.perf_counter() - inicio
+            paginas = sum(d["paginas"] for d in corpus)
+            resultados["pipeline"] = {
+                "docs": len(corpus),
+                "paginas": paginas,
+                "segundos": round(segundos, 3),
+                "paginas_por_segundo": round(paginas / segundos, 2),
+                "docs_por_hora": round(len(corpus) / segundos * 3600),
+            }
+
+            # OCR por regiones con una plantilla medida sobre el diseño del corpus
+            if hay_ocr:
+                inicio = time.perf_counter()
+                resultados["plantillas"] = run_templates(lectura, corpus_dir, corpus)
+                resultados["plantillas"]["segundos"] = round(time.perf_counter() - inicio, 3)
+
+            # Recolección desde un buzón .eml con el portal JPM de prueba
+            resultados["recoleccion"] = run_collection(corpus_dir, corpus, trabajo_dir, workers, seed, verbose)
+            resultados["cuarentena"] = check_quarantine(trabajo_dir)
+    finally:
+        stub.stop()
+
+    rss_propio, rss_hijos = peak_rss_mb()
+    resultados["rss_max_mb"] = {"proceso": rss_propio, "procesos_hijos": rss_hijos}
+    return resultados
+
+
+def print_report(resultados):
+    """Imprime los resultados en forma de tabla"""
+    print(f"\n=== Benchmark cartas NDF ({resultados['docs_por_tipo']} docs por tipo, "
+          f"{resultados['workers']} workers) ===")
+    print(f"{'Tipo':<24}{'Docs':>6}{'Págs':>6}{'s/doc':>9}{'págs/s':>9}")
+    for nombre, tipo in resultados["tipos"].items():
+        pps = tipo["paginas_por_segundo"] if tipo["paginas_por_segundo"] is not None else "-"
+        print(f"{nombre:<24}{tipo['docs']:>6}{tipo['paginas']:>6}{tipo['segundos'] / tipo['docs']:>9.3f}{pps:>9}")
+    etapas = resultados["etapas"]
+    print(f"\nRegex: {etapas['regex_ms_por_doc']} ms/doc ({etapas['regex_aciertos']:.0%} de campos correctos) | "
+          f"LLM (stub): {etapas['llm_ms_por_doc']} ms/doc")
+    pipeline = resultados["pipeline"]
+    print(f"Pipeline completo: {pipeline['docs']} docs en {pipeline['segundos']} s | "
+          f"{pipeline['paginas_por_segundo']} págs/s | {pipeline['docs_por_hora']} docs/hora")
+    recoleccion = resultados.get("recoleccion")
+    if recoleccion:
+        print(f"Recolección: {recoleccion['mensajes']} mensajes en {recoleccion['segundos']} s "
+              f"({recoleccion['ms_por_mensaje']} ms/mensaje) | adjuntos {recoleccion['adjuntos']}/"
+              f"{recoleccion['adjuntos_esperados']} ({recoleccion['duplicados_omitidos']} duplicados omitidos) | "
+              f"descargas JPM {recoleccion['descargas_jpm']}")
+    plantillas = resultados.get("plantillas")
+    if plantillas:
+        conteo, desplazada = plantillas["plantilla"], plantillas["desplazada"]
+        print(f"Plantillas: {plantillas['docs']} escaneados | {conteo['correctos']} correctos, "
+              f"{conteo['descartados']} descartados, {conteo['incorrectos']} incorrectos | desplazada: "
+              f"{desplazada['descartados']}/{plantillas['docs']} descartados, respaldo "
+              f"{plantillas.get('respaldo', '-')} | {plantillas['segundos']} s")
+    cuarentena = resultados.get("cuarentena")
+    if cuarentena:
+        print(f"Cuarentena: OK ({cuarentena['reintentos_portal']} intentos al portal en "
+              f"{cuarentena['corridas']} corridas; la marca avanzó)")
+    rss = resultados["rss_max_mb"]
+    print(f"RSS máximo: {rss['proceso']} MB (proceso), {rss['procesos_hijos']} MB (workers)")
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description="Benchmark de extracción de cartas NDF")
+    parser.add_argument("--docs-por-tipo", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--salida", help="Ruta de un JSON con los resultados")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar la salida del pipeline")
+    args = parser.parse_args()
+
+    resultados = run_benchmark(args.docs_por_tipo, args.workers, args.seed, args.verbose)
+    print_report(resultados)
+    if args.salida:
+        Path(args.salida).write_text(json.dumps(resultados, indent=2, ensure_ascii=False), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+Bitácora SQLite del procesamiento de cartas NDF
+Cada documento se identifica por el SHA-256 de su contenido y la fecha de proceso;
+guarda su estado, el ID asignado y la fila del Excel de seguimiento, para que una
+nueva corrida solo procese lo pendiente y conserve la numeración
+"""
+import json
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+# Orden de avance de un documento; "error" se reintenta en la siguiente corrida
+ESTADOS = ("pendiente", "extraido", "copiado", "en_excel", "error")
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS documentos (
+    hash TEXT NOT NULL,
+    fecha_proceso TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    archivo_original TEXT NOT NULL,
+    estado TEXT NOT NULL,
+    nuevo_nombre TEXT,
+    registro TEXT,
+    error TEXT,
+    actualizado TEXT NOT NULL,
+    PRIMARY KEY (hash, fecha_proceso),
+    UNIQUE (fecha_proceso, id)
+)
+"""
+
+
+class Bitacora:
+    """Estado persistente de cada documento, con IDs estables por fecha de proceso"""
+
+    def __init__(self, db_path, id_inicial=1001):
+        """
+        Abre (o crea) la bitácora
+
+        Args:
+            db_path: Archivo SQLite. Debe estar en un disco local: SQLite no es
+                confiable sobre recursos compartidos de red
+            id_inicial: Primer ID de cada fecha de proceso
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.id_inicial = id_inicial
+        # Autocommit: cada cambio de estado queda en disco aunque el proceso se caiga después
+        self.conn = sqlite3.connect(str(self.db_path), isolation_level=None, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(_ESQUEMA)
+
+    def register(self, file_hash, fecha_proceso, archivo):
+        """
+        Registra un documento o devuelve el registro existente
+
+        Un documento nuevo recibe el siguiente ID libre de la fecha; uno ya
+        registrado conserva el suyo aunque cambie el nombre del archivo.
+
+        Returns:
+            dict: Fila de la bitácora (hash, fecha_proceso, id, archivo_original, estado, ...)
+        """
+        # BEGIN IMMEDIATE reserva la escritura para que dos corridas no tomen el mismo ID
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            fila = self._get(file_hash, fecha_proceso)
+            if fila is None:
+                siguiente = self.conn.execute(
+                    "SELECT COALESCE(MAX(id) + 1, ?) FROM documentos WHERE fecha_proceso = ?",
+                    (self.id_inicial, fecha_proceso)
+                ).fetchone()[0]
+                self.conn.execute(
+                    "INSERT INTO documentos (hash, fecha_proceso, id, archivo_original, estado, actualizado) "
+                    "VALUES (?, ?, ?, ?, 'pendiente', ?)",
+                    (file_hash, fecha_proceso, siguiente, archivo, _now())
+                )
+                fila = self._get(file_hash, fecha_proceso)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return fila
+
+    def mark(self, file_hash, fecha_proceso, estado, nuevo_nombre=None, registro=None, error=None):
+        """
+        Actualiza el estado de un documento
+
+        Args:
+            estado: Uno de ESTADOS
+            nuevo_nombre: Nombre del archivo copiado, si ya se conoce
+            registro: Fila del Excel de seguimiento (dict), si ya se construyó
+            error: Mensaje de error; se limpia al pasar a un estado sin error
+        """
+        if estado not in ESTADOS:
+            raise ValueError(f"Estado desconocido: {estado}")
+        self.conn.execute(
+            "UPDATE documentos SET estado = ?, nuevo_nombre = COALESCE(?, nuevo_nombre), "
+            "registro = COALESCE(?, registro), error = ?, actualizado = ? "
+            "WHERE hash = ? AND fecha_proceso = ?",
+            (estado, nuevo_nombre, json.dumps(registro, ensure_ascii=False) if registro is not None else None,
+             error, _now(), file_hash, fecha_proceso)
+        )
+
+    def mark_many(self, claves, estado):
+        """Cambia el estado de varios documentos (lista de (hash, fecha_proceso)) en una transacción"""
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "UPDATE documentos SET estado = ?, error = NULL, actualizado = ? WHERE hash = ? AND fecha_proceso = ?",
+                [(estado, _now(), file_hash, fecha) for file_hash, fecha in claves]
+            )
+
+    def records(self, fecha_proceso):
+        """
+        Filas del Excel de seguimiento de una fecha, en orden de ID
+
+        Returns:
+            list: Tuplas (hash, estado, registro dict) de los documentos que ya tienen fila
+        """
+        filas = self.conn.execute(
+            "SELECT hash, estado, registro FROM documentos "
+            "WHERE fecha_proceso = ? AND registro IS NOT NULL ORDER BY id",
+            (fecha_proceso,)
+        ).fetchall()
+        return [(fila["hash"], fila["estado"], json.loads(fila["registro"])) for fila in filas]
+
+    def _get(self, file_hash, fecha_proceso):
+        fila = self.conn.execute(
+            "SELECT * FROM documentos WHERE hash = ? AND fecha_proceso = ?", (file_hash, fecha_proceso)
+        ).fetchone()
+        return dict(fila) if fila is not None else None
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
@@ -0,0 +1,391 @@
+"""
+Acceso al buzón de cartas NDF
+BuzonOutlook lee la carpeta de Outlook por COM pidiendo al servidor solo los mensajes
+del rango de fechas y, en bloque, solo las columnas Subject, ReceivedTime y EntryID;
+el cuerpo y los adjuntos se piden después por EntryID, solo para los mensajes que se
+procesan. BuzonEml lee archivos .eml de una carpeta local y permite correr la
+recolección y los benchmarks sin Outlook (p. ej. en Linux)
+
+MarcaDeAgua guarda hasta dónde se procesó el buzón para que cada corrida pida solo
+los mensajes que no ha visto
+"""
+import re
+import json
+import email
+import ctypes
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from email import policy
+from email.message import EmailMessage
+from email.parser import BytesHeaderParser
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+try:
+    import win32com.client
+except ImportError:  # Sin pywin32 (Linux): solo queda disponible BuzonEml
+    win32com = None
+
+
+class MensajeInfo:
+    """Encabezado de un mensaje: lo mínimo para decidir si se procesa"""
+
+    def __init__(self, entry_id: str, subject: str, received: datetime, has_attachments: bool = True):
+        self.entry_id = entry_id
+        self.subject = subject
+        self.received = received
+        self.has_attachments = has_attachments
+
+    def __repr__(self) -> str:
+        return f"MensajeInfo({self.subject[:40]!r}, {self.received:%Y-%m-%d %H:%M})"
+
+
+class Adjunto:
+    """Adjunto de un mensaje con su nombre y la forma de guardarlo en disco"""
+
+    def __init__(self, filename: str, saver: Callable[[Path], None]):
+        self.filename = filename
+        self._saver = saver
+
+    def save(self, path: Path) -> None:
+        """Guarda el adjunto en path"""
+        self._saver(Path(path))
+
+
+class Buzon(ABC):
+    """Carpeta de correo de la que se recolectan las cartas"""
+
+    @abstractmethod
+    def list_messages(self, desde: datetime, hasta: Optional[datetime] = None) -> List[MensajeInfo]:
+        """
+        Encabezados de los mensajes recibidos en el rango, del más antiguo al más reciente
+
+        Args:
+            desde: Fecha de recepción mínima (inclusive)
+            hasta: Fecha de recepción máxima (inclusive); None = sin límite
+        """
+
+    @abstractmethod
+    def get_body(self, entry_id: str) -> str:
+        """Cuerpo en texto plano del mensaje"""
+
+    @abstractmethod
+    def iter_attachments(self, entry_id: str) -> Iterator[Adjunto]:
+        """Adjuntos del mensaje"""
+
+
+# GetLocaleInfoEx: formato de fecha corta de la configuración regional de Windows
+LOCALE_SSHORTDATE = 0x1F
+
+
+def _locale_short_date() -> Optional[str]:
+    """Patrón de fecha corta de Windows (p. ej. "dd/MM/yyyy"), o None si no se puede leer"""
+    try:
+        buffer = ctypes.create_unicode_buffer(80)
+        if ctypes.windll.kernel32.GetLocaleInfoEx(None, LOCALE_SSHORTDATE, buffer, len(buffer)):
+            return buffer.value
+    except (AttributeError, OSError):
+        pass
+    return None
+
+
+def format_short_date(fecha: datetime, patron: str) -> Optional[str]:
+    """
+    Escribe la fecha con un patrón de fecha corta de Windows
+
+    Args:
+        fecha: Fecha a escribir
+        patron: Patrón con d/dd, M/MM, yy/yyyy y separadores, p. ej. "dd/MM/yyyy" o "M/d/yyyy"
+
+    Returns:
+        str: Fecha formateada, o None si el patrón usa nombres (ddd, MMM) o le falta el día, el mes o el año
+    """
+    partes = {}
+
+    def reemplazar(match):
+        token = match.group(0)
+        letra = token[0]
+        if letra in "dM" and len(token) > 2:
+            return "\0"  # Nombres de día o mes: dependen del idioma
+        partes[letra] = True
+        if letra == "d":
+            return f"{fecha.day:0{len(token)}d}"
+        if letra == "M":
+            return f"{fecha.month:0{len(token)}d}"
+        return f"{fecha.year % 100:02d}" if len(token) <= 2 else f"{fecha.year:04d}"
+
+    texto = re.sub(r"d+|M+|y+", reemplazar, re.sub(r"'[^']*'", "", patron))
+    if "\0" in texto or set(partes) != {"d", "M", "y"}:
+        return None
+    return texto
+
+
+def _naive(fecha) -> datetime:
+    """Quita la zona horaria que pywin32 agrega a las fechas de COM"""
+    if hasattr(fecha, "tzinfo") and fecha.tzinfo is not None:
+        fecha = fecha.replace(tzinfo=None)
+    return datetime(fecha.year, fecha.month, fecha.day, fecha.hour, fecha.minute, fecha.second)
+
+
+class BuzonOutlook(Buzon):
+    """Carpeta de Outlook leída con Restrict y la API de tablas (Folder.GetTable)"""
+
+    # Filas que se traen por llamada COM con Table.GetArray
+    FILAS_POR_LOTE = 500
+    # PR_HASATTACH no tiene nombre integrado en Table.Columns; se agrega por su referencia DASL
+    COLUMNA_ADJUNTOS = "urn:schemas:httpmail:hasattachment"
+
+    def __init__(self, folder: object, logger=None):
+        """
+        Inicializa el buzón
+
+        Args:
+            folder: Carpeta de Outlook (MAPIFolder) ya abierta
+            logger: Logger para advertencias; opcional
+        """
+        if win32com is None:
+            raise RuntimeError("pywin32 no está instalado: BuzonOutlook solo funciona en Windows con Outlook")
+        self.folder = folder
+        self.namespace = folder.Session
+        self.store_id = folder.StoreID
+        self.logger = logger
+        # Último mensaje abierto: cuerpo y adjuntos del mismo mensaje comparten un GetItemFromID
+        self._ultimo = (None, None)
+
+    def _warn(self, mensaje: str) -> None:
+        if self.logger:
+            self.logger.warning(mensaje)
+
+    @staticmethod
+    def _date_filter(desde: datetime) -> Optional[str]:
+        """
+        Filtro de Restrict desde el día anterior a desde, o None si no se puede escribir
+
+        Restrict interpreta la fecha con el formato de fecha corta de la configuración
+        regional (dd/mm en español): se escribe con ese mismo formato y sin hora. El día de
+        más y el corte exacto sobre la columna ReceivedTime cubren la hora y la zona horaria
+        """
+        patron = _locale_short_date()
+        fecha = format_short_date(desde - timedelta(days=1), patron) if patron else None
+        return f"[ReceivedTime] >= '{fecha}'" if fecha else None
+
+    def _newest_received(self) -> Optional[datetime]:
+        """Fecha del mensaje más reciente de la carpeta: una sola fila de una columna"""
+        table = self.folder.GetTable()
+        table.Columns.RemoveAll()
+        table.Columns.Add("ReceivedTime")
+        table.Sort("[ReceivedTime]", True)
+        filas = table.GetArray(1)
+        return _naive(filas[0][0]) if filas else None
+
+    def _read_table(self, filtro: Optional[str]) -> list:
+        """Filas (EntryID, Subject, ReceivedTime, adjuntos) de la tabla, filtrada o completa"""
+        table = self.folder.GetTable(filtro) if filtro else self.folder.GetTable()
+        table.Columns.RemoveAll()
+        for column in ("EntryID", "Subject", "ReceivedTime", self.COLUMNA_ADJUNTOS):
+            table.Columns.Add(column)
+        filas = []
+        while not table.EndOfTable:
+            filas.extend(table.GetArray(self.FILAS_POR_LOTE))
+        return filas
+
+    def list_messages(self, desde: datetime, hasta: Optional[datetime] = None) -> List[MensajeInfo]:
+        # Sin filtro se lee la tabla completa: sigue siendo una lectura en bloque de cuatro
+        # columnas, no un acceso COM por mensaje
+        filtro = self._date_filter(desde)
+        if filtro is None:
+            self._warn("No se pudo escribir la fecha en el formato regional; se lee la carpeta sin filtrar")
+            filas = self._read_table(None)
+        else:
+            try:
+                filas = self._read_table(filtro)
+            except Exception as e:
+                self._warn(f"Outlook rechazó el filtro de fecha {filtro} ({e}); se lee la carpeta sin filtrar")
+                filas = self._read_table(None)
+            else:
+                # Una tabla filtrada vacía puede ser un filtro mal interpretado (día y mes
+                # cruzados), no un buzón sin correo nuevo: se compara con el más reciente
+                if not filas:
+                    ultimo = self._newest_received()
+                    if ultimo is not None and ultimo >= desde:
+                        self._warn(f"El filtro {filtro} no devolvió mensajes pero hay uno del {ultimo}; "
+                                   f"se lee la carpeta sin filtrar")
+                        filas = self._read_table(None)
+
+        mensajes = []
+        for entry_id, subject, received, has_attachments in filas:
+            # Con el nombre integrado ReceivedTime, Outlook entrega la hora local
+            received = _naive(received)
+            if received < desde or (hasta is not None and received > hasta):
+                continue
+            mensajes.append(MensajeInfo(entry_id, subject or "", received, bool(has_attachments)))
+        mensajes.sort(key=lambda m: m.received)
+        return mensajes
+
+    def _get_item(self, entry_id: str):
+        if self._ultimo[0] != entry_id:
+            self._ultimo = (entry_id, self.namespace.GetItemFromID(entry_id, self.store_id))
+        return self._ultimo[1]
+
+    def get_body(self, entry_id: str) -> str:
+        return self._get_item(entry_id).Body
+
+    def iter_attachments(self, entry_id: str) -> Iterator[Adjunto]:
+        for attachment in self._get_item(entry_id).Attachments:
+            yield Adjunto(attachment.FileName, lambda path, a=attachment: a.SaveAsFile(str(path)))
+
+
+class BuzonEml(Buzon):
+    """Carpeta local de archivos .eml; el EntryID es el nombre del archivo"""
+
+    def __init__(self, directorio):
+        """
+        Inicializa el buzón
+
+        Args:
+            directorio: Carpeta con los .eml (p. ej. exportados de Outlook o generados por el benchmark)
+        """
+        self.directorio = Path(directorio)
+        self._mensajes: Dict[str, EmailMessage] = {}
+
+    def _load(self, entry_id: str) -> EmailMessage:
+        if entry_id not in self._mensajes:
+            with open(self.directorio / entry_id, "rb") as f:
+                self._mensajes[entry_id] = email.message_from_binary_file(f, policy=policy.default)
+        return self._mensajes[entry_id]
+
+    def list_messages(self, desde: datetime, hasta: Optional[datetime] = None) -> List[MensajeInfo]:
+        mensajes = []
+        for path in self.directorio.glob("*.eml"):
+            # Para listar basta con los encabezados; el cuerpo se lee solo si se procesa
+            with open(path, "rb") as f:
+                mensaje = BytesHeaderParser(policy=policy.default).parse(f)
+            received = parsedate_to_datetime(mensaje["Date"])
+            if received.tzinfo is not None:
+                received = received.astimezone().replace(tzinfo=None)
+            if received < desde or (hasta is not None and received > hasta):
+                continue
+            # Sin leer el cuerpo no se sabe si hay adjuntos; multipart/mixed es la señal habitual
+            has_attachments = mensaje.get_content_type() == "multipart/mixed"
+            mensajes.append(MensajeInfo(path.name, str(mensaje["Subject"] or ""), received, has_attachments))
+        mensajes.sort(key=lambda m: m.received)
+        return mensajes
+
+    def get_body(self, entry_id: str) -> str:
+        cuerpo = self._load(entry_id).get_body(preferencelist=("plain", "html"))
+        return cuerpo.get_content() if cuerpo is not None else ""
+
+    def iter_attachments(self, entry_id: str) -> Iterator[Adjunto]:
+        for parte in self._load(entry_id).iter_attachments():
+            filename = parte.get_filename()
+            if not filename:
+                continue
+            yield Adjunto(filename, lambda path, p=parte: path.write_bytes(p.get_payload(decode=True)))
+
+
+class MarcaDeAgua:
+    """
+    Hasta dónde se procesó el buzón, guardado en JSON
+
+    Guarda la fecha de recepción más reciente procesada y los EntryID de la
+    ventana de solape anterior a ella: la siguiente corrida vuelve a pedir esa
+    ventana (para no perder correos que Outlook sincroniza tarde o con la misma
+    hora) y descarta los que ya tienen EntryID registrado
+
+    Un mensaje que falla detiene la marca en su fecha hasta que se procese. Para que
+    uno que nunca va a funcionar (p. ej. un código JPM vencido) no la detenga para
+    siempre, se cuentan sus intentos y tras max_intentos pasa a cuarentena: queda
+    registrado en el JSON para revisarlo a mano y la marca sigue de largo
+    """
+
+    def __init__(self, path, solape: timedelta = timedelta(days=1), max_intentos: int = 3):
+        """
+        Carga la marca
+
+        Args:
+            path: Archivo JSON de estado; si no existe, no hay marca
+            solape: Ventana que se vuelve a revisar antes de la marca
+            max_intentos: Corridas fallidas de un mensaje antes de ponerlo en cuarentena
+        """
+        self.path = Path(path)
+        self.solape = solape
+        self.max_intentos = max_intentos
+        self.ultima: Optional[datetime] = None
+        self.vistos: Dict[str, str] = {}
+        self.intentos: Dict[str, int] = {}
+        self.cuarentena: Dict[str, dict] = {}
+        if self.path.exists():
+            estado = json.loads(self.path.read_text(encoding="utf-8"))
+            if estado.get("ultima"):
+                self.ultima = datetime.fromisoformat(estado["ultima"])
+            self.vistos = estado.get("vistos", {})
+            self.intentos = estado.get("intentos", {})
+            self.cuarentena = estado.get("cuarentena", {})
+
+    def since(self, fecha_inicial: datetime) -> datetime:
+        """Fecha desde la que hay que pedir mensajes; fecha_inicial si aún no hay marca"""
+        if self.ultima is None:
+            return fecha_inicial
+        return self.ultima - self.solape
+
+    def pending(self, mensajes: List[MensajeInfo]) -> List[MensajeInfo]:
+        """Descarta los mensajes que ya se procesaron en una corrida anterior"""
+        return [m for m in mensajes if m.entry_id not in self.vistos]
+
+    def advance(self, mensajes: List[MensajeInfo], fallidos: List[MensajeInfo] = ()) -> List[MensajeInfo]:
+        """
+        Registra los mensajes como procesados y guarda la marca
+
+        Args:
+            mensajes: Mensajes procesados por completo
+            fallidos: Mensajes que fallaron; no se registran y la marca no pasa del más
+                antiguo, así la siguiente corrida los vuelve a pedir. Al fallar
+                max_intentos veces pasan a cuarentena y dejan de detener la marca
+
+        Returns:
+            list: Mensajes de fallidos que entraron a cuarentena en esta corrida
+        """
+        for mensaje in mensajes:
+            self.vistos[mensaje.entry_id] = mensaje.received.isoformat()
+            self.intentos.pop(mensaje.entry_id, None)
+
+        en_cuarentena = []
+        pendientes = []
+        for mensaje in fallidos:
+            intentos = self.intentos.get(mensaje.entry_id, 0) + 1
+            if intentos < self.max_intentos:
+                self.intentos[mensaje.entry_id] = intentos
+                pendientes.append(mensaje)
+                continue
+            # Se registra como visto para que la ventana de solape no lo vuelva a pedir
+            self.intentos.pop(mensaje.entry_id, None)
+            self.vistos[mensaje.entry_id] = mensaje.received.isoformat()
+            self.cuarentena[mensaje.entry_id] = {"recibido": mensaje.received.isoformat(),
+                                                 "asunto": mensaje.subject, "intentos": intentos}
+            en_cuarentena.append(mensaje)
+        fallidos = pendientes
+        # Los vistos incluyen los mensajes más recientes que una corrida con fallos ya procesó
+        # sin poder mover la marca: cuando ya no hay fallos la marca los alcanza
+        recibidos = [datetime.fromisoformat(recibido) for recibido in self.vistos.values()]
+        if self.ultima is not None:
+            recibidos.append(self.ultima)
+        if fallidos:
+            limite = min(mensaje.received for mensaje in fallidos)
+            recibidos = [min(recibido, limite) for recibido in recibidos] or [limite]
+        if not recibidos:
+            return en_cuarentena
+        self.ultima = max(recibidos)
+        # Solo hace falta recordar los EntryID que la siguiente corrida vuelve a pedir
+        limite = self.ultima - self.solape
+        self.vistos = {
+            entry_id: recibido for entry_id, recibido in self.vistos.items()
+            if datetime.fromisoformat(recibido) >= limite
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        estado = {"ultima": self.ultima.isoformat(), "vistos": self.vistos, "intentos": self.intentos,
+                  "cuarentena": self.cuarentena}
+        tmp_path.write_text(json.dumps(estado, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp_path.replace(self.path)
+        return en_cuarentena
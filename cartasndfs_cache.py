@@ -0,0 +1,118 @@
+"""
+Caché persistente en disco para resultados de extracción de cartas NDF
+Las entradas se indexan por el SHA-256 del PDF y la configuración de extracción
+"""
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """Calcula el SHA-256 del contenido de un archivo"""
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ExtractionCache:
+    """Caché de texto extraído y respuestas del LLM, un archivo JSON por documento"""
+
+    def __init__(self, cache_dir, max_size_mb=500, max_age_days=30):
+        """
+        Inicializa la caché
+
+        Args:
+            cache_dir: Carpeta donde se guardan las entradas
+            max_size_mb: Tamaño máximo total; se eliminan primero las menos usadas
+            max_age_days: Edad máxima de una entrada desde su último uso
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.max_age_seconds = max_age_days * 24 * 3600
+
+    @staticmethod
+    def make_key(file_hash, settings):
+        """
+        Construye la llave de una entrada
+
+        Args:
+            file_hash: SHA-256 del PDF
+            settings: Configuración que afecta el resultado (DPI, idioma, modelo, versión del prompt...)
+
+        Returns:
+            str: Llave hexadecimal
+        """
+        settings_json = json.dumps(settings, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(f"{file_hash}:{settings_json}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key):
+        """
+        Busca una entrada
+
+        Returns:
+            dict: Entrada guardada, o None si no existe o expiró
+        """
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.max_age_seconds:
+                path.unlink(missing_ok=True)
+                return None
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            # Marcar como usada para la expiración y el desalojo por tamaño
+            os.utime(path)
+            return entry
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, key, entry):
+        """Guarda una entrada de forma atómica"""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """
+        Elimina entradas expiradas y, si se supera el tamaño máximo, las de uso más antiguo
+
+        Returns:
+            int: Número de entradas eliminadas
+        """
+        now = time.time()
+        entries = []
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        removed = 0
+        total_size = 0
+        vigentes = []
+        for mtime, size, path in entries:
+            if now - mtime > self.max_age_seconds:
+                path.unlink(missing_ok=True)
+                removed += 1
+            else:
+                vigentes.append((mtime, size, path))
+                total_size += size
+
+        for mtime, size, path in sorted(vigentes):
+            if total_size <= self.max_size_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_size -= size
+            removed += 1
+        return removed
@@ -0,0 +1,76 @@
+"""
+PDF leído una sola vez en memoria
+El mismo buffer sirve para el hash de la caché, PyMuPDF, el OCR y la copia de
+salida, así cada carta se lee una vez del recurso de red y nunca se reescribe
+"""
+import hashlib
+from pathlib import Path
+import fitz
+
+
+class DocumentoPDF:
+    """Bytes de un PDF con su nombre y, si está cifrado, su contraseña"""
+
+    def __init__(self, path, data=None, password=None):
+        """
+        Inicializa el documento
+
+        Args:
+            path: Ruta del archivo original (solo se lee si no se pasa data)
+            data: Contenido del PDF, si ya se tiene en memoria
+            password: Contraseña de usuario para PDFs cifrados
+        """
+        self.path = Path(path)
+        self.data = Path(path).read_bytes() if data is None else data
+        self.password = password
+        self._sha256 = None
+        self._cifrado = None
+
+    @property
+    def name(self):
+        return self.path.name
+
+    @property
+    def sha256(self):
+        """SHA-256 del contenido (igual al de cartasndfs_cache.hash_file sobre el archivo)"""
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.data).hexdigest()
+        return self._sha256
+
+    def open(self):
+        """
+        Abre el buffer con PyMuPDF y lo descifra si hace falta
+
+        Returns:
+            fitz.Document: Documento listo para leer; cerrarlo al terminar
+
+        Raises:
+            ValueError: Si el PDF está cifrado y la contraseña falta o no es válida
+        """
+        doc = fitz.open(stream=self.data, filetype="pdf")
+        self._cifrado = bool(doc.needs_pass)
+        if self._cifrado and not doc.authenticate(self.password or ""):
+            doc.close()
+            raise ValueError(f"No se pudo descifrar {self.name}: contraseña faltante o inválida")
+        return doc
+
+    def output_bytes(self):
+        """
+        Contenido para la copia de salida: el mismo PDF, sin cifrado si tenía contraseña
+
+        Returns:
+            bytes: PDF listo para escribir
+        """
+        if not self.password:
+            return self.data
+        doc = self.open()
+        try:
+            # No consultar needs_pass/is_encrypted después de authenticate: con PyMuPDF 1.2x
+            # eso deja los streams sin descifrar al guardar. garbage=1 reescribe todos los objetos
+            return doc.tobytes(encryption=fitz.PDF_ENCRYPT_NONE, garbage=1) if self._cifrado else self.data
+        finally:
+            doc.close()
+
+    def write_to(self, destination):
+        """Escribe la copia de salida en destination; el archivo original no se toca"""
+        Path(destination).write_bytes(self.output_bytes())
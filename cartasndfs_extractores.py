@@ -0,0 +1,288 @@
+"""
+Extracción determinística de campos de cartas NDF con expresiones regulares
+Patrones por banco (basados en los de cartasndfs_pruebas.ipynb) con validación
+de cada valor, para llamar al LLM solo por los campos que no se puedan leer
+"""
+import re
+from datetime import datetime
+
+CAMPOS = ("tasa_fwd", "valor_nominal_usd", "fecha_inicio")
+
+# Rangos plausibles de tasa forward: COP/USD y, en algunos contratos, EUR/USD
+RANGOS_TASA = ((2500.0, 6500.0), (0.5, 2.0))
+NOMINAL_MINIMO_USD = 1000
+
+MESES = {
+    "ene": 1, "jan": 1, "feb": 2, "mar": 3, "abr": 4, "apr": 4, "may": 5,
+    "jun": 6, "jul": 7, "ago": 8, "aug": 8, "sep": 9, "set": 9, "oct": 10,
+    "nov": 11, "dic": 12, "dec": 12
+}
+
+_FECHA = (
+    r"\d{1,2}[/-]\d{1,2}[/-]\d{2,4}"
+    r"|\d{1,2}[\s-]+(?:de\s+)?[A-Za-zÁÉÍÓÚáéíóú]{3,10}\.?[\s-]+(?:del?\s+)?\d{4}"
+    r"|[A-Za-zÁÉÍÓÚáéíóú]{3,10}\.?\s+\d{1,2},?\s+(?:del?\s+)?\d{4}"
+)
+_NUMERO = r"\d[\d.,]*\d"
+
+PATRONES_GENERALES = {
+    "fecha_inicio": [
+        rf"(?:Trade Date|Fecha de Celebraci[oó]n|Fecha (?:de )?Negociaci[oó]n|Deal Date)\s*[:\-]?\s*({_FECHA})",
+    ],
+    "tasa_fwd": [
+        rf"(?:Forward Rate|Tasa Forward|Tasa FW|Tasa Pactada|Strike(?: Price)?)\s*[:\-]?\s*(?:COP\s*)?\$?\s*({_NUMERO})",
+        rf"({_NUMERO})\s*COP\s*/\s*USD",
+        rf"\bTasa\s*[:\-]\s*\$?\s*({_NUMERO})",
+    ],
+    "valor_nominal_usd": [
+        rf"(?:Notional Amount|Valor Nominal|Valor Nocional|Monto Nocional|Monto en USD|Valor Negociado)"
+        rf"\s*(?:USD)?\s*[:\-]?\s*(?:USD|US\$|U\.S\.\$)\s*({_NUMERO})",
+        rf"(?:Notional Amount|Valor Nominal|Valor Nocional|Monto Nocional|Valor Negociado)"
+        rf"\s*[:\-]?\s*({_NUMERO})\s*(?:USD|US\$)",
+    ],
+}
+
+# Patrones propios de cada formato; se prueban antes que los generales
+PATRONES_BANCO = {
+    "JPMORGAN": {
+        "fecha_inicio": [rf"Trade Date\s*:\s*({_FECHA})"],
+        "tasa_fwd": [rf"Forward Rate\s*:\s*({_NUMERO})"],
+        "valor_nominal_usd": [rf"Reference Currency Notional Amount\s*:\s*USD\s*({_NUMERO})"],
+    },
+    "BANCOLOMBIA": {
+        "fecha_inicio": [rf"Fecha de Celebraci[oó]n\s*:?\s*({_FECHA})"],
+        "tasa_fwd": [rf"Tasa Forward\s*[-:]?\s*\$?\s*({_NUMERO})"],
+        "valor_nominal_usd": [rf"Valor Nominal\s*:?\s*USD\s*({_NUMERO})"],
+    },
+    "DAVIbank": {
+        "fecha_inicio": [rf"Fecha de Celebraci[oó]n\s*:?\s*({_FECHA})"],
+        "tasa_fwd": [rf"Tasa (?:Forward|Pactada)\s*[-:]?\s*\$?\s*({_NUMERO})"],
+        "valor_nominal_usd": [rf"Valor (?:Nominal|Nocional)\s*(?:USD)?\s*:?\s*(?:USD)?\s*\$?\s*({_NUMERO})"],
+    },
+    "ITAÚ": {
+        "fecha_inicio": [rf"Fecha (?:de )?Negociaci[oó]n\s*:?\s*({_FECHA})"],
+        "tasa_fwd": [rf"Tasa (?:Forward|FW)\s*[-:]?\s*\$?\s*({_NUMERO})"],
+        "valor_nominal_usd": [rf"(?:Monto en USD|Valor Negociado)\s*:?\s*(?:USD)?\s*\$?\s*({_NUMERO})"],
+    },
+}
+
+
+def parse_number(value):
+    """
+    Convierte un número con separadores de miles/decimales a float
+
+    Acepta "4.236,20", "4,236.20", "4236,20" y "1,000,000.00". Si aparecen los
+    dos separadores, el último es el decimal; si aparece uno solo en grupos de
+    tres dígitos, es de miles.
+
+    Returns:
+        float: Valor, o None si no se puede interpretar
+    """
+    value = value.strip().rstrip(".,")
+    if "," in value and "." in value:
+        decimal = "," if value.rfind(",") > value.rfind(".") else "."
+        miles = "." if decimal == "," else ","
+        value = value.replace(miles, "").replace(decimal, ".")
+    elif "," in value or "." in value:
+        sep = "," if "," in value else "."
+        if re.fullmatch(rf"\d{{1,3}}(?:\{sep}\d{{3}})+", value):
+            value = value.replace(sep, "")
+        elif value.count(sep) == 1:
+            value = value.replace(sep, ".")
+        else:
+            return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_date(value):
+    """
+    Normaliza una fecha al formato dd/mm/aaaa
+
+    Returns:
+        str: Fecha normalizada, o None si no es una fecha válida
+    """
+    value = value.strip().lower()
+    match = re.fullmatch(r"(\d{1,2})[/-](\d{1,2})[/-](\d{2,4})", value)
+    if match:
+        day, month, year = (int(g) for g in match.groups())
+    else:
+        words = re.findall(r"[a-záéíóú]+|\d+", value)
+        numbers = [int(w) for w in words if w.isdigit()]
+        months = [MESES[w[:3]] for w in words if not w.isdigit() and w[:3] in MESES]
+        if len(numbers) != 2 or len(months) != 1:
+            return None
+        month = months[0]
+        day, year = (numbers[0], numbers[1]) if numbers[1] > 31 else (numbers[1], numbers[0])
+    if year < 100:
+        year += 2000
+    try:
+        fecha = datetime(year, month, day)
+    except ValueError:
+        return None
+    if not 2000 <= fecha.year <= 2100:
+        return None
+    return fecha.strftime("%d/%m/%Y")
+
+
+def validate_field(campo, raw):
+    """
+    Interpreta y valida el valor crudo de un campo
+
+    Args:
+        campo: Nombre del campo (ver CAMPOS)
+        raw: Texto capturado por la expresión regular
+
+    Returns:
+        float | int | str: Valor normalizado, o None si no pasa la validación
+    """
+    if campo == "fecha_inicio":
+        return parse_date(raw)
+
+    number = parse_number(raw)
+    if number is None:
+        return None
+    if campo == "tasa_fwd":
+        if any(low <= number <= high for low, high in RANGOS_TASA):
+            return number
+        return None
+    if campo == "valor_nominal_usd":
+        if number >= NOMINAL_MINIMO_USD and number == int(number):
+            return int(number)
+        return None
+    return None
+
+
+# Forma del valor de cada campo, sin etiqueta
+VALORES = {"fecha_inicio": _FECHA, "tasa_fwd": _NUMERO, "valor_nominal_usd": _NUMERO}
+
+# Fecha año-mes-día sin separadores (20250315): en un recorte sin etiqueta parece un monto
+_FECHA_COMPACTA = r"(?:19|20)\d{2}(?:0[1-9]|1[0-2])(?:0[1-9]|[12]\d|3[01])"
+
+
+def find_value(campo, text):
+    """
+    Valor del campo si todo el texto es un valor válido (p. ej. el OCR de una región
+    que solo debe contener el valor)
+
+    A diferencia de extract_fields no busca dentro del texto: sin etiqueta que lo
+    confirme, un recorte con algo más (una referencia, una fecha año-mes-día) no
+    debe producir un valor
+
+    Args:
+        campo: Nombre del campo (ver CAMPOS)
+        text: Texto leído
+
+    Returns:
+        float | int | str: Valor normalizado, o None si el texto no es un valor válido del campo
+    """
+    valor = text.strip()
+    if campo != "fecha_inicio":
+        # El OCR puede partir el número con espacios y dejar el "$" de la etiqueta
+        valor = re.sub(r"\s+", "", valor).lstrip("$")
+        if re.fullmatch(_FECHA_COMPACTA, valor):
+            return None
+    if not re.fullmatch(VALORES[campo], valor, re.IGNORECASE):
+        return None
+    return validate_field(campo, valor)
+
+
+def extract_fields(text, banco):
+    """
+    Extrae los campos del contrato con los patrones del banco y los generales
+
+    Para cada campo se prueban los patrones en orden y se toma la primera
+    coincidencia que pase la validación.
+
+    Args:
+        text: Texto del PDF (sin limpiar: clean_text elimina las "/" de las fechas)
+        banco: Banco detectado
+
+    Returns:
+        dict: {campo: valor o None} para cada campo de CAMPOS
+    """
+    propios = PATRONES_BANCO.get(banco, {})
+    resultado = {}
+    for campo in CAMPOS:
+        resultado[campo] = None
+        for pattern in propios.get(campo, []) + PATRONES_GENERALES[campo]:
+            for match in re.finditer(pattern, text, re.IGNORECASE):
+                valor = validate_field(campo, match.group(1))
+                if valor is not None:
+                    resultado[campo] = valor
+                    break
+            if resultado[campo] is not None:
+                break
+    return resultado
+
+
+# Etiquetas cerca de las cuales suele estar cada campo, con su peso para ordenar
+# las ventanas. Se buscan en el texto ya limpio (sin tildes ni "/"), por eso
+# "Celebraci\w*" en vez de "Celebración"
+ETIQUETAS_CONTEXTO = {
+    "tasa_fwd": [
+        (r"Forward Rate", 3), (r"Tasa Forward", 3), (r"Tasa FW", 3), (r"Strike", 2),
+        (r"COP\s*USD", 2), (r"Tasa", 1), (r"Rate", 1),
+    ],
+    "valor_nominal_usd": [
+        (r"Notional Amount", 3), (r"Valor No(?:minal|cional)", 3), (r"Valor Negociado", 3),
+        (r"Monto en USD", 3), (r"Notional", 2), (r"Monto", 1), (r"USD", 1),
+    ],
+    "fecha_inicio": [
+        (r"Trade Date", 3), (r"Fecha de Celebraci\w*", 3), (r"Fecha (?:de )?Negociaci\w*", 3),
+        (r"Deal Date", 2), (r"Fecha", 1),
+    ],
+}
+
+
+def select_context(text, campos=CAMPOS, antes=60, despues=160, max_hits_campo=3, max_chars=1200):
+    """
+    Selecciona fragmentos del texto alrededor de las etiquetas de cada campo
+
+    Cada coincidencia de una etiqueta abre una ventana de texto; por campo se
+    conservan las ventanas de mayor peso, se fusionan las que se solapan y se
+    devuelven en el orden del documento hasta max_chars.
+
+    Args:
+        text: Texto limpio del contrato
+        campos: Campos a buscar (normalmente los que la regex no pudo llenar)
+        antes: Caracteres antes de la etiqueta
+        despues: Caracteres después de la etiqueta
+        max_hits_campo: Máximo de ventanas por campo
+        max_chars: Tamaño máximo del contexto
+
+    Returns:
+        str: Fragmentos separados por "...", o el inicio del texto si no hay etiquetas
+    """
+    ventanas = []
+    for campo in campos:
+        hits = []
+        for etiqueta, peso in ETIQUETAS_CONTEXTO.get(campo, []):
+            for match in re.finditer(rf"\b{etiqueta}\b", text, re.IGNORECASE):
+                hits.append((peso, -match.start(), max(0, match.start() - antes), min(len(text), match.end() + despues)))
+        # Más peso primero y, a igual peso, la aparición más temprana
+        hits.sort(reverse=True)
+        ventanas.extend((peso, inicio, fin) for peso, _, inicio, fin in hits[:max_hits_campo])
+
+    if not ventanas:
+        return text[:max_chars]
+
+    # Tomar las ventanas de mayor peso hasta llenar el presupuesto
+    elegidas = []
+    total = 0
+    for peso, inicio, fin in sorted(ventanas, key=lambda v: (-v[0], v[1])):
+        if total + (fin - inicio) > max_chars and elegidas:
+            continue
+        elegidas.append((inicio, fin))
+        total += fin - inicio
+
+    # Fusionar solapes y devolver en el orden del documento
+    fusionadas = []
+    for inicio, fin in sorted(elegidas):
+        if fusionadas and inicio <= fusionadas[-1][1]:
+            fusionadas[-1] = (fusionadas[-1][0], max(fusionadas[-1][1], fin))
+        else:
+            fusionadas.append((inicio, fin))
+    return "\n...\n".join(text[inicio:fin].strip() for inicio, fin in fusionadas)
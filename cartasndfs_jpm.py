@@ -0,0 +1,181 @@
+"""
+Cliente HTTP del portal de confirmaciones JPM
+Hace por HTTP lo mismo que el navegador: abre el enlace del correo, envía el código
+de verificación en el formulario (txtAccessCode, con sus campos ocultos y cookies)
+y sigue el enlace Q416_downloadspecific, escribiendo el PDF en disco por partes
+"""
+import re
+import queue
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Optional, Tuple
+from urllib.parse import unquote, urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CAMPO_CODIGO = "txtAccessCode"
+CLASE_DESCARGA = "Q416_downloadspecific"
+# cartasndfs_lectura_pdf reconoce las cartas JPM por este prefijo en el nombre del archivo
+PREFIJO_CONFIRMACION = "Confirmation-AE"
+
+# Enlaces ASP.NET del tipo javascript:__doPostBack('lnkDownload','')
+_POSTBACK = re.compile(r"__doPostBack\('([^']*)',\s*'([^']*)'\)")
+_FILENAME_UTF8 = re.compile(r"filename\*\s*=\s*[^']*''([^;]+)", re.IGNORECASE)
+_FILENAME = re.compile(r'filename\s*=\s*"?([^";]+)"?', re.IGNORECASE)
+
+
+class _PaginaPortal(HTMLParser):
+    """Formularios, campo del código y enlaces de descarga de una página del portal"""
+
+    def __init__(self, html: str):
+        super().__init__(convert_charrefs=True)
+        self.forms = []
+        self.form_codigo = None
+        self.nombre_codigo = None
+        self.enlaces = []
+        self.feed(html)
+        self.close()
+
+    def _form_actual(self) -> dict:
+        if not self.forms:
+            # Campos fuera de un <form>: se envían a la misma página
+            self.forms.append({"action": "", "method": "post", "campos": {}, "botones": []})
+        return self.forms[-1]
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "form":
+            self.forms.append({"action": attrs.get("action") or "", "method": (attrs.get("method") or "get").lower(),
+                               "campos": {}, "botones": []})
+        elif tag == "input" and attrs.get("name"):
+            form = self._form_actual()
+            name = attrs["name"]
+            tipo = (attrs.get("type") or "text").lower()
+            if tipo in ("submit", "image"):
+                form["botones"].append((name, attrs.get("value") or ""))
+            elif tipo in ("checkbox", "radio") and "checked" not in attrs:
+                return
+            else:
+                form["campos"][name] = attrs.get("value") or ""
+            # En ASP.NET el name lleva prefijos (ctl00$...$txtAccessCode); el id no
+            if attrs.get("id") == CAMPO_CODIGO or name.endswith(CAMPO_CODIGO):
+                self.form_codigo = form
+                self.nombre_codigo = name
+        elif tag == "a" and CLASE_DESCARGA in (attrs.get("class") or "").split():
+            self.enlaces.append(attrs.get("href") or "")
+
+
+def _filename(respuesta) -> Optional[str]:
+    """Nombre del archivo según Content-Disposition o, si no viene, la URL"""
+    disposicion = respuesta.headers.get("Content-Disposition", "")
+    match = _FILENAME_UTF8.search(disposicion)
+    if match:
+        return Path(unquote(match.group(1).strip())).name
+    match = _FILENAME.search(disposicion)
+    if match:
+        return Path(match.group(1).strip()).name
+    nombre = Path(urlparse(respuesta.url).path).name
+    return nombre if nombre.lower().endswith(".pdf") else None
+
+
+class ClienteJPM:
+    """Descargas del portal JPM con un pool de sesiones HTTP reutilizables"""
+
+    def __init__(self, max_sesiones: int = 2, timeout: int = 30):
+        """
+        Inicializa el cliente
+
+        Args:
+            max_sesiones: Descargas simultáneas; cada una usa su propia sesión (cookies)
+            timeout: Timeout por petición en segundos
+        """
+        self.timeout = timeout
+        self._sesiones = queue.Queue()
+        for _ in range(max(1, max_sesiones)):
+            session = requests.Session()
+            session.headers["User-Agent"] = "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._sesiones.put(session)
+
+    @contextmanager
+    def _session(self):
+        session = self._sesiones.get()
+        # Las conexiones keep-alive se reutilizan; las cookies del portal son de cada descarga
+        session.cookies.clear()
+        try:
+            yield session
+        finally:
+            self._sesiones.put(session)
+
+    def _submit(self, session, page_url: str, form: dict, campos: dict, stream: bool = False):
+        action = urljoin(page_url, form["action"])
+        if form["method"] == "post":
+            return session.post(action, data=campos, timeout=self.timeout, stream=stream)
+        return session.get(action, params=campos, timeout=self.timeout, stream=stream)
+
+    def download(self, url: str, code: str, directory) -> Tuple[Path, str]:
+        """
+        Descarga una confirmación
+
+        Args:
+            url: Enlace del correo
+            code: Código de verificación del correo
+            directory: Carpeta donde se escribe el PDF
+
+        Returns:
+            tuple: (archivo escrito con extensión .parcial, nombre que envió el portal; si no
+                envió uno con PREFIJO_CONFIRMACION, "Confirmation-AE-<código>.pdf")
+
+        Raises:
+            RuntimeError: Si el portal no muestra el formulario o el enlace esperado, o no devuelve un PDF
+            requests.RequestException: Si falla una petición
+        """
+        with self._session() as session:
+            respuesta = session.get(url, timeout=self.timeout)
+            respuesta.raise_for_status()
+            pagina = _PaginaPortal(respuesta.text)
+            if pagina.form_codigo is None:
+                raise RuntimeError("El portal no mostró el formulario del código de acceso")
+
+            campos = dict(pagina.form_codigo["campos"])
+            campos[pagina.nombre_codigo] = code
+            if pagina.form_codigo["botones"]:
+                boton, valor = pagina.form_codigo["botones"][0]
+                campos[boton] = valor
+            respuesta = self._submit(session, respuesta.url, pagina.form_codigo, campos)
+            respuesta.raise_for_status()
+
+            pagina = _PaginaPortal(respuesta.text)
+            if not pagina.enlaces:
+                raise RuntimeError("No apareció el enlace de descarga; el código puede ser inválido o haber expirado")
+            postback = _POSTBACK.search(pagina.enlaces[0])
+            if postback:
+                if not pagina.forms:
+                    raise RuntimeError("El enlace de descarga necesita un formulario que la página no tiene")
+                form = pagina.forms[0]
+                campos = dict(form["campos"], __EVENTTARGET=postback.group(1), __EVENTARGUMENT=postback.group(2))
+                respuesta = self._submit(session, respuesta.url, form, campos, stream=True)
+            else:
+                respuesta = session.get(urljoin(respuesta.url, pagina.enlaces[0]), timeout=self.timeout, stream=True)
+
+            with respuesta:
+                respuesta.raise_for_status()
+                filename = _filename(respuesta)
+                if not filename or PREFIJO_CONFIRMACION not in filename:
+                    filename = f"{PREFIJO_CONFIRMACION}-{code}.pdf"
+                partial_path = Path(directory) / f"{filename}.parcial"
+                try:
+                    with open(partial_path, "wb") as f:
+                        for chunk in respuesta.iter_content(chunk_size=64 * 1024):
+                            f.write(chunk)
+                    with open(partial_path, "rb") as f:
+                        if f.read(5) != b"%PDF-":
+                            raise RuntimeError("El portal no devolvió un PDF")
+                except BaseException:
+                    partial_path.unlink(missing_ok=True)
+                    raise
+        return partial_path, filename
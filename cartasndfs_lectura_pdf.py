@@ -1,20 +1,26 @@
 import os
 import re
+import argparse
 import json
-import shutil
 import time
-import requests
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import pandas as pd
 import pytesseract
-import fitz
 from datetime import datetime
 from pathlib import Path
-from pdf2image import convert_from_path
-from PyPDF2 import PdfReader, PdfWriter
+from cartasndfs_ocr import OCR_LANG, ocr_pdf, ocr_pdf_adaptive, page_has_text_layer
+from cartasndfs_cache import ExtractionCache
+from cartasndfs_bitacora import Bitacora
+from cartasndfs_documento import DocumentoPDF
+from cartasndfs_extractores import CAMPOS, extract_fields, select_context
+from cartasndfs_ollama import OllamaClient, OllamaModelManager, keep_alive_seconds, ollama_stats
+from cartasndfs_plantillas import PLANTILLAS, PLANTILLAS_VERSION, read_template
+from cartasndfs_metricas import Cronometro, RegistroMetricas, llm_metrics, print_summary
+import cartasndfs_traza as traza
 
 # Configuraciones
 pytesseract.pytesseract.tesseract_cmd = r'C:\Users\ntorreslo\AppData\Local\Programs\Tesseract-OCR\tesseract'
-directory_poppler = r'C:\Poppler\poppler-24.08.0\Library\bin'
 
 # Fechas y directorios
 today = datetime.now()
@@ -23,78 +29,250 @@ month = today.strftime("%m")
 day = today.strftime("%d%m%y")
 fecha_proceso = today.strftime('%d-%m-%y')
 
-input_dir = Path(r"Z:/17. Reporting Automation/Cartas NDFs/Cartas sin firmas") / year / month / day
+input_base_dir = Path(r"Z:/17. Reporting Automation/Cartas NDFs/Cartas sin firmas")
+input_dir = input_base_dir / year / month / day
 output_base_dir = Path(r"Z:/17. Reporting Automation/Cartas NDFs/Cartas para firmar")
 excel_output_dir = Path(r"Z:/17. Reporting Automation/Cartas NDFs/Cartas para firmar")
-excel_output_dir.mkdir(parents=True, exist_ok=True)
 
-def ensure_model_ready():
-    """Pre-carga el modelo Ollama"""
-    print("Verificando modelo...")
-    payload_test = {
-        "model": "llama3.2:3b",
-        "prompt": "Extrae datos del siguiente texto en JSON: tasa_fwd: 4000, valor_nominal_usd: 1000000, fecha_inicio: 01/01/2024",
-        "stream": False,
-        "options": {
-            "num_predict": 100,
-            "temperature": 0.1,
-            "keep_alive": "30m"
-        }
-    }
+# Modo vigilancia (--vigilar): cada cuánto se revisa la carpeta del día y cuántos segundos
+# debe quedar quieto un archivo (mismo tamaño y fecha) antes de procesarlo
+vigilancia_intervalo_s = 10
+vigilancia_estabilidad_s = 5
+# Un PDF sin %%EOF al final se sigue escribiendo; pasado este tiempo se procesa igual (quedará con error)
+vigilancia_max_espera_s = 120
+# Un archivo que quedó con error (no se pudo leer, timeout del LLM, Z: caído al copiar) o cuyo
+# lote falló se reintenta pasados estos segundos, sin reiniciar la vigilancia
+vigilancia_reintento_s = 300
+
+# Procesamiento paralelo: número de procesos para la extracción de texto (1 = modo serial)
+num_workers = max(1, (os.cpu_count() or 2) - 1)
+
+# Memoria máxima (MB) para páginas renderizadas por documento; cada proceso tiene la suya.
+# Una página carta ocupa ~100 MB a 600 dpi y ~70 MB a 500 dpi
+ocr_memoria_max_mb = 400
+
+# OCR adaptativo: lee primero a baja resolución y re-renderiza a mayor DPI
+# solo las páginas cuya confianza media (0-100 según tesseract) quede bajo el umbral
+ocr_adaptativo = True
+dpi_escalones = (300, 400, 500, 600)
+umbral_confianza_ocr = 75
+
+# Motor de OCR: "auto" usa el primero disponible entre tesserocr, la API C de libtesseract
+# (la DLL que trae el instalador de Tesseract) y pytesseract. Los dos primeros dejan los
+# modelos cargados en cada proceso del pool y reciben las páginas en memoria
+ocr_motor = "auto"
+
+# Preprocesamiento antes del OCR: escala de grises, umbral adaptativo, corrección de la
+# inclinación y recorte de bordes. Tesseract recibe una imagen binaria más pequeña
+ocr_preproceso = True
+
+# OCR por regiones: en los formatos con plantilla (cartasndfs_plantillas.PLANTILLAS) se leen
+# solo los recortes de los tres campos; si alguno no pasa la validación o la verificación se
+# hace el OCR de las páginas completas como siempre. Los campos de la plantilla reemplazan a
+# la regex y al LLM, así que se activa solo con plantillas medidas sobre cartas reales
+ocr_plantillas = False
+
+# Servidor Ollama. llm_en_vuelo = peticiones simultáneas al modelo; para que se atiendan
+# en paralelo el servidor debe correr con OLLAMA_NUM_PARALLEL >= llm_en_vuelo
+ollama_url = "http://localhost:11434"
+llm_en_vuelo = 2
+llm_timeout = 280  # importantisimo acomodar esto. muchas veces toca cambiarlo por la potencia del compu
+
+# El modelo queda en memoria durante el lote y al final vuelve a descargarse tras
+# llm_keep_alive_final sin uso. Cada petición reemplaza el keep_alive, así que todas lo envían
+# y lo renuevan. Es finito a propósito: si el proceso muere sin llamar a release(), Ollama
+# libera el modelo pasado ese tiempo en vez de dejarlo fijo hasta reiniciar el servidor
+llm_keep_alive = "1h"
+llm_keep_alive_final = "30m"
+llm_timeout_carga = 300
+
+# Modelo y versión del prompt; subir PROMPT_VERSION cada vez que se edite el prompt
+# para que la caché no devuelva respuestas del prompt anterior
+ollama_model = "llama3.2:3b"
+PROMPT_VERSION = 5
+
+# Salida estructurada: el modelo responde con un JSON validado por esquema (campo
+# "format" de Ollama), en streaming, y se corta la generación al cerrarse el objeto
+llm_salida_estructurada = True
+llm_max_tokens = 96
+ESQUEMA_RESPUESTA_LLM = {
+    "type": "object",
+    "properties": {
+        "tasa_fwd": {"type": ["number", "null"]},
+        "valor_nominal_usd": {"type": ["integer", "null"]},
+        "fecha_inicio": {"type": ["string", "null"]}
+    },
+    "required": ["tasa_fwd", "valor_nominal_usd", "fecha_inicio"]
+}
+
+# Caché local de texto extraído y respuestas del LLM (no en Z: para no depender de la red)
+cache_dir = Path(os.environ.get("LOCALAPPDATA", Path.home())) / "cartasndfs" / "cache"
+cache_max_mb = 500
+cache_max_dias = 30
+
+# Bitácora de documentos procesados: estados, IDs por fecha y filas del Excel.
+# Una nueva corrida del mismo día solo procesa documentos nuevos o con error
+bitacora_path = cache_dir.parent / "bitacora.sqlite3"
+
+# Traza de la corrida en formato Chrome trace-event (se abre en ui.perfetto.dev), junto al Excel.
+# También se activa con la variable de entorno CARTASNDFS_TRAZA=1
+trazar = os.environ.get("CARTASNDFS_TRAZA") == "1"
+
+# Contraseñas de los PDFs cifrados, según un fragmento del nombre del archivo
+CLAVES_PDF = {"COLOMBIA TELECO": "830122566"}
+
+def load_document(file_path):
+    """Lee el PDF una sola vez; el buffer se usa para el hash, la extracción y la copia"""
+    filename = os.path.basename(file_path)
+    password = next((clave for fragmento, clave in CLAVES_PDF.items() if fragmento in filename), None)
+    return DocumentoPDF(file_path, password=password)
+
+def ocr_document(pdf, dpi_max, pages):
+    """OCR de las páginas indicadas (pdf: ruta, bytes o fitz.Document abierto); en modo adaptativo solo sube hasta dpi_max donde hace falta"""
+    if not ocr_adaptativo:
+        return ocr_pdf(pdf, dpi=dpi_max, memoria_max_mb=ocr_memoria_max_mb, pages=pages, motor=ocr_motor,
+                       preproceso=ocr_preproceso)
     
+    dpis = [dpi for dpi in dpi_escalones if dpi < dpi_max] + [dpi_max]
+    return ocr_pdf_adaptive(
+        pdf, dpis, umbral_confianza_ocr,
+        memoria_max_mb=ocr_memoria_max_mb, pages=pages, motor=ocr_motor, preproceso=ocr_preproceso
+    )
+
+def extract_text_or_ocr(documento, dpi_max, cronometro):
+    """
+    Usa la capa de texto de las páginas digitales y hace OCR solo de las que son imagen.
+    Devuelve (texto, detalles del OCR, tiempos por página del OCR)
+    """
+    with cronometro.etapa("apertura"):
+        doc = documento.open()
     try:
-        response = requests.post("http://localhost:11434/api/generate", json=payload_test, timeout=30)
-        result = response.json()
-        print("Modelo listo:", result.get('response', '')[:50])
-    except Exception as e:
-        print(f"Error pre-cargando modelo: {e}")
+        textos = {}
+        with cronometro.etapa("capa_texto"):
+            for page in doc:
+                if page_has_text_layer(page):
+                    textos[page.number + 1] = page.get_text()
+        n_pages = doc.page_count
+        
+        pendientes = [n for n in range(1, n_pages + 1) if n not in textos]
+        # Las páginas escaneadas se renderizan desde el mismo documento abierto (ya descifrado)
+        paginas_leidas = ocr_document(doc, dpi_max, pendientes) if pendientes else []
+    finally:
+        doc.close()
+    
+    metodos = {n: "txt" for n in textos}
+    confianzas = []
+    paginas_ocr = []
+    for pagina in paginas_leidas:
+        textos[pagina["pagina"]] = pagina["texto"]
+        metodos[pagina["pagina"]] = str(pagina["dpi"])
+        if "confianza" in pagina:
+            confianzas.append(pagina["confianza"])
+        cronometro.add("render", pagina["render_ms"])
+        cronometro.add("preproceso", pagina["preproceso_ms"])
+        cronometro.add("ocr", pagina["ocr_ms"])
+        paginas_ocr.append({
+            "pagina": pagina["pagina"], "dpi": pagina["dpi"], "motor": pagina["motor"],
+            "intentos": pagina.get("intentos", 1),
+            "render_ms": round(pagina["render_ms"], 1), "preproceso_ms": round(pagina["preproceso_ms"], 1),
+            "ocr_ms": round(pagina["ocr_ms"], 1)
+        })
 
-def extract_text_from_pdf(file_path):
-    """Extrae texto según el tipo de PDF"""
-    filename = os.path.basename(file_path)
+    text = "".join(textos[n] for n in sorted(textos))
+    detalles = {
+        "metodo_extraccion": "texto" if not pendientes else ("ocr" if len(pendientes) == n_pages else "mixto"),
+        "plantilla": "",
+        # Por página: "txt" si se usó la capa de texto, o el DPI final del OCR. P. ej. "txt/300/500"
+        "dpi_ocr": "/".join(metodos[n] for n in sorted(metodos)),
+        # Confianza de la peor página, que es la que limita la lectura
+        "confianza_ocr": round(min(confianzas), 1) if confianzas else ""
+    }
+    return text, detalles, paginas_ocr
+
+def extract_with_template(documento, banco, dpi_max, cronometro):
+    """
+    Lee solo las regiones de la plantilla del banco y, si no hay plantilla o alguno de
+    sus campos no pasa la validación, vuelve a extract_text_or_ocr.
+    Devuelve (texto, detalles del OCR, tiempos por página del OCR, campos de la plantilla o None)
+    """
+    plantilla = PLANTILLAS.get(banco) if ocr_plantillas else None
+    if plantilla is None:
+        return (*extract_text_or_ocr(documento, dpi_max, cronometro), None)
+
+    with traza.span("plantilla", "ocr", plantilla=plantilla.nombre) as args:
+        campos, lectura = read_template(documento, plantilla, motor=ocr_motor)
+        args["motivo"] = lectura["motivo"]
+    cronometro.add("render", lectura["render_ms"])
+    cronometro.add("preproceso", lectura["preproceso_ms"])
+    cronometro.add("ocr", lectura["ocr_ms"])
+    if campos is None:
+        text, detalles, paginas_ocr = extract_text_or_ocr(documento, dpi_max, cronometro)
+        return text, detalles, paginas_ocr, None
+
+    detalles = {"metodo_extraccion": "plantilla", "plantilla": plantilla.nombre,
+                "dpi_ocr": str(plantilla.dpi), "confianza_ocr": ""}
+    return lectura["texto"], detalles, [], campos
+
+def extract_text_from_pdf(documento):
+    """
+    Extrae texto según el tipo de PDF (DocumentoPDF o ruta). Devuelve (texto, banco, detalles del OCR).
+    Los tiempos y spans medidos en el proceso de extracción viajan en detalles["metricas"] y detalles["traza"];
+    los campos leídos con una plantilla, en detalles["campos_plantilla"]
+    """
+    if not isinstance(documento, DocumentoPDF):
+        documento = load_document(documento)
+    with traza.span("extraccion", "documento", archivo=documento.name) as args:
+        text, banco, detalles = _extract_text_from_pdf(documento)
+        args.update(banco=banco, metodo=detalles["metodo_extraccion"], dpi=detalles["dpi_ocr"])
+    # En un proceso del pool los spans vuelven al principal junto con el resultado
+    detalles["traza"] = traza.drain() if traza.is_enabled() else []
+    return text, banco, detalles
+
+def _extract_text_from_pdf(documento):
+    """Extracción según el banco, deducido del nombre del archivo"""
+    inicio = time.perf_counter()
+    cronometro = Cronometro()
+    filename = documento.name
+    detalles = {"metodo_extraccion": "texto", "plantilla": "", "dpi_ocr": "", "confianza_ocr": ""}
+    paginas_ocr = []
+    campos_plantilla = None
     
     if "Confirmation-AE" in filename:  # JPMorgan
-        doc = fitz.open(file_path)
-        text = doc.load_page(1).get_text()
+        with cronometro.etapa("apertura"):
+            doc = documento.open()
+        with cronometro.etapa("capa_texto"):
+            text = doc.load_page(1).get_text()
         doc.close()
         banco = "JPMORGAN"
         
     elif "COLOMBIA TELECO" in filename:  # Bancolombia
-        reader = PdfReader(file_path)
-        writer = PdfWriter()
-        if reader.is_encrypted:
-            reader.decrypt("830122566")
-        for page in reader.pages:
-            writer.add_page(page)
-        with open(file_path, "wb") as f:
-            writer.write(f)
-        doc = fitz.open(file_path)
-        text = doc.load_page(0).get_text()
+        # Cifrado: se descifra en memoria con la contraseña de CLAVES_PDF, sin reescribir el original
+        with cronometro.etapa("apertura"):
+            doc = documento.open()
+        with cronometro.etapa("capa_texto"):
+            text = doc.load_page(0).get_text()
         doc.close()
         banco = "BANCOLOMBIA"
         
     elif re.search(r"\b\d{7}\b", filename):  # Scotiabank
-        images = convert_from_path(file_path, dpi=600, poppler_path=directory_poppler)
-        text = ""
-        for image in images:
-            text += pytesseract.image_to_string(image, lang='eng+spa')
         banco = "DAVIbank"
+        text, detalles, paginas_ocr, campos_plantilla = extract_with_template(
+            documento, banco, dpi_max=600, cronometro=cronometro)
         
     elif "_NDFV_FW" in filename:  # ITAÚ
-        images = convert_from_path(file_path, dpi=500, poppler_path=directory_poppler)
-        text = ""
-        for image in images:
-            text += pytesseract.image_to_string(image, lang='eng+spa')
         banco = "ITAÚ"
+        text, detalles, paginas_ocr, campos_plantilla = extract_with_template(
+            documento, banco, dpi_max=500, cronometro=cronometro)
         
-    else:  # Otros bancos con OCR
-        images = convert_from_path(file_path, dpi=500, poppler_path=directory_poppler)
-        text = ""
-        for image in images:
-            text += pytesseract.image_to_string(image, lang='eng+spa')
-        banco = detect_banco_from_text(text)
+    else:  # Otros bancos: capa de texto si existe, OCR si la página es imagen
+        text, detalles, paginas_ocr = extract_text_or_ocr(documento, dpi_max=500, cronometro=cronometro)
+        with cronometro.etapa("deteccion_banco"):
+            banco = detect_banco_from_text(text)
     
-    return text, banco
+    cronometro.add("extraccion", (time.perf_counter() - inicio) * 1000)
+    detalles["metricas"] = {"tiempos_ms": cronometro.as_dict(), "ocr_paginas": paginas_ocr}
+    detalles["campos_plantilla"] = campos_plantilla
+    return text, banco, detalles
 
 def detect_banco_from_text(text):
     """Detecta el banco del texto extraído"""
@@ -116,9 +294,9 @@ def clean_text(text):
     text_clean = re.sub(r'[^\w\s,.:-]', '', text_clean)
     return text_clean
 
-def extract_with_llm(text):
-    """Extrae datos usando Ollama"""
-    prompt = f"""Eres un experto en análisis de contratos financieros en inglés y español con experiencia en extracción de datos estructurados.
+# Bloque fijo de instrucciones. Va en "system" y es idéntico en todas las llamadas, así
+# Ollama reutiliza su caché de prompt (KV) y solo evalúa el texto de cada contrato
+INSTRUCCIONES_LLM = """Eres un experto en análisis de contratos financieros en inglés y español con experiencia en extracción de datos estructurados.
 
 OBJETIVO: Extraer información específica de contratos forward y presentarla en formato JSON.
 
@@ -147,13 +325,13 @@ fecha_inicio:
 - Puede aparecer como "Trade Date", "Fecha Negociación", "Deal Date"
 
 REGLAS DE FORMATO CRÍTICAS:
-- tasa_fwd: ELIMINAR puntos de miles, mantener coma decimal
-  Correcto: 4236,20
-  Incorrecto: 4.236,20 o 4.233620
+- tasa_fwd: Número JSON con punto decimal y sin separadores de miles
+  Correcto: 4236.20
+  Incorrecto: 4.236,20 o 4,236.20 o 4236,20 o "4236.20"
   
-- valor_nominal_usd: SOLO números enteros, sin separadores
+- valor_nominal_usd: Número JSON entero, sin separadores ni decimales
   Correcto: 2000000
-  Incorrecto: 2,000,000 o 2.000.000
+  Incorrecto: 2,000,000 o 2.000.000 o 2000000.00 o "2000000"
   
 - fecha_inicio: Formato estricto dd/mm/aaaa
   Correcto: 15/03/2024
@@ -165,126 +343,611 @@ INSTRUCCIONES DE SALIDA:
 - Si un campo no se encuentra, usa null
 
 FORMATO DE RESPUESTA ESPERADO:
-{{
+{
   "tasa_fwd": 4236.20,
   "valor_nominal_usd": 2000000,
   "fecha_inicio": "15/03/2024"
-}}
+}"""
 
-TEXTO DEL CONTRATO A ANALIZAR:
+def extract_with_llm(text, client=None):
+    """
+    Extrae datos usando Ollama; client permite reutilizar la sesión HTTP entre documentos.
+    Devuelve (datos o {"error": ...}, métricas de Ollama más "latencia_ms" de la petición)
+    """
+    prompt = f"""TEXTO DEL CONTRATO A ANALIZAR:
 ---
 {text[:3000]}
 ---
 Procede con la extracción:"""
 
     payload = {
-        "model": "llama3.2:3b",
+        "model": ollama_model,
+        "system": INSTRUCCIONES_LLM,
         "prompt": prompt,
         "stream": False,
+        "keep_alive": llm_keep_alive,
         "options": {
-            "temperature": 0.1,
-            "keep_alive": "30m"
+            "temperature": 0.1
         }
     }
 
-    try:
-        response = requests.post("http://localhost:11434/api/generate"
-        , json=payload
-        , timeout=280 # importantisimo acomodar esto. muchas veces toca cambiarlo por la potencia del compu
-        )
-        result = response.json()
+    if llm_salida_estructurada:
+        # El esquema obliga al modelo a responder solo el objeto y num_predict acota la salida
+        payload["format"] = ESQUEMA_RESPUESTA_LLM
+        payload["options"]["num_predict"] = llm_max_tokens
+
+    def consultar(client):
+        if llm_salida_estructurada:
+            return client.generate_json(payload)
+        result = client.generate(payload)
         respuesta_texto = result.get('response', '')
         
         # Buscar JSON en la respuesta
         json_match = re.search(r'\{.*\}', respuesta_texto, re.DOTALL)
-        if json_match:
-            return json.loads(json_match.group(0))
-        else:
-            return {"error": "No se encontró JSON válido"}
+        return (json.loads(json_match.group(0)) if json_match else None), ollama_stats(result)
+
+    inicio = time.perf_counter()
+    try:
+        with traza.span("llm", "llm", caracteres=len(text)) as args:
+            if client is None:
+                with OllamaClient(ollama_url, max_en_vuelo=1, timeout=llm_timeout) as client:
+                    data, metricas = consultar(client)
+            else:
+                data, metricas = consultar(client)
+            args.update(metricas)
+        metricas["latencia_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+        if data is None:
+            return {"error": "No se encontró JSON válido"}, metricas
+        return data, metricas
             
     except Exception as e:
-        return {"error": f"Error con Ollama: {str(e)}"}
+        latencia_ms = round((time.perf_counter() - inicio) * 1000, 1)
+        return {"error": f"Error con Ollama: {str(e)}"}, {"latencia_ms": latencia_ms}
+
+def report_prompt_cache(metricas_llm):
+    """
+    Verifica con prompt_eval_count que el prefijo fijo no se re-evalúa en cada llamada.
+    Con caché, las llamadas después de la primera solo evalúan los tokens del contrato
+    """
+    conteos = [m["prompt_eval_count"] for m in metricas_llm if "prompt_eval_count" in m]
+    if len(conteos) < 2:
+        return
+    duraciones = [m.get("prompt_eval_duration", 0) / 1e6 for m in metricas_llm if "prompt_eval_count" in m]
+    siguientes = conteos[1:]
+    print(f"\nTokens de prompt evaluados: primera llamada {conteos[0]} ({duraciones[0]:.0f} ms), "
+          f"siguientes en promedio {sum(siguientes) / len(siguientes):.0f} "
+          f"({sum(duraciones[1:]) / len(siguientes):.0f} ms)")
+    if max(siguientes) >= conteos[0]:
+        print("Aviso: el prefijo de instrucciones se está re-evaluando; revisar que el modelo no se "
+              "recargue entre llamadas y que OLLAMA_NUM_PARALLEL no reparta las llamadas en más slots")
+
+def merge_fields(campos_regex, resultado_llm):
+    """Combina los campos leídos por regex con los del LLM y registra el origen de cada uno"""
+    valores = {}
+    origenes = {}
+    for campo in CAMPOS:
+        if campos_regex[campo] is not None:
+            valores[campo] = campos_regex[campo]
+            origenes[f"origen_{campo}"] = "regex"
+        elif 'error' in resultado_llm:
+            valores[campo] = "ERROR"
+            origenes[f"origen_{campo}"] = "llm"
+        else:
+            valores[campo] = resultado_llm.get(campo, "")
+            origenes[f"origen_{campo}"] = "llm"
+    valores["error"] = resultado_llm.get("error", "")
+    return {**valores, **origenes}
+
+def extract_or_error(documento):
+    """Como extract_text_from_pdf, pero un PDF dañado devuelve (None, None, {"error": ...}) sin cortar el lote"""
+    try:
+        return extract_text_from_pdf(documento)
+    except Exception as e:
+        return None, None, {"error": f"{type(e).__name__}: {e}", "traza": traza.drain() if traza.is_enabled() else []}
+
+def iter_extracted_texts(documentos, executor=None):
+    """Extrae texto, banco y detalles de cada DocumentoPDF, en el mismo orden de la lista de entrada"""
+    if executor is None:
+        return map(extract_or_error, documentos)
+    # executor.map entrega los resultados en el orden de envío, así el OCR de los
+    # siguientes archivos avanza mientras se procesa el actual con el LLM.
+    # Los procesos reciben los bytes ya leídos y no vuelven a abrir el archivo
+    return executor.map(extract_or_error, documentos)
+
+def extraction_settings():
+    """Configuración que cambia el resultado de la extracción; forma parte de la llave de caché"""
+    return {
+        "ocr_lang": OCR_LANG,
+        "ocr_adaptativo": ocr_adaptativo,
+        "dpi_escalones": list(dpi_escalones),
+        "umbral_confianza_ocr": umbral_confianza_ocr,
+        "ocr_motor": ocr_motor,
+        "ocr_preproceso": ocr_preproceso,
+        "plantillas_version": PLANTILLAS_VERSION if ocr_plantillas else None,
+        "modelo": ollama_model,
+        "prompt_version": PROMPT_VERSION,
+        "llm_salida_estructurada": llm_salida_estructurada
+    }
+
+def start_model(client):
+    """Carga el modelo y reporta si el arranque fue en frío o en caliente"""
+    manager = OllamaModelManager(
+        client, ollama_model,
+        keep_alive_lote=llm_keep_alive, keep_alive_final=llm_keep_alive_final,
+        timeout_carga=llm_timeout_carga, prefijo=INSTRUCCIONES_LLM
+    )
+    print("Verificando modelo...")
+    try:
+        arranque = manager.start()
+        if arranque["arranque"] == "frio":
+            print(f"Arranque en frío: {ollama_model} cargado en {arranque['segundos']:.1f}s "
+                  f"(carga según Ollama: {arranque['load_duration_s']:.1f}s)")
+        else:
+            print(f"Arranque en caliente: {ollama_model} ya estaba en memoria ({arranque['segundos']:.1f}s)")
+    except Exception as e:
+        print(f"Error: el modelo {ollama_model} no quedó cargado ({e}). Los campos sin regex quedarán con error")
+    return manager
 
-def main():
-    # Verificar modelo
-    ensure_model_ready()
+def timing_columns(tiempos, metricas_llm):
+    """Columnas de tiempos y tokens para el Excel de seguimiento"""
+    return {
+        "tiempo_extraccion_ms": tiempos.get("extraccion", ""),
+        "tiempo_ocr_ms": tiempos.get("ocr", ""),
+        "tiempo_llm_ms": tiempos.get("llm", ""),
+        "tiempo_copia_ms": tiempos.get("copia", ""),
+        "tiempo_total_ms": tiempos.get("total", ""),
+        "tokens_prompt": metricas_llm.get("prompt_eval_count", ""),
+        "tokens_generados": metricas_llm.get("eval_count", "")
+    }
+
+def read_documents(pdf_files, bitacora):
+    """
+    Lee cada PDF una sola vez y lo registra en la bitácora
+
+    Devuelve (documentos por archivo, filas de la bitácora, cronómetros) solo de los
+    que faltan por procesar: los que ya están en el Excel y los duplicados se descartan.
+    También devuelve los archivos que no se pudieron leer (borrados o movidos entre la
+    búsqueda y la lectura, o bloqueados) y cuántos se descartaron por cada motivo:
+    {"ya_procesados": en el Excel por una corrida anterior, "duplicados": mismo contenido que otro}
+    """
+    pdfs = {}
+    filas = {}
+    cronometros = {}
+    ilegibles = []
+    omitidos = {"ya_procesados": 0, "duplicados": 0}
+    hashes_vistos = set()
+    with traza.span("lectura", "main", archivos=len(pdf_files)):
+        for pdf_file in pdf_files:
+            cronometro = Cronometro()
+            try:
+                with cronometro.etapa("lectura"):
+                    documento = load_document(pdf_file)
+            except OSError as e:
+                print(f"No se pudo leer {pdf_file.name}: {e}")
+                ilegibles.append(pdf_file)
+                continue
+            if documento.sha256 in hashes_vistos:
+                print(f"Duplicado (mismo contenido que otro archivo del día): {pdf_file.name}")
+                omitidos["duplicados"] += 1
+                continue
+            hashes_vistos.add(documento.sha256)
+            # IDs persistentes: un documento conserva su ID del día aunque se vuelva a correr.
+            # Los que ya están en el Excel no se reprocesan; los demás retoman donde quedaron
+            fila = bitacora.register(documento.sha256, fecha_proceso, pdf_file.name)
+            if fila["estado"] == "en_excel":
+                omitidos["ya_procesados"] += 1
+                continue
+            pdfs[pdf_file] = documento
+            filas[pdf_file] = fila
+            cronometros[pdf_file] = cronometro
+    return pdfs, filas, cronometros, ilegibles, omitidos
+
+def process_batch(pdf_files, cache, bitacora, client, registro, executor=None, workers=1):
+    """
+    Procesa un lote de PDFs: extracción, regex, LLM, copia y bitácora
+
+    Args:
+        pdf_files: Archivos en el orden en que deben numerarse
+        cache: ExtractionCache
+        bitacora: Bitacora de la corrida
+        client: OllamaClient con el modelo ya cargado
+        registro: RegistroMetricas donde se escriben los tiempos por documento
+        executor: Pool de procesos ya creado (modo vigilancia); si es None se crea uno
+            para el lote cuando workers > 1
+        workers: Procesos para el pool temporal
+
+    Returns:
+        list: Archivos que no se pudieron leer o quedaron en estado error en la bitácora;
+            la próxima corrida los reintenta
+    """
+    pdfs, filas, cronometros, fallidos, omitidos = read_documents(pdf_files, bitacora)
+    print(f"Ya procesados en corridas anteriores: {omitidos['ya_procesados']}, "
+          f"duplicados: {omitidos['duplicados']}, sin leer: {len(fallidos)}, por procesar: {len(filas)}")
+    pdf_files = list(filas)
+    
+    # Documentos ya procesados con la misma configuración saltan directo a copia y Excel
+    settings = extraction_settings()
+    with traza.span("consulta_cache", "main", archivos=len(pdf_files)):
+        cache_keys = {pdf_file: cache.make_key(pdfs[pdf_file].sha256, settings) for pdf_file in pdf_files}
+        cached = {pdf_file: cache.get(cache_keys[pdf_file]) for pdf_file in pdf_files}
+    pendientes = [pdf_file for pdf_file in pdf_files if cached[pdf_file] is None]
+    print(f"En caché: {len(pdf_files) - len(pendientes)}, por extraer: {len(pendientes)}")
     
-    # Lista para almacenar resultados
-    records = []
-    current_id = 1001
+    executor_lote = None
+    if executor is None and workers > 1 and len(pendientes) > 1:
+        n_procesos = min(workers, len(pendientes))
+        # Con la traza activa cada proceso registra sus spans y los devuelve con el resultado
+        executor = executor_lote = ProcessPoolExecutor(max_workers=n_procesos,
+                                                       initializer=traza.enable_worker if trazar else None)
+        print(f"Extracción en paralelo con {n_procesos} procesos")
     
+    # Etapa 1 (OCR) alimenta a la etapa 2 (LLM): cada documento se encola al modelo
+    # apenas tiene texto, mientras el pool sigue con el OCR de los siguientes
+    documentos = []
+    metricas_llm = []
+    try:
+        resultados_extraccion = iter_extracted_texts([pdfs[pdf_file] for pdf_file in pendientes], executor)
+        for pdf_file in pdf_files:
+            print(f"\nExtrayendo: {pdf_file.name}")
+            entrada = cached[pdf_file]
+            cronometro = cronometros[pdf_file]
+            metricas_extraccion = {"tiempos_ms": {}, "ocr_paginas": []}
+            if entrada is None:
+                # El tiempo en este span es lo que el hilo principal espera por el pool
+                with traza.span("espera_extraccion", "main", archivo=pdf_file.name):
+                    text, banco, detalles = next(resultados_extraccion)
+                traza.extend(detalles.pop("traza"))
+                if text is None:
+                    print(f"Error extrayendo texto: {detalles['error']}")
+                    bitacora.mark(pdfs[pdf_file].sha256, fecha_proceso, "error", error=detalles["error"])
+                    pdfs.pop(pdf_file)
+                    fallidos.append(pdf_file)
+                    continue
+                # Los tiempos y spans son de esta corrida y no se guardan en caché
+                metricas_extraccion = detalles.pop("metricas")
+                campos_plantilla = detalles.pop("campos_plantilla")
+                entrada = {
+                    "texto": text,
+                    "texto_limpio": clean_text(text),
+                    "banco": banco,
+                    "detalles": detalles,
+                    "campos_plantilla": campos_plantilla,
+                    "resultado_llm": None
+                }
+            else:
+                print("Texto extraído desde caché")
+            if filas[pdf_file]["estado"] in ("pendiente", "error"):
+                bitacora.mark(pdfs[pdf_file].sha256, fecha_proceso, "extraido")
+            
+            # Primero los campos de la plantilla, si se validaron todos y la segunda lectura de los
+            # campos de verificación coincidió (read_template); si no, los patrones
+            # por banco (sobre el texto crudo: clean_text quita las "/" de las fechas)
+            with cronometro.etapa("regex"):
+                campos_regex = entrada.get("campos_plantilla") or extract_fields(entrada["texto"], entrada["banco"])
+            faltantes = [campo for campo in CAMPOS if campos_regex[campo] is None]
+            
+            # El LLM solo se consulta si la regex no llenó todos los campos
+            futuro_llm = None
+            if faltantes and not entrada["resultado_llm"]:
+                print(f"Campos sin leer por regex: {', '.join(faltantes)}")
+                # Al modelo solo van los fragmentos alrededor de las etiquetas de los campos faltantes
+                contexto = select_context(entrada["texto_limpio"], faltantes)
+                print(f"Contexto para el LLM: {len(contexto)} de {len(entrada['texto_limpio'])} caracteres")
+                futuro_llm = client.submit(extract_with_llm, contexto, client)
+            documentos.append((pdf_file, entrada, campos_regex, futuro_llm, cronometro, metricas_extraccion))
+        
+        # Etapa 3: en el orden original; los IDs ya vienen asignados por la bitácora
+        for pdf_file, entrada, campos_regex, futuro_llm, cronometro, metricas_extraccion in documentos:
+            print(f"\nProcesando: {pdf_file.name}")
+            fila = filas[pdf_file]
+            documento = pdfs.pop(pdf_file)
+            banco = entrada["banco"]
+            resultado_llm = entrada["resultado_llm"] or {}
+            metricas = {}
+            if futuro_llm is not None:
+                with traza.span("espera_llm", "main", archivo=pdf_file.name):
+                    resultado_llm, metricas = futuro_llm.result()
+                cronometro.add("llm", metricas.get("latencia_ms", 0))
+                metricas_llm.append(metricas)
+                if metricas:
+                    print(f"LLM: {metricas.get('prompt_eval_count', '?')} tokens de prompt evaluados, "
+                          f"{metricas.get('eval_count', '?')} generados")
+                # Los errores no se guardan en caché para reintentarlos en la próxima corrida
+                entrada["resultado_llm"] = None if 'error' in resultado_llm else resultado_llm
+            if futuro_llm is not None or cached[pdf_file] is None:
+                cache.put(cache_keys[pdf_file], entrada)
+        
+            # Crear nuevo nombre y mover archivo
+            nuevo_nombre = f"{banco} {fecha_proceso} {fila['id']}.pdf"
+            destino_dir = output_base_dir / year / month / day / banco
+            destino_dir.mkdir(parents=True, exist_ok=True)
+            nuevo_path = destino_dir / nuevo_nombre
+            
+            error_copia = None
+            if fila["estado"] == "copiado" and nuevo_path.exists():
+                # Una corrida anterior se cayó después de copiarlo
+                print(f"Ya copiado en: {nuevo_path}")
+            else:
+                try:
+                    # Bancolombia se escribe ya descifrado; el buffer se libera al copiarlo
+                    with cronometro.etapa("copia"):
+                        documento.write_to(nuevo_path)
+                    print(f"Movido a: {nuevo_path}")
+                except Exception as e:
+                    error_copia = f"Error moviendo archivo: {e}"
+                    print(error_copia)
+            
+            # Total del documento: lectura + extracción (en su proceso) + regex + LLM + copia
+            tiempos = {**metricas_extraccion["tiempos_ms"], **cronometro.as_dict()}
+            etapas_total = ("lectura", "extraccion", "regex", "llm", "copia")
+            tiempos["total"] = round(sum(tiempos.get(e, 0) for e in etapas_total), 1)
+            registro.write({
+                "id": fila["id"],
+                "archivo": pdf_file.name,
+                "banco": banco,
+                "cache": cached[pdf_file] is not None,
+                "metodo_extraccion": entrada["detalles"].get("metodo_extraccion"),
+                "tiempos_ms": tiempos,
+                "ocr_paginas": metricas_extraccion["ocr_paginas"],
+                "llm": llm_metrics(metricas)
+            })
+        
+            # Crear registro
+            record = {
+                "id": fila["id"],
+                "archivo_original": pdf_file.name,
+                "nuevo_nombre_archivo": nuevo_nombre,
+                "banco": banco,
+                "fecha_proceso": fecha_proceso,
+                **entrada["detalles"],
+                **merge_fields(campos_regex, resultado_llm),
+                **timing_columns(tiempos, metricas)
+            }
+        
+            # Con error de copia o del LLM la fila queda en el Excel y el documento se
+            # reintenta en la próxima corrida, con el mismo ID
+            error = error_copia or record["error"]
+            bitacora.mark(documento.sha256, fecha_proceso, "error" if error else "copiado",
+                          nuevo_nombre=nuevo_nombre, registro=record, error=error or None)
+            if error:
+                fallidos.append(pdf_file)
+        
+            print(f"Datos extraídos: { {campo: record[campo] for campo in CAMPOS} }")
+        
+        report_prompt_cache(metricas_llm)
+    finally:
+        if executor_lote is not None:
+            executor_lote.shutdown(cancel_futures=True)
+    return fallidos
+
+def report_paths():
+    """Carpeta del día para Excel, métricas y traza, y la fecha que llevan sus nombres"""
+    return excel_output_dir / year / month / day, datetime.now().strftime('%Y%m%d')
+
+def write_excel(bitacora):
+    """
+    Reescribe el Excel de seguimiento con todas las filas del día, también las de corridas anteriores.
+    Se escribe a un temporal y se reemplaza, así nadie abre un Excel a medio escribir.
+    Devuelve el número de filas
+    """
+    filas_excel = bitacora.records(fecha_proceso)
+    records = [record for _, _, record in filas_excel]
+    if not records:
+        return 0
+    salida_dir, timestamp = report_paths()
+    salida_dir.mkdir(parents=True, exist_ok=True)
+    excel_path = salida_dir / f"Seguimiento NDFs {timestamp}.xlsx"
+    tmp_path = excel_path.with_name(f"~{excel_path.name}")
+    with traza.span("excel", "main", filas=len(records)):
+        pd.DataFrame(records).to_excel(tmp_path, index=False, engine='openpyxl')
+        os.replace(tmp_path, excel_path)
+    bitacora.mark_many([(file_hash, fecha_proceso) for file_hash, estado, _ in filas_excel
+                        if estado == "copiado"], "en_excel")
+    print(f"\nResultados guardados en: {excel_path}")
+    return len(records)
+
+def main(workers=num_workers):
     print(f"Procesando PDFs en: {input_dir}")
+    if trazar:
+        traza.enable()
+    inicio_corrida = traza.now_us()
     
     # Verificar si existe el directorio
     if not input_dir.exists():
         print(f"Error: El directorio {input_dir} no existe")
         return
     
-    pdf_files = list(input_dir.glob("*.pdf"))
+    # Orden fijo para que la numeración sea la misma en modo serial y paralelo
+    pdf_files = sorted(input_dir.glob("*.pdf"))
     print(f"Encontrados {len(pdf_files)} archivos PDF")
     
-    for pdf_file in pdf_files:
-        print(f"\nProcesando: {pdf_file.name}")
-        
-        # Extraer texto y banco
-        text, banco = extract_text_from_pdf(str(pdf_file))
-        text_clean = clean_text(text)
-        
-        # Extraer datos con LLM
-        resultado_llm = extract_with_llm(text_clean)
-        
-        # Crear nuevo nombre y mover archivo
-        nuevo_nombre = f"{banco} {fecha_proceso} {current_id}.pdf"
-        destino_dir = output_base_dir / year / month / day / banco
-        destino_dir.mkdir(parents=True, exist_ok=True)
-        nuevo_path = destino_dir / nuevo_nombre
-        
-        try:
-            shutil.copy(str(pdf_file), str(nuevo_path))
-            print(f"Movido a: {nuevo_path}")
-        except Exception as e:
-            print(f"Error moviendo archivo: {e}")
-        
-        # Crear registro
-        record = {
-            "id": current_id,
-            "archivo_original": pdf_file.name,
-            "nuevo_nombre_archivo": nuevo_nombre,
-            "banco": banco,
-            "fecha_proceso": fecha_proceso
-        }
-        
-        if 'error' in resultado_llm:
-            record.update({
-                "tasa_fwd": "ERROR",
-                "valor_nominal_usd": "ERROR", 
-                "fecha_inicio": "ERROR",
-                "error": resultado_llm.get("error", "Error desconocido")
-            })
-        else:
-            record.update({
-                "tasa_fwd": resultado_llm.get("tasa_fwd", ""),
-                "valor_nominal_usd": resultado_llm.get("valor_nominal_usd", ""),
-                "fecha_inicio": resultado_llm.get("fecha_inicio", ""),
-                "error": ""
-            })
-        
-        records.append(record)
-        current_id += 1
-        
-        print(f"Datos extraídos: {resultado_llm}")
+    cache = ExtractionCache(cache_dir, max_size_mb=cache_max_mb, max_age_days=cache_max_dias)
+    bitacora = Bitacora(bitacora_path)
     
-    # Guardar Excel
-    if records:
-        df = pd.DataFrame(records)
-        timestamp = datetime.now().strftime('%Y%m%d')
-        excel_path = excel_output_dir / year / month / day / f"Seguimiento NDFs {timestamp}.xlsx"
-        df.to_excel(excel_path, index=False, engine='openpyxl')
-        print(f"\nResultados guardados en: {excel_path}")
-    else:
+    # Un registro JSON por documento con los tiempos de cada etapa, junto al Excel
+    salida_dir, timestamp = report_paths()
+    registro = RegistroMetricas(salida_dir / f"Metricas NDFs {timestamp}.jsonl")
+    
+    client = OllamaClient(ollama_url, max_en_vuelo=llm_en_vuelo, timeout=llm_timeout)
+    with traza.span("carga_modelo", "llm"):
+        manager = start_model(client)
+    try:
+        process_batch(pdf_files, cache, bitacora, client, registro, workers=workers)
+    finally:
+        manager.release()
+        client.close()
+        cache.evict()
+        print_summary(registro.close())
+        print(f"Métricas guardadas en: {registro.path}")
+    
+    filas = write_excel(bitacora)
+    if not filas:
         print("No se procesaron archivos")
+    bitacora.close()
+    
+    if trazar:
+        traza.record("main", "main", inicio_corrida, traza.now_us() - inicio_corrida, documentos=filas)
+        traza_path = salida_dir / f"Traza NDFs {timestamp}.json"
+        print(f"Traza guardada en: {traza_path} ({traza.write(traza_path)} eventos)")
 
-if __name__ == "__main__":
-    main()
+def update_dates(now=None):
+    """Recalcula las fechas y la carpeta de entrada si cambió el día. Devuelve True si cambió"""
+    global today, year, month, day, fecha_proceso, input_dir
+    now = now or datetime.now()
+    if now.strftime("%d%m%y") == day:
+        return False
+    today = now
+    year = today.strftime("%Y")
+    month = today.strftime("%m")
+    day = today.strftime("%d%m%y")
+    fecha_proceso = today.strftime('%d-%m-%y')
+    input_dir = input_base_dir / year / month / day
+    return True
 
+def ready_files(directorio, vistos, procesados, estabilidad_s):
+    """
+    PDFs nuevos de la carpeta que ya terminaron de escribirse.
+    Un archivo está listo cuando su tamaño y fecha de modificación no cambian durante
+    estabilidad_s segundos, se puede abrir (Outlook y Chrome lo bloquean mientras escriben)
+    y termina en %%EOF.
+    vistos y procesados se conservan entre llamadas: {archivo: ((tamaño, mtime), desde)} y {archivo: (tamaño, mtime)}
+    """
+    if not directorio.exists():
+        return []
+    ahora = time.monotonic()
+    listos = []
+    for pdf_file in sorted(directorio.glob("*.pdf")):
+        try:
+            stat = pdf_file.stat()
+        except FileNotFoundError:
+            continue
+        firma = (stat.st_size, stat.st_mtime)
+        if procesados.get(pdf_file) == firma:
+            continue
+        anterior = vistos.get(pdf_file)
+        if anterior is None or anterior[0] != firma:
+            vistos[pdf_file] = (firma, ahora)
+            continue
+        if stat.st_size == 0 or ahora - anterior[1] < estabilidad_s:
+            continue
+        try:
+            with open(pdf_file, "rb") as f:
+                f.seek(max(0, stat.st_size - 1024))
+                completo = b"%%EOF" in f.read()
+        except PermissionError:
+            continue
+        if completo or ahora - anterior[1] > vigilancia_max_espera_s:
+            listos.append(pdf_file)
+    return listos
 
+def watch(workers=num_workers, intervalo_s=None, estabilidad_s=None):
+    """
+    Modo vigilancia: procesa los PDFs a medida que llegan a la carpeta del día.
+    El modelo queda cargado y los procesos de OCR vivos entre lotes; el Excel se
+    reescribe después de cada lote. Sin archivos nuevos, el keep_alive del modelo se
+    renueva cada mitad de llm_keep_alive para que no se descargue. Un lote que falla no
+    detiene la vigilancia: sus archivos, y los que quedaron con error, se reintentan
+    pasados vigilancia_reintento_s. Termina con Ctrl+C
+    """
+    intervalo_s = intervalo_s or vigilancia_intervalo_s
+    estabilidad_s = estabilidad_s or vigilancia_estabilidad_s
+    if trazar:
+        traza.enable()
+    
+    cache = ExtractionCache(cache_dir, max_size_mb=cache_max_mb, max_age_days=cache_max_dias)
+    bitacora = Bitacora(bitacora_path)
+    client = OllamaClient(ollama_url, max_en_vuelo=llm_en_vuelo, timeout=llm_timeout)
+    manager = start_model(client)
+    # Las peticiones de cada lote renuevan el keep_alive; en los ratos sin archivos lo renueva la vigilancia
+    keep_alive_s = keep_alive_seconds(llm_keep_alive)
+    refresco_s = keep_alive_s / 2 if keep_alive_s else None
+    ultimo_uso = time.monotonic()
+    
+    def new_executor():
+        if workers <= 1:
+            return None
+        return ProcessPoolExecutor(max_workers=workers, initializer=traza.enable_worker if trazar else None)
+    
+    executor = new_executor()
+    vistos = {}
+    procesados = {}
+    reintentos = {}  # {archivo: time.monotonic() desde el que se puede reintentar}
+    excel_pendiente = False
+    print(f"Vigilando {input_dir} cada {intervalo_s}s (Ctrl+C para terminar)")
+    try:
+        while True:
+            if update_dates():
+                print(f"\nNuevo día: vigilando {input_dir}")
+                vistos.clear()
+                procesados.clear()
+                reintentos.clear()
+            
+            ahora = time.monotonic()
+            listos = [pdf_file for pdf_file in ready_files(input_dir, vistos, procesados, estabilidad_s)
+                      if reintentos.get(pdf_file, 0) <= ahora]
+            if listos:
+                print(f"\n{len(listos)} archivo(s) nuevo(s): {', '.join(f.name for f in listos)}")
+                try:
+                    salida_dir, timestamp = report_paths()
+                    registro = RegistroMetricas(salida_dir / f"Metricas NDFs {timestamp}.jsonl")
+                    try:
+                        fallidos = set(process_batch(listos, cache, bitacora, client, registro, executor=executor))
+                    finally:
+                        print_summary(registro.close())
+                except Exception as e:
+                    # Lo ya copiado quedó en la bitácora; el reintento retoma desde ahí
+                    print(f"Error procesando el lote ({type(e).__name__}: {e}); "
+                          f"se reintenta en {vigilancia_reintento_s}s")
+                    fallidos = set(listos)
+                    if isinstance(e, BrokenProcessPool):
+                        print("El pool de procesos se cayó; se crea uno nuevo")
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        executor = new_executor()
+                
+                for pdf_file in listos:
+                    if pdf_file in fallidos:
+                        reintentos[pdf_file] = time.monotonic() + vigilancia_reintento_s
+                    else:
+                        reintentos.pop(pdf_file, None)
+                        procesados[pdf_file] = vistos.pop(pdf_file)[0]
+                excel_pendiente = True
+                ultimo_uso = time.monotonic()
+            elif refresco_s and time.monotonic() - ultimo_uso >= refresco_s:
+                if not manager.refresh():
+                    print("No se pudo renovar el keep_alive del modelo; se reintenta en el próximo ciclo")
+                else:
+                    ultimo_uso = time.monotonic()
+            
+            if excel_pendiente:
+                try:
+                    write_excel(bitacora)
+                    excel_pendiente = False
+                except PermissionError:
+                    # El Excel está abierto en otro equipo; se reintenta en el próximo ciclo
+                    print("No se pudo actualizar el Excel (¿está abierto?); se reintenta en el próximo ciclo")
+            
+            time.sleep(intervalo_s)
+    except KeyboardInterrupt:
+        print("\nVigilancia detenida")
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        manager.release()
+        client.close()
+        cache.evict()
+        bitacora.close()
+        if trazar:
+            salida_dir, timestamp = report_paths()
+            traza_path = salida_dir / f"Traza NDFs {timestamp}.json"
+            print(f"Traza guardada en: {traza_path} ({traza.write(traza_path)} eventos)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lectura de cartas NDF")
+    parser.add_argument("--vigilar", action="store_true",
+                        help="Quedarse vigilando la carpeta del día y procesar los PDFs a medida que llegan")
+    parser.add_argument("--workers", type=int, default=num_workers, help="Procesos para la extracción de texto")
+    args = parser.parse_args()
+    if args.vigilar:
+        watch(workers=args.workers)
+    else:
+        main(workers=args.workers)
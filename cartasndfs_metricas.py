@@ -0,0 +1,159 @@
+"""
+Métricas de tiempo y tokens por documento
+Cada documento deja un registro JSON por línea y al final de la corrida se
+agrega un resumen con percentiles por etapa
+"""
+import json
+import time
+from contextlib import contextmanager
+import cartasndfs_traza as traza
+
+# Etapas que se miden por documento, en el orden del pipeline
+ETAPAS = ("lectura", "apertura", "capa_texto", "render", "preproceso", "ocr", "deteccion_banco", "regex", "llm", "copia")
+PERCENTILES = (50, 90, 95)
+
+
+class Cronometro:
+    """Acumula milisegundos por etapa; una etapa puede medirse varias veces"""
+
+    def __init__(self):
+        self._tiempos = {}
+
+    @contextmanager
+    def etapa(self, nombre):
+        """Mide el bloque with y lo suma a la etapa; con la traza activa también queda como span"""
+        inicio = time.perf_counter()
+        try:
+            with traza.span(nombre, "etapa"):
+                yield
+        finally:
+            self.add(nombre, (time.perf_counter() - inicio) * 1000)
+
+    def add(self, nombre, ms):
+        """Suma milisegundos medidos por fuera (p. ej. en el hilo de renderizado)"""
+        self._tiempos[nombre] = self._tiempos.get(nombre, 0.0) + ms
+
+    def as_dict(self):
+        """Tiempos en milisegundos redondeados, listos para JSON y para pasar entre procesos"""
+        return {nombre: round(ms, 1) for nombre, ms in self._tiempos.items()}
+
+
+def percentile(values, p):
+    """Percentil p (0-100) con interpolación lineal; None si no hay valores"""
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def summarize(registros, segundos_corrida):
+    """
+    Resume los registros de una corrida
+
+    Args:
+        registros: Registros por documento (ver RegistroMetricas.write)
+        segundos_corrida: Tiempo de pared de la corrida completa
+
+    Returns:
+        dict: Documentos, throughput, tokens y, por etapa, n/p50/p90/p95/max/total en ms
+    """
+    etapas = {}
+    nombres = list(ETAPAS) + ["extraccion", "total"]
+    for nombre in nombres:
+        valores = [r["tiempos_ms"][nombre] for r in registros if nombre in r["tiempos_ms"]]
+        if not valores:
+            continue
+        resumen = {"n": len(valores)}
+        for p in PERCENTILES:
+            resumen[f"p{p}"] = round(percentile(valores, p), 1)
+        resumen["max"] = round(max(valores), 1)
+        resumen["total"] = round(sum(valores), 1)
+        etapas[nombre] = resumen
+
+    llm = [r["llm"] for r in registros if r.get("llm")]
+    return {
+        "tipo": "resumen",
+        "documentos": len(registros),
+        "desde_cache": sum(1 for r in registros if r.get("cache")),
+        "paginas_ocr": sum(len(r.get("ocr_paginas", [])) for r in registros),
+        "segundos": round(segundos_corrida, 2),
+        "docs_por_hora": round(len(registros) / segundos_corrida * 3600) if segundos_corrida else None,
+        "llamadas_llm": len(llm),
+        "tokens_prompt": sum(m.get("prompt_eval_count", 0) for m in llm),
+        "tokens_generados": sum(m.get("eval_count", 0) for m in llm),
+        "etapas": etapas,
+    }
+
+
+def print_summary(resumen):
+    """Imprime el resumen de la corrida como tabla"""
+    print(f"\nResumen de tiempos: {resumen['documentos']} documentos ({resumen['desde_cache']} desde caché) "
+          f"en {resumen['segundos']} s")
+    print(f"{'Etapa':<18}{'n':>5}{'p50 ms':>10}{'p90 ms':>10}{'p95 ms':>10}{'max ms':>10}{'total s':>10}")
+    for nombre, etapa in resumen["etapas"].items():
+        print(f"{nombre:<18}{etapa['n']:>5}{etapa['p50']:>10.1f}{etapa['p90']:>10.1f}"
+              f"{etapa['p95']:>10.1f}{etapa['max']:>10.1f}{etapa['total'] / 1000:>10.2f}")
+    if resumen["llamadas_llm"]:
+        print(f"LLM: {resumen['llamadas_llm']} llamadas, {resumen['tokens_prompt']} tokens de prompt, "
+              f"{resumen['tokens_generados']} generados")
+
+
+def llm_metrics(metricas):
+    """Pasa las duraciones de Ollama de nanosegundos a milisegundos"""
+    resultado = {}
+    for key, value in metricas.items():
+        if key.endswith("_duration"):
+            resultado[key.replace("_duration", "_ms")] = round(value / 1e6, 1)
+        else:
+            resultado[key] = value
+    return resultado
+
+
+class RegistroMetricas:
+    """Archivo JSON lines con un registro por documento y el resumen de la corrida al final"""
+
+    def __init__(self, path):
+        """
+        Inicializa el registro
+
+        Args:
+            path: Ruta del archivo .jsonl; si existe se agregan líneas al final
+        """
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.registros = []
+        self.inicio = time.perf_counter()
+        self.run_id = time.strftime("%Y%m%d-%H%M%S")
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _write_line(self, data):
+        self._file.write(json.dumps(dict(data, run_id=self.run_id), ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def write(self, registro):
+        """Agrega el registro de un documento; "tiempos_ms" es obligatorio"""
+        registro = dict(registro, tipo="documento")
+        self.registros.append(registro)
+        self._write_line(registro)
+
+    def close(self):
+        """
+        Escribe el resumen de la corrida y cierra el archivo
+
+        Returns:
+            dict: Resumen (ver summarize)
+        """
+        resumen = summarize(self.registros, time.perf_counter() - self.inicio)
+        self._write_line(resumen)
+        self._file.close()
+        return resumen
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self._file.closed:
+            self.close()
@@ -0,0 +1,281 @@
+"""
+Motores de OCR que mantienen Tesseract cargado entre páginas
+pytesseract lanza un proceso tesseract por página, que vuelve a cargar los modelos
+eng+spa y recibe la imagen por un PNG temporal. Los motores persistentes cargan los
+modelos una vez por hilo (en la práctica, una vez por proceso del pool de extracción)
+y reciben la imagen en memoria. Cada llamada puede pedir otra segmentación (psm) y una
+lista de caracteres permitidos (whitelist), p. ej. para leer solo una región con números
+
+Con motor "auto" se usa el primero disponible:
+    tesserocr    -> paquete tesserocr (API de Tesseract en proceso)
+    capi         -> API C de libtesseract por ctypes, sin dependencias extra
+    pytesseract  -> un proceso por página (comportamiento anterior)
+"""
+import os
+import shutil
+import ctypes
+import ctypes.util
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import pytesseract
+
+MOTORES_AUTO = ("tesserocr", "capi", "pytesseract")
+PSM_AUTO = 3  # Segmentación automática, la de la línea de comandos de tesseract
+VARIABLE_WHITELIST = "tessedit_char_whitelist"
+
+_local = threading.local()
+
+
+def _tesseract_dir():
+    """Carpeta del ejecutable configurado en pytesseract (en Windows trae la DLL y tessdata)"""
+    cmd = pytesseract.pytesseract.tesseract_cmd
+    ruta = shutil.which(cmd) or cmd
+    return Path(ruta).resolve().parent if ruta and Path(ruta).exists() else None
+
+
+def _tessdata_dir():
+    """tessdata junto al ejecutable, o None para que Tesseract use TESSDATA_PREFIX o su ruta por defecto"""
+    if os.environ.get("TESSDATA_PREFIX"):
+        return None
+    carpeta = _tesseract_dir()
+    if carpeta is not None and (carpeta / "tessdata").is_dir():
+        return str(carpeta / "tessdata")
+    return None
+
+
+def _find_libtesseract():
+    """Ruta de libtesseract: junto al ejecutable (instalador de Windows) o en las rutas del sistema"""
+    carpeta = _tesseract_dir()
+    if carpeta is not None:
+        for patron in ("libtesseract*.dll", "tesseract*.dll", "libtesseract*.so*", "libtesseract*.dylib"):
+            encontrados = sorted(carpeta.glob(patron))
+            if encontrados:
+                if hasattr(os, "add_dll_directory"):
+                    # Las DLL de las que depende libtesseract (leptonica, etc.) están en la misma carpeta
+                    os.add_dll_directory(str(carpeta))
+                return str(encontrados[-1])
+    return ctypes.util.find_library("tesseract")
+
+
+class MotorOCR(ABC):
+    """Motor de OCR; cada instancia la usa un solo hilo"""
+
+    nombre = ""
+
+    def text(self, image, dpi=None, psm=None, whitelist=None):
+        """Texto de la imagen PIL"""
+        return self.text_with_confidence(image, dpi, psm, whitelist)[0]
+
+    @abstractmethod
+    def text_with_confidence(self, image, dpi=None, psm=None, whitelist=None):
+        """
+        Texto de la imagen y confianza media de las palabras
+
+        Args:
+            image: Imagen PIL
+            dpi: Resolución con que se renderizó, si se conoce
+            psm: Modo de segmentación de Tesseract; None = automático
+            whitelist: Caracteres permitidos; None = todos
+
+        Returns:
+            tuple: (texto, confianza 0-100; 0 si no se reconoció ninguna palabra)
+        """
+
+    def close(self):
+        pass
+
+
+class MotorTesserocr(MotorOCR):
+    """Tesseract en proceso a través del paquete tesserocr"""
+
+    nombre = "tesserocr"
+
+    def __init__(self, lang):
+        import tesserocr
+        tessdata = _tessdata_dir()
+        opciones = {"path": tessdata} if tessdata else {}
+        self.api = tesserocr.PyTessBaseAPI(lang=lang, psm=tesserocr.PSM.AUTO, **opciones)
+
+    def _recognize(self, image, dpi, psm, whitelist):
+        self.api.SetPageSegMode(psm if psm is not None else PSM_AUTO)
+        self.api.SetVariable(VARIABLE_WHITELIST, whitelist or "")
+        self.api.SetImage(image)
+        if dpi:
+            self.api.SetSourceResolution(int(dpi))
+        return self.api.GetUTF8Text()
+
+    def text(self, image, dpi=None, psm=None, whitelist=None):
+        try:
+            return self._recognize(image, dpi, psm, whitelist)
+        finally:
+            self.api.Clear()
+
+    def text_with_confidence(self, image, dpi=None, psm=None, whitelist=None):
+        try:
+            text = self._recognize(image, dpi, psm, whitelist)
+            confidences = list(self.api.AllWordConfidences())
+        finally:
+            self.api.Clear()
+        return text, sum(confidences) / len(confidences) if confidences else 0.0
+
+    def close(self):
+        self.api.End()
+
+
+class MotorCAPI(MotorOCR):
+    """Tesseract en proceso a través de la API C de libtesseract (ctypes)"""
+
+    nombre = "capi"
+
+    def __init__(self, lang):
+        ruta = _find_libtesseract()
+        if ruta is None:
+            raise OSError("No se encontró libtesseract")
+        lib = ctypes.CDLL(ruta)
+        api = ctypes.c_void_p
+        lib.TessBaseAPICreate.restype = api
+        lib.TessBaseAPIInit3.argtypes = [api, ctypes.c_char_p, ctypes.c_char_p]
+        lib.TessBaseAPIInit3.restype = ctypes.c_int
+        lib.TessBaseAPISetPageSegMode.argtypes = [api, ctypes.c_int]
+        lib.TessBaseAPISetVariable.argtypes = [api, ctypes.c_char_p, ctypes.c_char_p]
+        lib.TessBaseAPISetVariable.restype = ctypes.c_int
+        lib.TessBaseAPISetImage.argtypes = [api, ctypes.c_char_p, ctypes.c_int, ctypes.c_int,
+                                            ctypes.c_int, ctypes.c_int]
+        lib.TessBaseAPISetSourceResolution.argtypes = [api, ctypes.c_int]
+        # El texto se libera con TessDeleteText: se recibe como puntero, no como str de ctypes
+        lib.TessBaseAPIGetUTF8Text.argtypes = [api]
+        lib.TessBaseAPIGetUTF8Text.restype = ctypes.c_void_p
+        lib.TessDeleteText.argtypes = [ctypes.c_void_p]
+        lib.TessBaseAPIAllWordConfidences.argtypes = [api]
+        lib.TessBaseAPIAllWordConfidences.restype = ctypes.POINTER(ctypes.c_int)
+        lib.TessDeleteIntArray.argtypes = [ctypes.POINTER(ctypes.c_int)]
+        lib.TessBaseAPIClear.argtypes = [api]
+        lib.TessBaseAPIEnd.argtypes = [api]
+        lib.TessBaseAPIDelete.argtypes = [api]
+        self.lib = lib
+
+        self.api = lib.TessBaseAPICreate()
+        tessdata = _tessdata_dir()
+        if lib.TessBaseAPIInit3(self.api, tessdata.encode() if tessdata else None, lang.encode()) != 0:
+            lib.TessBaseAPIDelete(self.api)
+            raise RuntimeError(f"libtesseract no pudo cargar los idiomas {lang}")
+        lib.TessBaseAPISetPageSegMode(self.api, PSM_AUTO)
+
+    def _recognize(self, image, dpi, psm, whitelist):
+        self.lib.TessBaseAPISetPageSegMode(self.api, psm if psm is not None else PSM_AUTO)
+        self.lib.TessBaseAPISetVariable(self.api, VARIABLE_WHITELIST.encode(), (whitelist or "").encode())
+        # Escala de grises de 8 bits: Tesseract binariza sobre gris y copia el buffer al recibirlo
+        gris = image if image.mode == "L" else image.convert("L")
+        self.lib.TessBaseAPISetImage(self.api, gris.tobytes(), gris.width, gris.height, 1, gris.width)
+        if dpi:
+            self.lib.TessBaseAPISetSourceResolution(self.api, int(dpi))
+        puntero = self.lib.TessBaseAPIGetUTF8Text(self.api)
+        if not puntero:
+            return ""
+        try:
+            return ctypes.string_at(puntero).decode("utf-8", errors="replace")
+        finally:
+            self.lib.TessDeleteText(puntero)
+
+    def text(self, image, dpi=None, psm=None, whitelist=None):
+        try:
+            return self._recognize(image, dpi, psm, whitelist)
+        finally:
+            self.lib.TessBaseAPIClear(self.api)
+
+    def text_with_confidence(self, image, dpi=None, psm=None, whitelist=None):
+        try:
+            text = self._recognize(image, dpi, psm, whitelist)
+            confidences = []
+            puntero = self.lib.TessBaseAPIAllWordConfidences(self.api)
+            if puntero:
+                # Arreglo terminado en -1
+                i = 0
+                while puntero[i] != -1:
+                    confidences.append(puntero[i])
+                    i += 1
+                self.lib.TessDeleteIntArray(puntero)
+        finally:
+            self.lib.TessBaseAPIClear(self.api)
+        return text, sum(confidences) / len(confidences) if confidences else 0.0
+
+    def close(self):
+        self.lib.TessBaseAPIEnd(self.api)
+        self.lib.TessBaseAPIDelete(self.api)
+
+
+class MotorPytesseract(MotorOCR):
+    """Un proceso tesseract por página; respaldo cuando no hay un motor en proceso"""
+
+    nombre = "pytesseract"
+
+    def __init__(self, lang):
+        self.lang = lang
+
+    @staticmethod
+    def _config(dpi, psm, whitelist):
+        opciones = []
+        if dpi:
+            opciones.append(f"--dpi {int(dpi)}")
+        if psm is not None:
+            opciones.append(f"--psm {int(psm)}")
+        if whitelist:
+            opciones.append(f"-c {VARIABLE_WHITELIST}={whitelist}")
+        return " ".join(opciones)
+
+    def text(self, image, dpi=None, psm=None, whitelist=None):
+        return pytesseract.image_to_string(image, lang=self.lang, config=self._config(dpi, psm, whitelist))
+
+    def text_with_confidence(self, image, dpi=None, psm=None, whitelist=None):
+        data = pytesseract.image_to_data(image, lang=self.lang, config=self._config(dpi, psm, whitelist),
+                                         output_type=pytesseract.Output.DICT)
+        lines = {}
+        confidences = []
+        for i, word in enumerate(data["text"]):
+            word = word.strip()
+            conf = float(data["conf"][i])
+            if not word or conf < 0:
+                continue
+            confidences.append(conf)
+            # Reconstruir el texto por líneas en orden de lectura
+            key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            lines.setdefault(key, []).append(word)
+
+        text = "\n".join(" ".join(words) for words in lines.values()) + "\n"
+        return text, sum(confidences) / len(confidences) if confidences else 0.0
+
+
+MOTORES = {"tesserocr": MotorTesserocr, "capi": MotorCAPI, "pytesseract": MotorPytesseract}
+
+
+def get_engine(lang, motor="auto"):
+    """
+    Motor de OCR de este hilo; se crea la primera vez y queda cargado mientras viva el hilo
+
+    Args:
+        lang: Idiomas de Tesseract, p. ej. "eng+spa"
+        motor: "auto" o uno de MOTORES
+
+    Returns:
+        MotorOCR: Motor listo para usar
+
+    Raises:
+        RuntimeError: Si el motor pedido (o ninguno en modo auto) se puede cargar
+    """
+    motores = getattr(_local, "motores", None)
+    if motores is None:
+        motores = _local.motores = {}
+    clave = (lang, motor)
+    if clave not in motores:
+        errores = []
+        for nombre in (MOTORES_AUTO if motor == "auto" else (motor,)):
+            try:
+                motores[clave] = MOTORES[nombre](lang)
+                break
+            except Exception as e:  # ImportError, OSError o error de inicialización: se prueba el siguiente
+                errores.append(f"{nombre}: {e}")
+        else:
+            raise RuntimeError("No se pudo cargar un motor de OCR (" + "; ".join(errores) + ")")
+    return motores[clave]
@@ -0,0 +1,290 @@
+"""
+Renderizado y OCR de PDFs escaneados página por página
+Cada página se renderiza, se pasa por OCR y se libera antes de cargar más
+páginas de las que caben en el presupuesto de memoria. El OCR lo hace el motor
+de cartasndfs_motor_ocr, que recibe las imágenes en memoria; antes, por defecto,
+cartasndfs_preproceso las binariza, endereza y recorta
+"""
+import time
+import queue
+import threading
+import fitz
+from PIL import Image
+import cartasndfs_traza as traza
+from cartasndfs_motor_ocr import get_engine
+from cartasndfs_preproceso import preprocess
+
+OCR_LANG = 'eng+spa'
+BYTES_POR_PIXEL = 3  # Imágenes RGB; 1 si se renderiza en escala de grises
+TAMANO_CARTA_PTS = (612.0, 792.0)
+
+
+def estimate_page_bytes(page_size, dpi, bytes_por_pixel=BYTES_POR_PIXEL):
+    """
+    Estima la memoria que ocupa una página renderizada
+
+    Args:
+        page_size: (ancho, alto) de la página en puntos; None para tamaño carta
+        dpi: Resolución de renderizado
+        bytes_por_pixel: 3 para RGB, 1 para escala de grises
+
+    Returns:
+        int: Bytes aproximados de la imagen en memoria
+    """
+    width_pts, height_pts = page_size or TAMANO_CARTA_PTS
+    width_px = width_pts / 72 * dpi
+    height_px = height_pts / 72 * dpi
+    return int(width_px * height_px * bytes_por_pixel)
+
+
+def render_page(page, dpi, grayscale=False):
+    """
+    Renderiza una página de PyMuPDF
+
+    Returns:
+        Image: Imagen PIL en modo L (grayscale) o RGB
+    """
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY if grayscale else fitz.csRGB, alpha=False)
+    return Image.frombytes("L" if grayscale else "RGB", (pix.width, pix.height), pix.samples)
+
+
+def _open_pdf(pdf):
+    """(documento de PyMuPDF, True si hay que cerrarlo) para una ruta, bytes o un documento ya abierto"""
+    if isinstance(pdf, fitz.Document):
+        return pdf, False
+    if isinstance(pdf, (bytes, bytearray)):
+        return fitz.open(stream=pdf, filetype="pdf"), True
+    return fitz.open(pdf), True
+
+
+def iter_page_images(pdf, dpi, memoria_max_mb=400, pages=None, grayscale=False):
+    """
+    Genera las páginas del PDF como imágenes, una por una
+
+    Un hilo renderiza la página siguiente mientras el consumidor hace OCR de la
+    actual. Un semáforo limita cuántas páginas viven en memoria a la vez: la
+    página se libera cuando el consumidor pide la siguiente.
+
+    Las páginas se renderizan con PyMuPDF desde el documento en memoria: sin
+    archivos temporales ni procesos de Poppler por página
+
+    Args:
+        pdf: Ruta del PDF, su contenido en bytes o un fitz.Document abierto (y ya
+            descifrado); el documento no debe usarse desde otro hilo mientras se itera
+        dpi: Resolución de renderizado
+        memoria_max_mb: Memoria máxima para imágenes renderizadas
+        pages: Números de página (desde 1) a renderizar; None para todas
+        grayscale: Renderizar en escala de grises (un tercio de la memoria de RGB)
+
+    Yields:
+        tuple: (numero_pagina, imagen PIL, milisegundos de renderizado). El
+            renderizado corre en paralelo con el OCR, así que no suma al tiempo de pared
+    """
+    doc, cerrar = _open_pdf(pdf)
+    if pages is None:
+        pages = range(1, doc.page_count + 1)
+    # Presupuesto según la página más grande de las que se renderizan
+    page_size = max(((doc[n - 1].rect.width, doc[n - 1].rect.height) for n in pages),
+                    key=lambda size: size[0] * size[1], default=None)
+    page_bytes = estimate_page_bytes(page_size, dpi, 1 if grayscale else BYTES_POR_PIXEL)
+    # Siempre cabe al menos una página; con dos o más se solapan render y OCR
+    max_paginas = max(1, int(memoria_max_mb * 1024 * 1024 // page_bytes))
+
+    cupos = threading.Semaphore(max_paginas)
+    cola = queue.Queue()
+    detener = threading.Event()
+
+    def renderizar():
+        try:
+            for page_number in pages:
+                while not cupos.acquire(timeout=0.1):
+                    if detener.is_set():
+                        return
+                if detener.is_set():
+                    return
+                inicio = time.perf_counter()
+                with traza.span("render", "ocr", pagina=page_number, dpi=dpi):
+                    image = render_page(doc[page_number - 1], dpi, grayscale)
+                cola.put((page_number, image, (time.perf_counter() - inicio) * 1000))
+            cola.put(None)
+        except Exception as e:
+            cola.put(e)
+
+    hilo = threading.Thread(target=renderizar, name="render-pdf", daemon=True)
+    hilo.start()
+    try:
+        while True:
+            item = cola.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            page_number, image, render_ms = item
+            try:
+                yield page_number, image, render_ms
+            finally:
+                image.close()
+                cupos.release()
+    finally:
+        detener.set()
+        hilo.join()
+        if cerrar:
+            doc.close()
+
+
+def _prepare_page(image, page_number, dpi, preproceso):
+    """
+    Preprocesa la página si está activado
+
+    Returns:
+        tuple: (imagen para el OCR, milisegundos de preprocesamiento)
+    """
+    if not preproceso:
+        return image, 0.0
+    inicio = time.perf_counter()
+    with traza.span("preproceso", "ocr", pagina=page_number, dpi=dpi) as args:
+        image, info = preprocess(image, dpi)
+        args.update(info)
+    return image, (time.perf_counter() - inicio) * 1000
+
+
+def ocr_pdf(pdf, dpi, memoria_max_mb=400, pages=None, motor="auto", preproceso=True):
+    """
+    Hace OCR de las páginas del PDF sin tenerlas todas en memoria
+
+    Returns:
+        list: Dicts {"pagina", "dpi", "motor", "texto", "render_ms", "preproceso_ms", "ocr_ms"}
+            en orden de página
+    """
+    engine = get_engine(OCR_LANG, motor)
+    paginas = []
+    for page_number, image, render_ms in iter_page_images(pdf, dpi, memoria_max_mb, pages=pages,
+                                                          grayscale=preproceso):
+        image, preproceso_ms = _prepare_page(image, page_number, dpi, preproceso)
+        inicio = time.perf_counter()
+        with traza.span("ocr", "ocr", pagina=page_number, dpi=dpi, motor=engine.nombre):
+            text = engine.text(image, dpi)
+        paginas.append({
+            "pagina": page_number, "dpi": dpi, "motor": engine.nombre, "texto": text,
+            "render_ms": render_ms, "preproceso_ms": preproceso_ms,
+            "ocr_ms": (time.perf_counter() - inicio) * 1000
+        })
+    return paginas
+
+
+def ocr_with_confidence(image, dpi=None, motor="auto"):
+    """
+    Hace OCR de una imagen y calcula la confianza media de las palabras
+
+    Args:
+        image: Imagen PIL de la página
+        dpi: Resolución con que se renderizó, si se conoce
+        motor: Motor de OCR ("auto" o uno de cartasndfs_motor_ocr.MOTORES)
+
+    Returns:
+        tuple: (texto, confianza 0-100; 0 si no se reconoció ninguna palabra)
+    """
+    return get_engine(OCR_LANG, motor).text_with_confidence(image, dpi)
+
+
+def ocr_pdf_adaptive(pdf, dpis, umbral_confianza, memoria_max_mb=400, pages=None, motor="auto",
+                     preproceso=True):
+    """
+    OCR con resolución adaptativa
+
+    Todas las páginas se leen primero a la resolución más baja. Las páginas
+    con confianza menor al umbral se vuelven a renderizar con la siguiente
+    resolución de la lista, hasta superar el umbral o agotar la lista. Cada
+    pasada es un recorrido en streaming, así que respeta el presupuesto de
+    memoria.
+
+    Args:
+        pdf: Ruta del PDF, su contenido en bytes o un fitz.Document abierto; con un
+            documento abierto todas las pasadas renderizan desde él
+        dpis: Resoluciones a probar, de menor a mayor
+        umbral_confianza: Confianza media mínima (0-100) para aceptar una página
+        memoria_max_mb: Memoria máxima para imágenes renderizadas
+        pages: Números de página (desde 1) a procesar; None para todas
+        motor: Motor de OCR ("auto" o uno de cartasndfs_motor_ocr.MOTORES)
+        preproceso: Binarizar, enderezar y recortar cada página antes del OCR
+
+    Returns:
+        list: Dicts {"pagina", "dpi", "motor", "confianza", "intentos", "texto", "render_ms",
+            "preproceso_ms", "ocr_ms"} en orden de página; los tiempos suman todos los intentos
+    """
+    engine = get_engine(OCR_LANG, motor)
+    resultados = {}
+    intentos = {}
+    tiempos = {}
+    pendientes = pages  # None = todas las páginas en la primera pasada
+    for dpi in dpis:
+        for page_number, image, render_ms in iter_page_images(pdf, dpi, memoria_max_mb,
+                                                              pages=pendientes, grayscale=preproceso):
+            image, preproceso_ms = _prepare_page(image, page_number, dpi, preproceso)
+            inicio = time.perf_counter()
+            with traza.span("ocr", "ocr", pagina=page_number, dpi=dpi, motor=engine.nombre) as args:
+                text, confianza = engine.text_with_confidence(image, dpi)
+                args["confianza"] = round(confianza, 1)
+            ocr_ms = (time.perf_counter() - inicio) * 1000
+            intentos[page_number] = intentos.get(page_number, 0) + 1
+            render_total, preproceso_total, ocr_total = tiempos.get(page_number, (0.0, 0.0, 0.0))
+            tiempos[page_number] = (render_total + render_ms, preproceso_total + preproceso_ms, ocr_total + ocr_ms)
+            anterior = resultados.get(page_number)
+            # Una resolución mayor no siempre lee mejor: se conserva la mejor lectura
+            if anterior is None or confianza > anterior["confianza"]:
+                resultados[page_number] = {"pagina": page_number, "dpi": dpi, "motor": engine.nombre,
+                                           "confianza": confianza, "texto": text}
+        pendientes = [n for n, r in sorted(resultados.items()) if r["confianza"] < umbral_confianza]
+        if not pendientes:
+            break
+
+    return [
+        dict(resultados[n], intentos=intentos[n], render_ms=tiempos[n][0], preproceso_ms=tiempos[n][1],
+             ocr_ms=tiempos[n][2])
+        for n in sorted(resultados)
+    ]
+
+
+def page_has_text_layer(page, min_chars=40, min_glifos_legibles=0.9, max_cobertura_imagen=0.85,
+                        min_cobertura_texto=0.03):
+    """
+    Decide si una página de PyMuPDF tiene texto embebido utilizable
+
+    Una página se considera digital si tiene suficientes caracteres, si casi
+    todos sus glifos se mapean a Unicode (los que no, salen como U+FFFD) y si
+    no es una imagen a página completa con apenas unas líneas de texto encima.
+
+    Args:
+        page: Página de fitz
+        min_chars: Mínimo de caracteres no blancos
+        min_glifos_legibles: Fracción mínima de glifos con mapeo Unicode
+        max_cobertura_imagen: Fracción de la página cubierta por imágenes a partir
+            de la cual se exige min_cobertura_texto
+        min_cobertura_texto: Fracción mínima de la página cubierta por bloques de texto
+
+    Returns:
+        bool: True si basta con get_text() y no hace falta OCR
+    """
+    chars = [c for c in page.get_text() if not c.isspace()]
+    if len(chars) < min_chars:
+        return False
+
+    legibles = sum(1 for c in chars if c != "\ufffd" and c.isprintable())
+    if legibles / len(chars) < min_glifos_legibles:
+        return False
+
+    page_rect = page.rect
+    page_area = page_rect.width * page_rect.height or 1.0
+    image_area = 0.0
+    for info in page.get_image_info():
+        bbox = fitz.Rect(info["bbox"]) & page_rect
+        image_area += bbox.width * bbox.height
+    if image_area / page_area < max_cobertura_imagen:
+        return True
+
+    # Escaneo con algo de texto (sellos, pies de página): solo cuenta si el texto cubre la página
+    text_area = sum(
+        fitz.Rect(block[:4]).width * fitz.Rect(block[:4]).height
+        for block in page.get_text("blocks") if block[6] == 0
+    )
+    return text_area / page_area >= min_cobertura_texto
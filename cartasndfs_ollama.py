@@ -0,0 +1,342 @@
+"""
+Cliente HTTP para Ollama con sesión reutilizable y peticiones concurrentes
+"""
+import json
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+# Métricas que Ollama incluye en la respuesta final (duraciones en nanosegundos)
+METRICAS_OLLAMA = (
+    "total_duration", "load_duration", "prompt_eval_count",
+    "prompt_eval_duration", "eval_count", "eval_duration"
+)
+
+# Tras cerrarse el objeto JSON se siguen leyendo mensajes hasta el final (done), que trae
+# las métricas; el modelo suele emitir antes espacios o saltos de línea. Límite por si no llega
+DRENAJE_MAX_MENSAJES = 32
+DRENAJE_MAX_S = 2.0
+
+
+def ollama_stats(response):
+    """Extrae de una respuesta de Ollama solo los campos de métricas"""
+    return {key: response[key] for key in METRICAS_OLLAMA if key in response}
+
+
+def keep_alive_seconds(keep_alive):
+    """
+    Segundos de un keep_alive de Ollama: número (segundos) o duración como "90s", "30m", "1h"
+
+    Returns:
+        float: Segundos, o None si es negativo (el modelo no se descarga nunca)
+    """
+    if isinstance(keep_alive, str):
+        unidades = {"s": 1, "m": 60, "h": 3600}
+        unidad = keep_alive[-1:]
+        segundos = float(keep_alive[:-1]) * unidades[unidad] if unidad in unidades else float(keep_alive)
+    else:
+        segundos = float(keep_alive)
+    return None if segundos < 0 else segundos
+
+
+class OllamaClient:
+    """Cliente de la API de Ollama que reutiliza conexiones y limita las peticiones en vuelo"""
+
+    def __init__(self, base_url="http://localhost:11434", max_en_vuelo=2, timeout=280):
+        """
+        Inicializa el cliente
+
+        Args:
+            base_url: URL del servidor Ollama
+            max_en_vuelo: Máximo de peticiones simultáneas. Para que el servidor las
+                atienda en paralelo debe arrancar con OLLAMA_NUM_PARALLEL >= este valor
+            timeout: Timeout por petición en segundos (depende mucho de la potencia del equipo)
+        """
+        self.base_url = base_url.rstrip("/")
+        self.max_en_vuelo = max(1, max_en_vuelo)
+        self.timeout = timeout
+
+        # Una sola sesión con tantas conexiones keep-alive como peticiones en vuelo
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_en_vuelo)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = None
+
+    def post(self, endpoint, payload, timeout=None):
+        """
+        Envía un POST a la API y devuelve el JSON de respuesta
+
+        Args:
+            endpoint: Ruta de la API, p. ej. "/api/generate"
+            payload: Cuerpo de la petición
+            timeout: Timeout en segundos; por defecto el del cliente
+
+        Returns:
+            dict: Respuesta decodificada
+        """
+        response = self.session.post(f"{self.base_url}{endpoint}", json=payload, timeout=timeout or self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def get(self, endpoint, timeout=None):
+        """Envía un GET a la API y devuelve el JSON de respuesta"""
+        response = self.session.get(f"{self.base_url}{endpoint}", timeout=timeout or self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def generate(self, payload, timeout=None):
+        """Llama a /api/generate sin streaming"""
+        return self.post("/api/generate", dict(payload, stream=False), timeout)
+
+    def generate_json(self, payload, timeout=None):
+        """
+        Llama a /api/generate en streaming y corta apenas se cierra el objeto JSON
+
+        Pensado para usarse con "format" (esquema JSON) y "num_predict": el modelo
+        ya no escribe texto libre y no se espera a que termine de generar espacios
+        u otros tokens después del objeto.
+
+        Args:
+            payload: Cuerpo de la petición (sin "stream")
+            timeout: Timeout en segundos; por defecto el del cliente
+
+        Returns:
+            tuple: (objeto JSON o None si no se cerró un objeto válido,
+                    métricas de Ollama del último mensaje o {} si no llegó dentro de
+                    DRENAJE_MAX_MENSAJES mensajes / DRENAJE_MAX_S segundos tras el objeto)
+        """
+        scanner = _JsonObjectScanner()
+        stats = {}
+        text = ""
+        with self.session.post(f"{self.base_url}/api/generate", json=dict(payload, stream=True),
+                               timeout=timeout or self.timeout, stream=True) as response:
+            response.raise_for_status()
+            lines = response.iter_lines()
+            for line in lines:
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise RuntimeError(chunk["error"])
+                text += chunk.get("response", "")
+                if chunk.get("done"):
+                    scanner.feed(chunk.get("response", ""))
+                    stats = ollama_stats(chunk)
+                    break
+                if scanner.feed(chunk.get("response", "")):
+                    # Los tokens que siguen al objeto (espacios, saltos de línea) se descartan
+                    # hasta el mensaje final con las métricas; si tarda, se cierra la conexión
+                    limite = time.perf_counter() + DRENAJE_MAX_S
+                    for _, line in zip(range(DRENAJE_MAX_MENSAJES), lines):
+                        if line:
+                            chunk = json.loads(line)
+                            if chunk.get("done"):
+                                stats = ollama_stats(chunk)
+                                break
+                        if time.perf_counter() > limite:
+                            break
+                    break
+
+        if scanner.end is None:
+            return None, stats
+        try:
+            return json.loads(text[scanner.start:scanner.end]), stats
+        except json.JSONDecodeError:
+            return None, stats
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Ejecuta fn en el pool de peticiones en vuelo
+
+        Las tareas por encima de max_en_vuelo esperan en cola, así el OCR puede
+        seguir encolando documentos mientras el modelo responde los anteriores.
+
+        Returns:
+            Future: Resultado de fn
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_en_vuelo, thread_name_prefix="ollama")
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def close(self):
+        """Espera las peticiones pendientes y cierra las conexiones"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class OllamaModelManager:
+    """Carga el modelo antes del lote, verifica que quede residente y lo mantiene cargado hasta terminar"""
+
+    def __init__(self, client, model, keep_alive_lote="1h", keep_alive_final="30m",
+                 timeout_carga=300, intervalo_sondeo=0.5, prefijo=None):
+        """
+        Inicializa el administrador
+
+        Args:
+            client: OllamaClient a usar
+            model: Nombre del modelo, p. ej. "llama3.2:3b"
+            keep_alive_lote: keep_alive durante el lote; mejor finito que -1 (no descargar
+                nunca), que deja el modelo fijo si el proceso muere sin release(). Las
+                peticiones del lote deben enviar el mismo valor: cada una lo reemplaza y lo renueva
+            keep_alive_final: keep_alive que queda al terminar el lote
+            timeout_carga: Segundos máximos esperando que el modelo aparezca en /api/ps
+            intervalo_sondeo: Segundos entre consultas a /api/ps
+            prefijo: Texto "system" a evaluar al arrancar para dejarlo en la caché de prompt
+        """
+        self.client = client
+        self.model = model
+        self.keep_alive_lote = keep_alive_lote
+        self.keep_alive_final = keep_alive_final
+        self.timeout_carga = timeout_carga
+        self.intervalo_sondeo = intervalo_sondeo
+        self.prefijo = prefijo
+        self.arranque = None
+
+    def is_loaded(self):
+        """
+        Consulta /api/ps
+
+        Returns:
+            bool: True si el modelo está cargado en memoria
+        """
+        nombres = {self.model, f"{self.model}:latest"}
+        modelos = self.client.get("/api/ps", timeout=10).get("models", [])
+        return any(m.get("name") in nombres or m.get("model") in nombres for m in modelos)
+
+    def start(self):
+        """
+        Precarga el modelo con keep_alive de nivel superior y espera a que esté residente
+
+        Returns:
+            dict: {"arranque": "frio" | "caliente", "segundos": tiempo hasta quedar residente,
+                   "load_duration_s": tiempo de carga reportado por Ollama}
+        """
+        caliente = self.is_loaded()
+        inicio = time.perf_counter()
+
+        # Sin prompt, /api/generate solo carga el modelo; keep_alive va fuera de "options"
+        respuesta = self.client.post(
+            "/api/generate",
+            {"model": self.model, "keep_alive": self.keep_alive_lote, "stream": False},
+            timeout=self.timeout_carga
+        )
+
+        limite = inicio + self.timeout_carga
+        while not self.is_loaded():
+            if time.perf_counter() > limite:
+                raise TimeoutError(f"El modelo {self.model} no quedó cargado tras {self.timeout_carga} s")
+            time.sleep(self.intervalo_sondeo)
+        segundos = time.perf_counter() - inicio
+
+        if self.prefijo:
+            # Una generación de un token deja evaluado el prefijo fijo para el primer documento
+            self.client.post(
+                "/api/generate",
+                {"model": self.model, "system": self.prefijo, "prompt": ".",
+                 "keep_alive": self.keep_alive_lote, "stream": False, "options": {"num_predict": 1}},
+                timeout=self.timeout_carga
+            )
+
+        self.arranque = {
+            "arranque": "caliente" if caliente else "frio",
+            "segundos": round(segundos, 2),
+            "load_duration_s": round(respuesta.get("load_duration", 0) / 1e9, 2)
+        }
+        return self.arranque
+
+    def refresh(self):
+        """
+        Renueva el keep_alive del lote sin generar: el modelo y el prefijo evaluado siguen
+        en memoria mientras no pase keep_alive_lote sin peticiones
+
+        Returns:
+            bool: True si Ollama aceptó la petición
+        """
+        try:
+            self.client.post(
+                "/api/generate",
+                {"model": self.model, "keep_alive": self.keep_alive_lote, "stream": False},
+                timeout=self.timeout_carga
+            )
+            return True
+        except Exception:
+            return False
+
+    def release(self):
+        """
+        Devuelve el keep_alive al valor normal para que Ollama pueda descargar el modelo
+
+        Returns:
+            bool: True si Ollama aceptó el cambio
+        """
+        try:
+            self.client.post(
+                "/api/generate",
+                {"model": self.model, "keep_alive": self.keep_alive_final, "stream": False},
+                timeout=30
+            )
+            return True
+        except Exception:
+            # Si Ollama ya no responde no hay modelo que liberar
+            return False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class _JsonObjectScanner:
+    """Detecta, en un texto que llega por partes, dónde se cierra el primer objeto JSON"""
+
+    def __init__(self):
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.start = None
+        self.end = None
+
+    def feed(self, fragment):
+        """
+        Procesa un fragmento de texto
+
+        Returns:
+            bool: True cuando el objeto quedó cerrado (start/end son índices del texto completo)
+        """
+        for char in fragment:
+            if self.end is not None:
+                break
+            if self.start is None:
+                if char == "{":
+                    self.start = self.position
+                    self.depth = 1
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = self.position + 1
+            self.position += 1
+        return self.end is not None
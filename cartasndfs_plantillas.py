@@ -0,0 +1,231 @@
+"""
+Plantillas de diseño por banco para OCR por regiones
+En los formatos fijos (cartas ITAÚ _NDFV_FW y las de Scotiabank/Davibank de 7 dígitos)
+los tres campos están siempre en las mismas regiones de la misma página. Con la
+plantilla se renderizan solo esos recortes, a una resolución moderada, y se leen con
+segmentación de una línea y una lista de caracteres permitidos. Si algún valor no pasa
+la validación de cartasndfs_extractores, o si la segunda lectura de los campos de
+verificación no coincide, la plantilla se descarta y se hace el OCR de la página completa
+
+Las regiones están en puntos PDF (1/72 de pulgada) con origen arriba a la izquierda,
+las mismas coordenadas de fitz.Rect y de las reglas de Acrobat. Se miden sobre cartas
+reales de cada banco, no sobre las sintéticas del benchmark
+"""
+import time
+import fitz
+import numpy as np
+from PIL import Image
+import cartasndfs_traza as traza
+from cartasndfs_extractores import find_value
+from cartasndfs_motor_ocr import get_engine
+from cartasndfs_ocr import OCR_LANG, page_has_text_layer
+from cartasndfs_preproceso import adaptive_threshold, crop_borders, to_grayscale
+
+# Subir cada vez que se edite una plantilla: forma parte de la llave de caché
+PLANTILLAS_VERSION = 1
+
+PSM_LINEA = 7  # La región es una sola línea de texto
+CARACTERES_NUMERO = "0123456789.,$"
+CARACTERES_FECHA = "0123456789/-"
+MIN_TINTA_PX = 2  # Píxeles de tinta para que una fila o columna del recorte cuente como texto
+
+
+class Region:
+    """Recorte de una página donde está el valor de un campo"""
+
+    def __init__(self, campo, pagina, bbox, psm=PSM_LINEA, whitelist=None):
+        """
+        Args:
+            campo: Campo que se lee (ver cartasndfs_extractores.CAMPOS)
+            pagina: Número de página desde 1; negativo cuenta desde el final (-1 = última)
+            bbox: (x0, y0, x1, y1) en puntos PDF; debe cubrir el valor y no la etiqueta
+            psm: Modo de segmentación de Tesseract
+            whitelist: Caracteres permitidos; None = todos
+        """
+        self.campo = campo
+        self.pagina = pagina
+        self.bbox = bbox
+        self.psm = psm
+        self.whitelist = whitelist
+
+    def page_index(self, page_count):
+        """Índice (desde 0) de la página en un documento de page_count páginas, o None si no existe"""
+        indice = self.pagina - 1 if self.pagina > 0 else page_count + self.pagina
+        return indice if 0 <= indice < page_count else None
+
+
+class Plantilla:
+    """Diseño de las cartas de un banco: una región por campo"""
+
+    def __init__(self, nombre, regiones, verificar=("tasa_fwd",), dpi=300):
+        """
+        Args:
+            nombre: Nombre del formato; queda en la columna "plantilla" del Excel
+            regiones: Regiones de los campos
+            verificar: Campos que se leen una segunda vez, sin lista de caracteres y a otra
+                resolución; la plantilla solo se acepta si las dos lecturas coinciden
+            dpi: Resolución de renderizado de los recortes
+
+        Raises:
+            ValueError: Si no hay campos de verificación o alguno no tiene región
+        """
+        campos = {region.campo for region in regiones}
+        if not verificar or not set(verificar) <= campos:
+            raise ValueError(f"La plantilla {nombre} necesita al menos un campo de verificación con región")
+        self.nombre = nombre
+        self.regiones = regiones
+        self.verificar = tuple(verificar)
+        self.dpi = dpi
+
+    @property
+    def dpi_verificacion(self):
+        """Resolución de la segunda lectura: distinta para que los errores de las dos no coincidan"""
+        return self.dpi * 4 // 3
+
+
+# Plantillas por banco, con el mismo nombre de banco que asigna _extract_text_from_pdf,
+# p. ej. "ITAÚ" o "DAVIbank". Cada banco tiene las suyas, medidas sobre sus cartas reales:
+#   "ITAÚ": Plantilla("itau_ndfv_fw", [Region("fecha_inicio", 1, (x0, y0, x1, y1), whitelist=CARACTERES_FECHA),
+#                                      Region("valor_nominal_usd", 1, (...), whitelist=CARACTERES_NUMERO),
+#                                      Region("tasa_fwd", 1, (...), whitelist=CARACTERES_NUMERO)])
+# Sin plantilla el banco usa la lectura de la página completa
+PLANTILLAS = {}
+
+
+def render_region(page, bbox, dpi):
+    """
+    Renderiza solo el recorte de la página
+
+    Returns:
+        Image: Imagen PIL en modo L
+    """
+    clip = fitz.Rect(bbox) & page.rect
+    pix = page.get_pixmap(dpi=dpi, clip=clip, colorspace=fitz.csGRAY, alpha=False)
+    return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+
+def _keep_main_line(binary):
+    """Deja solo la franja de filas con tinta que tiene más tinta: la línea del valor, sin los
+    trazos de las líneas vecinas que la región alcanza a cortar arriba o abajo"""
+    tinta = (binary == 0).sum(axis=1)
+    # Unos pocos píxeles sueltos en una fila son ruido del escaneo, no texto
+    con_tinta = np.concatenate([[False], tinta >= MIN_TINTA_PX, [False]])
+    cambios = np.flatnonzero(con_tinta[1:] != con_tinta[:-1])
+    franjas = list(zip(cambios[::2], cambios[1::2]))
+    if len(franjas) > 1:
+        inicio, fin = max(franjas, key=lambda f: tinta[f[0]:f[1]].sum())
+        binary[:inicio] = 255
+        binary[fin:] = 255
+    return binary
+
+
+def _clear_edge_fragments(binary, espacio):
+    """
+    Borra la tinta pegada a los bordes izquierdo y derecho del recorte si la separa del
+    resto un espacio de al menos espacio columnas: es un trozo de la etiqueta (":", la "D"
+    de "USD") que, con la lista de caracteres, Tesseract leería como un dígito más.
+    Los espacios entre dígitos de un mismo número son más angostos, así que el valor no se toca
+    """
+    columnas = (binary == 0).sum(axis=0) >= MIN_TINTA_PX
+    for orden in (np.arange(len(columnas)), np.arange(len(columnas))[::-1]):
+        if not columnas[orden[0]]:
+            continue
+        blancas = 0
+        for i, columna in enumerate(orden):
+            blancas = 0 if columnas[columna] else blancas + 1
+            if blancas >= espacio:
+                binary[:, orden[:i + 1]] = 255
+                break
+    return binary
+
+
+def prepare_region(image, dpi):
+    """Binariza el recorte y quita el fondo alrededor del texto; sin enderezar (es una sola línea)"""
+    binary = adaptive_threshold(to_grayscale(image), max(15, int(dpi / 8) | 1))
+    # Un espacio entre palabras de un cuerpo 10-12 mide ~3 pt
+    binary = _clear_edge_fragments(_keep_main_line(binary), espacio=max(2, int(dpi * 2 / 72)))
+    binary, _ = crop_borders(binary, margen=int(dpi / 20))
+    return Image.fromarray(np.ascontiguousarray(binary), mode="L")
+
+
+def _read_region(engine, page, region, dpi, whitelist, lectura, nombre):
+    """
+    Renderiza, prepara y lee una región, sumando los tiempos en lectura
+
+    Returns:
+        tuple: (texto leído, valor validado o None)
+    """
+    inicio = time.perf_counter()
+    image = render_region(page, region.bbox, dpi)
+    lectura["render_ms"] += (time.perf_counter() - inicio) * 1000
+    inicio = time.perf_counter()
+    image = prepare_region(image, dpi)
+    lectura["preproceso_ms"] += (time.perf_counter() - inicio) * 1000
+
+    inicio = time.perf_counter()
+    with traza.span("ocr_region", "ocr", plantilla=nombre, campo=region.campo, pagina=page.number + 1,
+                    dpi=dpi, motor=engine.nombre) as args:
+        text = engine.text(image, dpi, psm=region.psm, whitelist=whitelist).strip()
+        valor = find_value(region.campo, text)
+        args.update(texto=text, valido=valor is not None)
+    lectura["ocr_ms"] += (time.perf_counter() - inicio) * 1000
+    return text, valor
+
+
+def read_template(documento, plantilla, motor="auto"):
+    """
+    Lee los campos con las regiones de la plantilla
+
+    Se detiene en el primer campo que no se pueda leer o validar. Los campos de
+    plantilla.verificar se leen otra vez sin lista de caracteres y a dpi_verificacion;
+    si la segunda lectura no da el mismo valor, la caja probablemente no está sobre el
+    campo y la plantilla se descarta. Si la página tiene capa de texto tampoco se usa
+    la plantilla: la lectura normal es más barata
+
+    Args:
+        documento: DocumentoPDF
+        plantilla: Plantilla del banco
+        motor: Motor de OCR ("auto" o uno de cartasndfs_motor_ocr.MOTORES)
+
+    Returns:
+        tuple: ({campo: valor} si todos los campos pasaron la validación y la verificación, o None;
+            dict {"texto", "motivo", "render_ms", "preproceso_ms", "ocr_ms"})
+    """
+    engine = get_engine(OCR_LANG, motor)
+    lectura = {"texto": "", "motivo": "", "render_ms": 0.0, "preproceso_ms": 0.0, "ocr_ms": 0.0}
+    campos = {}
+    lineas = []
+    doc = documento.open()
+    try:
+        paginas = {}
+        for region in plantilla.regiones:
+            indice = region.page_index(doc.page_count)
+            if indice is None:
+                lectura["motivo"] = f"el documento no tiene la página {region.pagina}"
+                return None, lectura
+            page = paginas[region.campo] = doc.load_page(indice)
+            if page_has_text_layer(page):
+                lectura["motivo"] = f"la página {indice + 1} tiene capa de texto"
+                return None, lectura
+
+            text, valor = _read_region(engine, page, region, plantilla.dpi, region.whitelist, lectura,
+                                       plantilla.nombre)
+            lineas.append(f"{region.campo}: {text}")
+            lectura["texto"] = "\n".join(lineas) + "\n"
+            if valor is None:
+                lectura["motivo"] = f"{region.campo} no pasó la validación ({text!r})"
+                return None, lectura
+            campos[region.campo] = valor
+
+        for region in plantilla.regiones:
+            if region.campo not in plantilla.verificar:
+                continue
+            text, valor = _read_region(engine, paginas[region.campo], region, plantilla.dpi_verificacion, None,
+                                       lectura, plantilla.nombre)
+            if valor != campos[region.campo]:
+                lectura["motivo"] = (f"{region.campo}: la verificación leyó {text!r}, "
+                                     f"distinto de {campos[region.campo]!r}")
+                return None, lectura
+    finally:
+        doc.close()
+    return campos, lectura
@@ -2,40 +2,71 @@
 Automatización para procesar cartas NDF desde Outlook
 Versión mejorada con manejo de excepciones y mejores prácticas
 """
-import win32com.client
+import os
 import re
 import logging
 import time
 import shutil
+import queue
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, List, Tuple
 from contextlib import contextmanager
 import sys
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import (
-    TimeoutException, 
-    NoSuchElementException, 
-    WebDriverException
-)
+import cartasndfs_traza as traza
+from cartasndfs_adjuntos import IndiceAdjuntos
+from cartasndfs_cache import hash_file
+from cartasndfs_buzon import Adjunto, Buzon, BuzonOutlook, MarcaDeAgua, MensajeInfo
+from cartasndfs_jpm import ClienteJPM
+
+try:
+    import win32com.client
+except ImportError:  # Sin pywin32 solo se puede recolectar desde un Buzon pasado al constructor
+    win32com = None
+
+try:
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import (
+        TimeoutException, 
+        NoSuchElementException, 
+        WebDriverException
+    )
+except ImportError:  # Sin Selenium las descargas JPM solo se hacen por HTTP, sin respaldo
+    webdriver = None
 
 
 class NDFProcessor:
     """Procesador de cartas NDF desde Outlook"""
     
-    def __init__(self, base_output_dir: str = None, downloads_dir: str = None, headless_mode: bool = True):
+    def __init__(self, base_output_dir: str = None, downloads_dir: str = None, headless_mode: bool = True,
+                 trace: Optional[bool] = None, buzon: Optional[Buzon] = None,
+                 fecha_inicial: Optional[datetime] = None, descargas_simultaneas: int = 2,
+                 descarga_http: bool = True):
         """
         Inicializa el procesador
         
         Args:
             base_output_dir: Directorio base para guardar archivos
-            downloads_dir: Directorio de descargas del navegador
+            downloads_dir: Carpeta donde se crean las carpetas temporales de descarga de cada
+                sesión del navegador; por defecto la carpeta temporal del sistema
             headless_mode: Si True, ejecuta Selenium en segundo plano sin ventana visible
+            trace: Si True, guarda una traza Chrome trace-event de la corrida en la carpeta de logs.
+                Por defecto se activa con la variable de entorno CARTASNDFS_TRAZA=1
+            buzon: Buzón del que se recolecta; por defecto la carpeta "Cartas NDF" de Outlook.
+                Un BuzonEml permite correr la recolección sin Outlook
+            fecha_inicial: Fecha desde la que se leen mensajes mientras no haya marca de agua;
+                por defecto el primer día del mes
+            descargas_simultaneas: Descargas JPM que corren a la vez mientras se recorren los mensajes
+            descarga_http: Si True, las confirmaciones JPM se descargan por HTTP sin navegador;
+                Selenium queda como respaldo si el portal cambia o la descarga falla
         """
         self.today = datetime.now()
         self.year = self.today.strftime("%Y")
@@ -45,17 +76,37 @@ class NDFProcessor:
         # Configurar directorios
         self.base_dir = Path(base_output_dir or r"Z:\17. Reporting Automation\Cartas NDFs\Cartas sin firmas")
         self.output_dir = self.base_dir / self.year / self.month / self.day
-        self.downloads_dir = Path(downloads_dir or r"C:\Users\ntorreslo\Downloads")
+        self.downloads_dir = Path(downloads_dir) if downloads_dir else None
         
         # Configurar modo de ejecución
         self.headless_mode = headless_mode
+        self.descargas_simultaneas = descargas_simultaneas
+        self.descarga_timeout_s = 60
+        self.descarga_intervalo_s = 0.1
+        self.trace = os.environ.get("CARTASNDFS_TRAZA") == "1" if trace is None else trace
+        
+        # Cliente HTTP del portal JPM y pool de sesiones del navegador para el respaldo:
+        # (webdriver, carpeta_de_descarga) libres y abiertas
+        self.jpm = ClienteJPM(max_sesiones=descargas_simultaneas) if descarga_http else None
+        self._sesiones = queue.Queue()
+        self._sesiones_abiertas = []
+        self._sesiones_lock = threading.Lock()
+        self._destino_lock = threading.Lock()
+        
+        # Buzón y marca de agua: cada corrida solo pide los mensajes que no ha visto
+        self.buzon = buzon
+        self.fecha_inicial = fecha_inicial or datetime(self.today.year, self.today.month, 1)
+        self.marca = MarcaDeAgua(self.base_dir / "logs" / "buzon_marca.json")
+        
+        # Índice por contenido de todo lo recolectado: un PDF repetido no se guarda dos veces
+        self.indice = IndiceAdjuntos(self.base_dir / "logs" / "adjuntos_indice.jsonl", self.base_dir)
         
         # Configurar logging
         self._setup_logging()
         
         # Expresiones regulares compiladas para mejor rendimiento
         self.safe_filename_pattern = re.compile(r'[^0-9a-zA-ZáéíóúÁÉÍÓÚñÑ\.\-_ ]+')
-        self.url_pattern = re.compile(r"https://[^\s]+")
+        self.url_pattern = re.compile(r"https?://[^\s]+")
         self.code_pattern = re.compile(r"Verification Code:\s*([A-Z0-9]+)")
         
     def _setup_logging(self) -> None:
@@ -97,6 +148,10 @@ class NDFProcessor:
         Returns:
             object: Objeto inbox o None si falla
         """
+        if win32com is None:
+            self.logger.error("pywin32 no está instalado: no se puede conectar con Outlook")
+            return None
+            
         try:
             self.logger.info("Iniciando conexión con Outlook...")
             outlook = win32com.client.Dispatch("Outlook.Application").GetNamespace("MAPI")
@@ -129,59 +184,35 @@ class NDFProcessor:
                 self.logger.error(f"Método alternativo también falló: {e2}")
                 return None
             
-    def _get_filtered_messages(self, inbox: object) -> Tuple[List[object], datetime, datetime]:
+    def _get_filtered_messages(self, buzon: Buzon) -> Tuple[List[MensajeInfo], datetime, datetime]:
         """
-        Obtiene mensajes filtrados por fecha
+        Obtiene los mensajes que no se han procesado
+        
+        Pide al buzón solo los mensajes recibidos desde la marca de agua (o desde
+        fecha_inicial en la primera corrida) y descarta los ya procesados
         
         Args:
-            inbox: Objeto inbox de Outlook
+            buzon: Buzón de donde se leen los mensajes
             
         Returns:
             tuple: (lista_mensajes_filtrados, fecha_inicio, fecha_fin)
         """
         try:
-            messages = inbox.Items
-            messages.Sort("[ReceivedTime]", True)  # Orden descendente
-            
-            self.logger.info(f"Total mensajes en carpeta: {messages.Count}")
-            
-            # Definir rango de fechas
-            #start = datetime(self.today.year, self.today.month, 1)
-            start = datetime(self.today.year, 12, 18)
+            start = self.marca.since(self.fecha_inicial)
             end = self.today
             
-            self.logger.info(f"Filtrando mensajes entre {start.date()} y {end.date()}")
-            
-            # Filtrar manualmente (más confiable que Restrict)
-            filtered_messages = []
+            self.logger.info(f"Filtrando mensajes entre {start} y {end}")
             
-            for i in range(1, messages.Count + 1):
-                try:
-                    message = messages.Item(i)
-                    received = message.ReceivedTime
-                    
-                    # Convertir a naive datetime si tiene zona horaria
-                    if hasattr(received, "tzinfo") and received.tzinfo is not None:
-                        received = received.replace(tzinfo=None)
-                    
-                    # Verificar si está en el rango de fechas
-                    if start <= received <= end:
-                        filtered_messages.append(message)
-                        
-                except Exception as e:
-                    self.logger.warning(f"Error procesando mensaje {i}: {e}")
-                    continue
+            messages = buzon.list_messages(start, end)
+            filtered_messages = self.marca.pending(messages)
             
-            self.logger.info(f"Filtrados {len(filtered_messages)} mensajes del período")
+            self.logger.info(f"Mensajes en el rango: {len(messages)}, sin procesar: {len(filtered_messages)}")
             
             # Log de algunos mensajes encontrados para verificación
             if filtered_messages:
                 self.logger.info("Primeros mensajes encontrados:")
-                for i, msg in enumerate(filtered_messages[:3]):
-                    try:
-                        self.logger.info(f"  - {msg.Subject[:50]} ({msg.ReceivedTime})")
-                    except:
-                        self.logger.info(f"  - Mensaje {i+1} (error leyendo detalles)")
+                for msg in filtered_messages[:3]:
+                    self.logger.info(f"  - {msg.subject[:50]} ({msg.received})")
             
             return filtered_messages, start, end
             
@@ -201,146 +232,204 @@ class NDFProcessor:
         """
         return self.safe_filename_pattern.sub('', filename)
         
-    def _save_attachment(self, attachment: object) -> bool:
+    def _unique_destination(self, filename: str) -> Path:
+        """
+        Ruta en el directorio de salida que no sobrescribe un archivo existente
+        
+        Args:
+            filename: Nombre deseado
+            
+        Returns:
+            Path: Ruta con sufijo de hora (y un contador si en ese segundo ya se usó) si el
+                nombre ya está ocupado. Llamar con _destino_lock tomado hasta mover el archivo
+        """
+        file_path = self.output_dir / filename
+        if file_path.exists():
+            timestamp = datetime.now().strftime("%H%M%S")
+            name_parts = filename.rsplit('.', 1)
+            numero = 1
+            while file_path.exists():
+                sufijo = timestamp if numero == 1 else f"{timestamp}_{numero}"
+                if len(name_parts) == 2:
+                    file_path = self.output_dir / f"{name_parts[0]}_{sufijo}.{name_parts[1]}"
+                else:
+                    file_path = self.output_dir / f"{filename}_{sufijo}"
+                numero += 1
+        return file_path
+        
+    def _save_attachment(self, attachment: Adjunto, origen: str = "") -> bool:
         """
         Guarda un adjunto específico
         
+        El adjunto se escribe primero con extensión .parcial y se compara su SHA-256
+        contra el índice de adjuntos: si el contenido ya se había recolectado se
+        descarta y queda registrado como enlace al archivo existente
+        
         Args:
-            attachment: Objeto attachment de Outlook
+            attachment: Adjunto del mensaje
+            origen: Asunto del mensaje, para el índice
             
         Returns:
-            bool: True si se guardó exitosamente
+            bool: True si se guardó, False si se omitió (no es PDF/xlsx o era un duplicado);
+                None si hubo un error
         """
         try:
-            filename = attachment.FileName.lower()
+            filename = attachment.filename.lower()
             
             if not (filename.endswith(".pdf") or filename.endswith(".xlsx")):
                 return False
                 
-            safe_filename = self._sanitize_filename(attachment.FileName)
-            file_path = self.output_dir / safe_filename
-            
-            # Evitar sobrescribir archivos existentes
-            if file_path.exists():
-                timestamp = datetime.now().strftime("%H%M%S")
-                name_parts = safe_filename.rsplit('.', 1)
-                if len(name_parts) == 2:
-                    safe_filename = f"{name_parts[0]}_{timestamp}.{name_parts[1]}"
-                else:
-                    safe_filename = f"{safe_filename}_{timestamp}"
-                file_path = self.output_dir / safe_filename
-            
-            attachment.SaveAsFile(str(file_path))
-            self.logger.info(f"Adjunto guardado: {safe_filename}")
+            safe_filename = self._sanitize_filename(attachment.filename)
+            
+            # La extensión .parcial evita que la lectura tome el archivo antes de verificarlo
+            partial_path = self.output_dir / f"{safe_filename}.parcial"
+            attachment.save(partial_path)
+            file_hash = hash_file(partial_path)
+            
+            # Consulta, nombre, movimiento e índice bajo el mismo candado que las descargas JPM:
+            # así dos copias del mismo contenido no pasan ambas el control de duplicados y
+            # nadie ocupa el nombre elegido antes del movimiento
+            with self._destino_lock:
+                existente = self.indice.lookup(file_hash)
+                if existente is not None:
+                    partial_path.unlink()
+                    self.indice.link(safe_filename, existente, file_hash, origen)
+                    self.logger.info(f"Adjunto duplicado omitido: {safe_filename} (igual a {existente.name})")
+                    return False
+                
+                # Evitar sobrescribir archivos existentes
+                file_path = self._unique_destination(safe_filename)
+                partial_path.replace(file_path)
+                self.indice.add(file_path, origen, file_hash)
+            self.logger.info(f"Adjunto guardado: {file_path.name}")
             return True
             
         except Exception as e:
-            self.logger.error(f"Error guardando adjunto {attachment.FileName}: {e}")
-            return False
+            self.logger.error(f"Error guardando adjunto {attachment.filename}: {e}")
+            return None
             
-    def process_attachments(self, messages: List[object], start: datetime, end: datetime) -> int:
+    def _create_webdriver(self, download_dir: Path):
         """
-        Procesa todos los adjuntos de los mensajes
+        Abre un navegador que descarga en download_dir
         
         Args:
-            messages: Lista de mensajes filtrados
-            start: Fecha de inicio
-            end: Fecha de fin
+            download_dir: Carpeta de descarga exclusiva de esta sesión
             
         Returns:
-            int: Número de adjuntos procesados
+            webdriver: Instancia del navegador
         """
-        if not messages or len(messages) == 0:
-            self.logger.info("No hay correos con adjuntos para procesar")
-            return 0
-            
-        processed_count = 0
-        
+        # Configurar opciones del navegador
+        chrome_options = Options()
+        
+        # MODO HEADLESS - Ejecuta en segundo plano sin ventana visible
+        if self.headless_mode:
+            chrome_options.add_argument("--headless=new")  # Nuevo modo headless más estable
+            chrome_options.add_argument("--disable-gpu")
+            chrome_options.add_argument("--no-sandbox")
+            chrome_options.add_argument("--disable-dev-shm-usage")
+            chrome_options.add_argument("--disable-extensions")
+            chrome_options.add_argument("--disable-logging")
+            chrome_options.add_argument("--silent")
+            # Configurar tamaño de ventana virtual
+            chrome_options.add_argument("--window-size=1920,1080")
+        else:
+            # Modo visible pero minimizado
+            chrome_options.add_argument("--start-minimized")
+            chrome_options.add_argument("--no-sandbox")
+            chrome_options.add_argument("--disable-dev-shm-usage")
+        
+        # Configurar directorio de descarga
+        prefs = {
+            "download.default_directory": str(download_dir),
+            "download.prompt_for_download": False,
+            "download.directory_upgrade": True,
+            "safebrowsing.enabled": True,
+            "profile.default_content_settings.popups": 0,
+            "profile.default_content_setting_values.automatic_downloads": 1
+        }
+        chrome_options.add_experimental_option("prefs", prefs)
+        
+        driver = webdriver.Chrome(options=chrome_options)
+        driver.set_page_load_timeout(30)
         try:
-            for message in messages:
-                try:
-                    received = message.ReceivedTime
-                    # Manejo seguro de timezone
-                    if hasattr(received, "tzinfo") and received.tzinfo is not None:
-                        received = received.replace(tzinfo=None)
-                        
-                    if not (start <= received <= end):
-                        continue
-                        
-                    attachments = message.Attachments
-                    for attachment in attachments:
-                        if self._save_attachment(attachment):
-                            processed_count += 1
-                            
-                except Exception as e:
-                    self.logger.error(f"Error procesando mensaje: {e}")
-                    continue
-                    
+            # Algunas versiones de Chrome headless ignoran las prefs de descarga sin este comando
+            driver.execute_cdp_cmd("Page.setDownloadBehavior",
+                                   {"behavior": "allow", "downloadPath": str(download_dir)})
         except Exception as e:
-            self.logger.error(f"Error en proceso de adjuntos: {e}")
-            
-        self.logger.info(f"Total de adjuntos procesados: {processed_count}")
-        return processed_count
+            self.logger.warning(f"No se pudo configurar la descarga por CDP: {e}")
+        return driver
+        
+    def _acquire_session(self) -> Optional[Tuple[object, Path]]:
+        """
+        Toma una sesión libre del pool o abre una nueva
         
+        Returns:
+            tuple: (webdriver, carpeta_de_descarga) o None si no se pudo abrir el navegador
+        """
+        while True:
+            try:
+                driver, download_dir = self._sesiones.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                driver.current_url  # La sesión sigue viva
+                return driver, download_dir
+            except Exception:
+                self.logger.warning("Sesión del navegador caída; se descarta")
+                self._quit_session((driver, download_dir))
+                
+        download_dir = Path(tempfile.mkdtemp(prefix="ndf_descargas_", dir=self.downloads_dir))
+        try:
+            with traza.span("abrir_navegador", "selenium"):
+                driver = self._create_webdriver(download_dir)
+        except WebDriverException as e:
+            self.logger.error(f"Error inicializando navegador: {e}")
+            shutil.rmtree(download_dir, ignore_errors=True)
+            return None
+        with self._sesiones_lock:
+            self._sesiones_abiertas.append((driver, download_dir))
+        return driver, download_dir
+        
+    def _quit_session(self, sesion: Tuple[object, Path]) -> None:
+        """Cierra el navegador de una sesión y borra su carpeta de descarga"""
+        driver, download_dir = sesion
+        try:
+            driver.quit()
+        except Exception as e:
+            self.logger.error(f"Error cerrando navegador: {e}")
+        shutil.rmtree(download_dir, ignore_errors=True)
+        with self._sesiones_lock:
+            if sesion in self._sesiones_abiertas:
+                self._sesiones_abiertas.remove(sesion)
+                
     @contextmanager
-    def _get_webdriver(self, headless: bool = True):
+    def _get_webdriver(self):
         """
-        Context manager para manejar el navegador web
+        Context manager que presta una sesión del pool de navegadores
         
-        Args:
-            headless: Si True, ejecuta en modo headless (segundo plano)
+        El navegador se abre la primera vez que se necesita y se reutiliza en las
+        descargas siguientes; se cierra en _close_webdrivers
         
         Yields:
-            webdriver: Instancia del navegador
+            tuple: (webdriver, carpeta_de_descarga), o (None, None) si no se pudo abrir
         """
-        driver = None
+        sesion = self._acquire_session()
+        if sesion is None:
+            yield None, None
+            return
         try:
-            # Configurar opciones del navegador
-            chrome_options = Options()
-            
-            # MODO HEADLESS - Ejecuta en segundo plano sin ventana visible
-            if headless:
-                chrome_options.add_argument("--headless=new")  # Nuevo modo headless más estable
-                chrome_options.add_argument("--disable-gpu")
-                chrome_options.add_argument("--no-sandbox")
-                chrome_options.add_argument("--disable-dev-shm-usage")
-                chrome_options.add_argument("--disable-extensions")
-                chrome_options.add_argument("--disable-logging")
-                chrome_options.add_argument("--silent")
-                # Configurar tamaño de ventana virtual
-                chrome_options.add_argument("--window-size=1920,1080")
-            else:
-                # Modo visible pero minimizado
-                chrome_options.add_argument("--start-minimized")
-                chrome_options.add_argument("--no-sandbox")
-                chrome_options.add_argument("--disable-dev-shm-usage")
-            
-            # Configurar directorio de descarga
-            prefs = {
-                "download.default_directory": str(self.downloads_dir),
-                "download.prompt_for_download": False,
-                "download.directory_upgrade": True,
-                "safebrowsing.enabled": True,
-                "profile.default_content_settings.popups": 0,
-                "profile.default_content_setting_values.automatic_downloads": 1
-            }
-            chrome_options.add_experimental_option("prefs", prefs)
-            
-            driver = webdriver.Chrome(options=chrome_options)
-            driver.set_page_load_timeout(30)
-            
-            yield driver
-            
-        except WebDriverException as e:
-            self.logger.error(f"Error inicializando navegador: {e}")
-            yield None
+            yield sesion
         finally:
-            if driver:
-                try:
-                    driver.quit()
-                except Exception as e:
-                    self.logger.error(f"Error cerrando navegador: {e}")
-                    
+            self._sesiones.put(sesion)
+            
+    def _close_webdrivers(self) -> None:
+        """Cierra todas las sesiones del pool"""
+        with self._sesiones_lock:
+            sesiones = list(self._sesiones_abiertas)
+        for sesion in sesiones:
+            self._quit_session(sesion)
+        self._sesiones = queue.Queue()
+        
     def _extract_url_and_code(self, body: str) -> Tuple[Optional[str], Optional[str]]:
         """
         Extrae URL y código de verificación del cuerpo del correo
@@ -358,7 +447,7 @@ class NDFProcessor:
             return url_match.group(0), code_match.group(1)
         return None, None
         
-    def _automate_download(self, url: str, code: str) -> bool:
+    def _automate_download(self, url: str, code: str) -> Optional[bool]:
         """
         Automatiza la descarga usando Selenium
         
@@ -367,13 +456,14 @@ class NDFProcessor:
             code: Código de verificación
             
         Returns:
-            bool: True si la descarga fue exitosa
+            bool: True si se descargó, False si era un duplicado, None si falló (ver _collect_download)
         """
-        with self._get_webdriver(headless=self.headless_mode) as driver:
+        with self._get_webdriver() as (driver, download_dir):
             if not driver:
-                return False
+                return None
                 
             try:
+                antes = set(os.listdir(download_dir))
                 self.logger.info(f"Accediendo a URL en modo {'headless' if self.headless_mode else 'visible'}: {url}")
                 driver.get(url)
                 wait = WebDriverWait(driver, 15)  # Aumentado timeout para modo headless
@@ -397,67 +487,174 @@ class NDFProcessor:
                 download_link.click()
                 self.logger.info("Descarga iniciada en segundo plano")
                 
-                # Esperar más tiempo en modo headless para que complete la descarga
-                wait_time = 5 if self.headless_mode else 3
-                time.sleep(wait_time)
-                return True
+                # Esperar a que Chrome termine de escribir el archivo
+                with traza.span("esperar_descarga", "selenium"):
+                    file_path = self._wait_for_download(download_dir, antes)
+                if file_path is None:
+                    self.logger.error(f"La descarga no terminó en {self.descarga_timeout_s} s")
+                    return None
+                    
+                return self._collect_download(file_path)
                 
             except TimeoutException:
                 self.logger.error("Timeout esperando elementos en la página")
-                return False
+                return None
             except NoSuchElementException as e:
                 self.logger.error(f"Elemento no encontrado: {e}")
-                return False
+                return None
             except Exception as e:
                 self.logger.error(f"Error durante automatización: {e}")
-                return False
+                return None
                 
-    def _move_downloaded_files(self) -> int:
+    def _wait_for_download(self, download_dir: Path, antes: set) -> Optional[Path]:
         """
-        Mueve archivos PDF descargados al directorio de salida
+        Espera a que termine la descarga iniciada en la carpeta de la sesión
         
+        Chrome escribe en un archivo .crdownload y lo renombra al terminar; la descarga
+        está completa cuando aparece un archivo nuevo y ya no queda ningún .crdownload
+        
+        Args:
+            download_dir: Carpeta de descarga de la sesión
+            antes: Nombres que ya estaban en la carpeta antes de descargar
+            
         Returns:
-            int: Número de archivos movidos
+            Path: Archivo descargado, o None si se agotó descarga_timeout_s
         """
-        moved_count = 0
+        limite = time.monotonic() + self.descarga_timeout_s
+        while time.monotonic() < limite:
+            nuevos = set(os.listdir(download_dir)) - antes
+            en_curso = [n for n in nuevos if n.endswith((".crdownload", ".tmp"))]
+            terminados = sorted(n for n in nuevos if n not in en_curso)
+            if terminados and not en_curso:
+                return download_dir / terminados[0]
+            time.sleep(self.descarga_intervalo_s)
+        return None
+        
+    def _collect_download(self, file_path: Path, filename: Optional[str] = None) -> Optional[bool]:
+        """
+        Mueve un archivo descargado al directorio de salida
         
-        try:
-            pattern = "Confirmation-AE*.pdf"
-            today_date = self.today.date()
+        Args:
+            file_path: Archivo descargado (carpeta de la sesión o .parcial en el directorio de salida)
+            filename: Nombre final; por defecto el del archivo descargado
             
-            for file_path in self.downloads_dir.glob(pattern):
-                try:
-                    if not file_path.is_file():
-                        continue
-                        
-                    # Verificar que el archivo fue modificado hoy
-                    modified_time = datetime.fromtimestamp(file_path.stat().st_mtime)
-                    if modified_time.date() != today_date:
-                        continue
-                        
-                    # Generar nombre único si el archivo ya existe
-                    destination = self.output_dir / file_path.name
-                    if destination.exists():
-                        timestamp = datetime.now().strftime("%H%M%S")
-                        name_parts = file_path.name.rsplit('.', 1)
-                        new_name = f"{name_parts[0]}_{timestamp}.{name_parts[1]}"
-                        destination = self.output_dir / new_name
-                        
-                    shutil.move(str(file_path), str(destination))
-                    self.logger.info(f"Archivo movido: {file_path.name}")
-                    moved_count += 1
-                    
-                except Exception as e:
-                    self.logger.error(f"Error moviendo archivo {file_path.name}: {e}")
+        Returns:
+            bool: True si se movió; False si era un duplicado (la confirmación ya está
+                recolectada, no hay que reintentarla); None si hubo un error
+        """
+        try:
+            # Una confirmación ya recolectada no se mueve otra vez
+            filename = filename or file_path.name
+            file_hash = hash_file(file_path)
+            with self._destino_lock:
+                existente = self.indice.lookup(file_hash)
+                if existente is not None:
+                    file_path.unlink()
+                    self.indice.link(filename, existente, file_hash, "descarga JPM")
+                    self.logger.info(f"Descarga duplicada omitida: {filename} (igual a {existente.name})")
+                    return False
                     
+                # Generar nombre único si el archivo ya existe
+                destination = self._unique_destination(filename)
+                shutil.move(str(file_path), str(destination))
+                self.indice.add(destination, "descarga JPM", file_hash)
+                
+            self.logger.info(f"Archivo movido: {destination.name}")
+            return True
+            
         except Exception as e:
-            self.logger.error(f"Error en proceso de movimiento de archivos: {e}")
+            self.logger.error(f"Error moviendo archivo {file_path.name}: {e}")
+            return None
+            
+    def _classify(self, message: MensajeInfo) -> Optional[str]:
+        """
+        Clasifica un mensaje con los datos del encabezado, sin abrirlo
+        
+        Args:
+            message: Encabezado del mensaje
+            
+        Returns:
+            str: "jpm" (enlace de descarga JPM), "adjuntos" (carta adjunta) o None si no hay nada que hacer
+        """
+        if message.subject.startswith("JPM Confirmation ID"):
+            return "jpm"
+        if message.has_attachments:
+            return "adjuntos"
+        return None
+        
+    def _save_message_attachments(self, message: MensajeInfo) -> Tuple[int, bool]:
+        """
+        Guarda los adjuntos de un mensaje
+        
+        Args:
+            message: Encabezado del mensaje
+            
+        Returns:
+            tuple: (adjuntos guardados, True si ningún adjunto falló)
+        """
+        saved_count = 0
+        sin_errores = True
+        with traza.span("mensaje", "outlook", asunto=message.subject[:80]):
+            for attachment in self.buzon.iter_attachments(message.entry_id):
+                with traza.span("adjunto", "outlook", archivo=attachment.filename):
+                    guardado = self._save_attachment(attachment, message.subject)
+                    if guardado is None:
+                        sin_errores = False
+                    elif guardado:
+                        saved_count += 1
+        return saved_count, sin_errores
+        
+    def _download_http(self, url: str, code: str) -> Optional[bool]:
+        """
+        Descarga una confirmación JPM por HTTP, escribiendo el PDF directo en el directorio de salida
+        
+        Args:
+            url: URL de descarga
+            code: Código de verificación
             
-        return moved_count
+        Returns:
+            bool: True si se descargó, False si era un duplicado, None si falló (ver _collect_download)
+        """
+        try:
+            partial_path, filename = self.jpm.download(url, code, self.output_dir)
+        except Exception as e:
+            self.logger.warning(f"Descarga HTTP fallida ({e})")
+            return None
+        self.logger.info(f"Descarga HTTP completa: {filename}")
+        resultado = self._collect_download(partial_path, self._sanitize_filename(filename))
+        if resultado is None:
+            partial_path.unlink(missing_ok=True)
+        return resultado
+        
+    def _download_jpm(self, subject: str, url: str, code: str) -> Optional[bool]:
+        """
+        Descarga una confirmación JPM por HTTP o, si falla, con Selenium; corre en un hilo del pool
         
-    def process_download_links(self, messages: List[object], start: datetime, end: datetime) -> int:
+        Returns:
+            bool: True si se descargó, False si era un duplicado, None si fallaron las dos vías
+        """
+        with traza.span("descarga_jpm", "descargas", asunto=subject[:80]) as args:
+            if self.jpm is not None:
+                args["via"] = "http"
+                resultado = self._download_http(url, code)
+                if resultado is not None:
+                    return resultado
+            if webdriver is None:
+                self.logger.error("Selenium no está instalado: no hay respaldo para la descarga")
+                return None
+            args["via"] = "selenium"
+            return self._automate_download(url, code)
+            
+    def process_messages(self, messages: List[MensajeInfo], start: datetime,
+                         end: datetime) -> Tuple[int, int, List[str]]:
         """
-        Procesa correos con enlaces de descarga JPM
+        Procesa los mensajes en una sola pasada
+        
+        Cada mensaje se clasifica una vez y se abre a lo sumo una vez. Los adjuntos se
+        guardan en este hilo, porque los objetos COM de Outlook no se pueden usar desde
+        otros hilos; las descargas JPM solo usan el navegador y se envían a un pool de
+        hilos mientras se sigue con los demás mensajes. Cada hilo reutiliza una sesión
+        del pool de navegadores, que se cierra al terminar la pasada
         
         Args:
             messages: Lista de mensajes filtrados
@@ -465,49 +662,76 @@ class NDFProcessor:
             end: Fecha de fin
             
         Returns:
-            int: Número de descargas procesadas
+            tuple: (adjuntos_procesados, descargas_procesadas, EntryID de los mensajes procesados
+                sin errores; los demás deben quedar pendientes para la siguiente corrida)
         """
         if not messages:
-            return 0
+            self.logger.info("No hay correos para procesar")
+            return 0, 0, []
             
-        processed_count = 0
-        
         try:
+            attachments_processed, downloads_processed, completados = self._process_messages(messages, start, end)
+        finally:
+            self._close_webdrivers()
+            
+        self.logger.info(f"Total de adjuntos procesados: {attachments_processed}")
+        self.logger.info(f"Descargas JPM completadas: {downloads_processed}")
+        return attachments_processed, downloads_processed, completados
+        
+    def _process_messages(self, messages: List[MensajeInfo], start: datetime,
+                          end: datetime) -> Tuple[int, int, List[str]]:
+        """Pasada sobre los mensajes (ver process_messages)"""
+        attachments_processed = 0
+        downloads_processed = 0
+        completados = []
+        futures = []
+        
+        with ThreadPoolExecutor(max_workers=self.descargas_simultaneas,
+                                thread_name_prefix="descarga_jpm") as executor:
             for message in messages:
                 try:
-                    if not message.Subject.startswith("JPM Confirmation ID"):
+                    if not (start <= message.received <= end):
                         continue
                         
-                    received = message.ReceivedTime
-                    # Manejo seguro de timezone
-                    if hasattr(received, "tzinfo") and received.tzinfo is not None:
-                        received = received.replace(tzinfo=None)
-                        
-                    if not (start <= received <= end):
+                    tipo = self._classify(message)
+                    if tipo is None:
+                        completados.append(message.entry_id)
                         continue
                         
-                    url, code = self._extract_url_and_code(message.Body)
-                    
-                    if not url or not code:
-                        self.logger.warning(f"No se encontró URL o código en mensaje: {message.Subject}")
-                        continue
+                    # Un correo JPM también puede traer adjuntos; se guardan igual que los demás
+                    adjuntos_ok = True
+                    if message.has_attachments:
+                        guardados, adjuntos_ok = self._save_message_attachments(message)
+                        attachments_processed += guardados
+                        
+                    if tipo == "jpm":
+                        url, code = self._extract_url_and_code(self.buzon.get_body(message.entry_id))
+                        if url and code:
+                            futures.append((executor.submit(self._download_jpm, message.subject, url, code),
+                                            message.entry_id, adjuntos_ok))
+                            continue
+                        # Reintentar no lo arregla: el cuerpo del correo no va a cambiar
+                        self.logger.warning(f"No se encontró URL o código en mensaje: {message.subject}")
                         
-                    if self._automate_download(url, code):
-                        processed_count += 1
-                        time.sleep(2)  # Pausa entre descargas
+                    if adjuntos_ok:
+                        completados.append(message.entry_id)
                         
                 except Exception as e:
-                    self.logger.error(f"Error procesando enlace de descarga: {e}")
+                    self.logger.error(f"Error procesando mensaje: {e}")
                     continue
                     
-        except Exception as e:
-            self.logger.error(f"Error en proceso de enlaces de descarga: {e}")
-            
-        # Mover archivos descargados
-        moved_files = self._move_downloaded_files()
-        self.logger.info(f"Archivos descargados y movidos: {moved_files}")
-        
-        return processed_count
+            for future, entry_id, adjuntos_ok in futures:
+                try:
+                    # None = la descarga falló; un duplicado (False) ya está recolectado
+                    resultado = future.result()
+                    if resultado is not None:
+                        downloads_processed += int(resultado)
+                        if adjuntos_ok:
+                            completados.append(entry_id)
+                except Exception as e:
+                    self.logger.error(f"Error procesando enlace de descarga: {e}")
+                    
+        return attachments_processed, downloads_processed, completados
         
     def run(self) -> bool:
         """
@@ -516,28 +740,65 @@ class NDFProcessor:
         Returns:
             bool: True si el proceso se completó exitosamente
         """
+        if not self.trace:
+            return self._run()
+            
+        traza.enable("recoleccion")
+        inicio = traza.now_us()
+        try:
+            return self._run()
+        finally:
+            traza.record("run", "recoleccion", inicio, traza.now_us() - inicio)
+            trace_path = self.base_dir / "logs" / f"traza_recoleccion_{self.day}.json"
+            try:
+                eventos = traza.write(trace_path)
+                self.logger.info(f"Traza guardada en: {trace_path} ({eventos} eventos)")
+            except Exception as e:
+                self.logger.error(f"Error guardando traza: {e}")
+                
+    def _run(self) -> bool:
+        """Pasos del proceso completo (ver run)"""
         self.logger.info("=== Iniciando procesamiento de cartas NDF ===")
         
         # Crear directorio de salida
         if not self._create_output_directory():
             return False
             
-        # Conectar con Outlook
-        inbox = self._get_outlook_connection()
-        if not inbox:
-            return False
+        # Conectar con Outlook, salvo que se haya pasado otro buzón
+        if self.buzon is None:
+            with traza.span("conexion_outlook", "outlook"):
+                inbox = self._get_outlook_connection()
+            if not inbox:
+                return False
+            self.buzon = BuzonOutlook(inbox, logger=self.logger)
             
-        # Obtener mensajes filtrados
-        messages, start, end = self._get_filtered_messages(inbox)
-        if not messages:
+        # Obtener mensajes sin procesar
+        with traza.span("filtrar_mensajes", "outlook"):
+            messages, start, end = self._get_filtered_messages(self.buzon)
+        if start is None:
             return False
+        if not messages:
+            self.logger.info("No hay mensajes nuevos desde la última corrida")
+            return True
             
         try:
-            # Procesar adjuntos
-            attachments_processed = self.process_attachments(messages, start, end)
-            
-            # Procesar enlaces de descarga
-            downloads_processed = self.process_download_links(messages, start, end)
+            # Procesar adjuntos y enlaces de descarga en una sola pasada
+            with traza.span("mensajes", "outlook", mensajes=len(messages)):
+                attachments_processed, downloads_processed, completados = self.process_messages(
+                    messages, start, end)
+            
+            # La marca avanza solo con los mensajes procesados sin errores; los que fallaron
+            # siguen pendientes y la siguiente corrida los vuelve a intentar, hasta que
+            # agotan sus intentos y pasan a cuarentena
+            completados = set(completados)
+            fallidos = [m for m in messages if m.entry_id not in completados]
+            en_cuarentena = self.marca.advance([m for m in messages if m.entry_id in completados], fallidos)
+            for mensaje in en_cuarentena:
+                self.logger.error(f"Mensaje en cuarentena tras {self.marca.max_intentos} intentos fallidos "
+                                  f"(revisar a mano): {mensaje.subject} ({mensaje.received})")
+            if len(fallidos) > len(en_cuarentena):
+                self.logger.warning(f"{len(fallidos) - len(en_cuarentena)} mensajes con errores quedan "
+                                    f"pendientes para la próxima corrida")
             
             self.logger.info(f"=== Proceso completado ===")
             self.logger.info(f"Adjuntos procesados: {attachments_processed}")
@@ -0,0 +1,127 @@
+"""
+Trazas de ejecución en formato Chrome trace-event
+El archivo resultante se abre en Perfetto (ui.perfetto.dev) o en chrome://tracing
+y muestra cada etapa por proceso e hilo, con sus huecos y solapes
+
+Desactivado por defecto: span() no registra nada hasta llamar a enable()
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+_eventos = []
+_lock = threading.Lock()
+_hilos = set()
+_activo = False
+
+
+def now_us():
+    """Marca de tiempo en microsegundos; es reloj de pared para que coincida entre procesos"""
+    return time.time_ns() // 1000
+
+
+def enable(nombre_proceso="principal"):
+    """Activa el registro de spans en este proceso"""
+    global _activo
+    with _lock:
+        _activo = True
+        _eventos.clear()
+        _hilos.clear()
+        _eventos.append({"name": "process_name", "ph": "M", "pid": os.getpid(), "tid": 0,
+                         "args": {"name": f"{nombre_proceso} ({os.getpid()})"}})
+
+
+def enable_worker():
+    """Inicializador de los procesos del pool: descarta lo heredado del padre y activa la traza"""
+    enable("extraccion")
+
+
+def is_enabled():
+    return _activo
+
+
+def record(name, cat, ts, dur, **args):
+    """Registra un span ya medido (ts y dur en microsegundos)"""
+    if not _activo:
+        return
+    pid = os.getpid()
+    tid = threading.get_ident()
+    with _lock:
+        if (pid, tid) not in _hilos:
+            # Nombre del hilo para que Perfetto muestre "ollama_0", "render-pdf", etc.
+            _hilos.add((pid, tid))
+            _eventos.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                             "args": {"name": threading.current_thread().name}})
+        _eventos.append({"name": name, "cat": cat, "ph": "X", "ts": ts, "dur": dur,
+                         "pid": pid, "tid": tid, "args": args})
+
+
+@contextmanager
+def _span(name, cat, args):
+    inicio = now_us()
+    try:
+        yield args
+    finally:
+        record(name, cat, inicio, now_us() - inicio, **args)
+
+
+def span(name, cat="", **args):
+    """
+    Mide un bloque with como span
+
+    Los args se muestran al seleccionar el span; el dict que entrega el with
+    se puede completar dentro del bloque (p. ej. con tokens o resultados)
+    """
+    if not _activo:
+        return nullcontext({})
+    return _span(name, cat, args)
+
+
+def drain():
+    """
+    Saca los eventos registrados hasta ahora
+
+    Returns:
+        list: Eventos; se usa en los procesos del pool para devolverlos al principal
+    """
+    with _lock:
+        eventos = list(_eventos)
+        _eventos.clear()
+        _hilos.clear()
+    return eventos
+
+
+def extend(eventos):
+    """Agrega eventos registrados en otro proceso"""
+    if not _activo or not eventos:
+        return
+    with _lock:
+        _eventos.extend(eventos)
+
+
+def write(path):
+    """
+    Escribe la traza en formato JSON de Chrome trace-event
+
+    Returns:
+        int: Número de eventos escritos
+    """
+    with _lock:
+        eventos = list(_eventos)
+    # drain() hace que cada proceso repita el nombre de sus hilos; basta uno por hilo
+    vistos = set()
+    unicos = []
+    for evento in eventos:
+        if evento["ph"] == "M":
+            clave = (evento["name"], evento["pid"], evento["tid"])
+            if clave in vistos:
+                continue
+            vistos.add(clave)
+        unicos.append(evento)
+    eventos = unicos
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": eventos, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+    return len(eventos)